@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -92,6 +93,24 @@ DATABASES = {
 }
 
 
+# The ACL and the approximate list counts are cached and forgotten by
+# whatever process changed them, so the default cache has to be one every
+# web and worker process sees. A local memory cache is one per process and
+# acl.py refuses it (taskMaster.E001). Migration 0020 makes the table.
+# The search versions live there too, only the result bodies sit in the
+# local "search" cache, see search.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'taskmaster_cache',
+    },
+    'search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'search',
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -137,6 +156,13 @@ STATIC_URL = '/static/'
 SITE_ID = 1
 
 REST_FRAMEWORK = {
+    # orjson and msgpack are optional, FastJSONRenderer falls back to the
+    # stdlib on its own and MessagePackRenderer is only added if it can work.
+    'DEFAULT_RENDERER_CLASSES': (
+        'taskMaster.api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ) + (('taskMaster.api.renderers.MessagePackRenderer',)
+         if find_spec('msgpack') else ()),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
@@ -151,6 +177,49 @@ REST_FRAMEWORK = {
     'MAX_PAGINATE_BY': 100
 }
 
+# Seconds a search result stays cached. Changes to anything the user can see
+# invalidate it sooner in every process, through versions in the default
+# cache, see search.py.
+SEARCH_CACHE_TIMEOUT = 60
+
+# Seconds a users cached ACL (the lists he can reach and administer) lives.
+# Relation and owner changes drop it right away, this is just a backstop.
+ACL_CACHE_TIMEOUT = 300
+
+# Seconds the approximate total of a cursor paginated list (count=approx)
+# is cached.
+LIST_COUNT_CACHE_TIMEOUT = 60
+
+# View counts are buffered in memory and written every this many seconds,
+# or sooner once this many rows have pending views. See viewcounts.py.
+VIEW_COUNT_FLUSH_INTERVAL = 10
+VIEW_COUNT_FLUSH_SIZE = 500
+
+# Notifications are delivered by manage.py notification_worker (see the
+# Procfile). Set this to deliver them from a thread pool of that size in
+# the web process instead, handy when there is no worker dyno.
+NOTIFICATION_WORKER_THREADS = int(os.environ.get(
+    'NOTIFICATION_WORKER_THREADS', 0))
+
+# An event that failed this many deliveries is left in the outbox table for
+# somebody to look at instead of being retried forever.
+NOTIFICATION_MAX_ATTEMPTS = 5
+
+# Longest a Notifications/stream/ request is held open, and how often a held
+# request looks for notifications written by other processes (the worker
+# and the other gunicorn workers, wakeup.py only reaches its own process).
+# Each held request ties up a gthread thread, see --threads in the Procfile.
+NOTIFICATION_STREAM_TIMEOUT = 25
+NOTIFICATION_STREAM_POLL = 5
+
+# manage.py prune_notifications deletes seen notifications older than this
+# many days. Unseen ones are kept unless the second setting is a number.
+NOTIFICATION_RETENTION_DAYS = 90
+NOTIFICATION_UNSEEN_RETENTION_DAYS = None
+
+# Rows a Sync/ page returns when the client doesnt pass a limit.
+SYNC_PAGE_SIZE = 100
+
 # Heroku: Update database configuration from $DATABASE_URL.
 import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
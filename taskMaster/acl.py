@@ -0,0 +1,80 @@
+""" This is acl.py and it keeps a cached answer to "which lists can this
+user reach and which of them can he administer". The list view, SearchAPI
+and every permission check used to work that out from UserListRelation on
+each request, now they read it from the Django cache and only rebuild it
+after the receivers in models.py forgot it because a TaskList or a
+UserListRelation of the user changed. That only works if every process
+shares the cache, see check_shared_cache. """
+from django.apps import apps
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db.models import Q
+
+# Above this many lists reachable_by goes back to a subquery instead of
+# pk__in, sqlite refuses statements with more than 999 parameters.
+MAX_IN_IDS = 500
+
+
+def _key(user_id):
+    return "acl:%s" % user_id
+
+
+def build(user_id):
+    """ {list id: (member, admin)} for every list user_id reaches, from one
+    query. Lists reached only through a relation the user made for somebody
+    else are (False, False), the user sees them in lists and search but the
+    permission classes dont count him as related. """
+    TaskList = apps.get_model("taskMaster", "TaskList")
+    rows = TaskList.objects.filter(
+        Q(owner_id=user_id) | Q(userlistrelation__user_id=user_id) |
+        Q(userlistrelation__owner_id=user_id)).values_list(
+        "pk", "owner_id", "userlistrelation__user_id",
+        "userlistrelation__owner_id", "userlistrelation__role")
+
+    acl = dict()
+    for list_id, list_owner, user, owner, role in rows:
+        member, admin = acl.get(list_id, (False, False))
+        if list_owner == user_id:
+            member, admin = True, True
+        elif user == user_id:
+            member = True
+            admin = admin or owner == user_id or \
+                (role or "").lower() == "admin"
+        acl[list_id] = (member, admin)
+    return acl
+
+
+def load(user_id):
+    """ The cached ACL of user_id, built on a miss. """
+    acl = cache.get(_key(user_id))
+    if acl is None:
+        acl = build(user_id)
+        cache.set(_key(user_id), acl,
+                  getattr(settings, "ACL_CACHE_TIMEOUT", 300))
+    return acl
+
+
+def forget(user_ids):
+    """ Drops the cached ACL of every user in user_ids. """
+    keys = [_key(user_id) for user_id in user_ids if user_id is not None]
+    if keys:
+        cache.delete_many(keys)
+
+
+@checks.register()
+def check_shared_cache(app_configs, **kwargs):
+    """ forget() only reaches the cache of the process it runs in. With a
+    local memory cache the other gunicorn workers would keep serving the old
+    ACL, and with it lists the user was just removed from, until it times
+    out. """
+    backend = settings.CACHES.get("default", {}).get("BACKEND", "")
+    if backend.endswith("locmem.LocMemCache"):
+        return [checks.Error(
+            "The default cache is local to each process, so cached ACLs, "
+            "list counts and search versions outlive their invalidation in "
+            "the others.",
+            hint="Point CACHES['default'] at a shared backend such as "
+                 "the database cache or memcached.",
+            id="taskMaster.E001")]
+    return []
@@ -0,0 +1,203 @@
+""" This is conditional.py and it answers If-None-Match and
+If-Modified-Since with a 304 before anything gets serialized. The validators
+come from one aggregate query: date_created (which is auto_now, so it is
+really a modified time) of the object or collection, plus the newest
+date_created and the number of rows of each child relation that shows up in
+the response. View counts are left out, they change on every read.
+
+The child values are correlated subqueries, one per child relation, rather
+than joins. Joining two children multiplies their rows, a list with 100
+tasks and 100 comments made the aggregate walk 10000 rows.
+
+A deleted row leaves no date_created behind, so Last-Modified of anything
+with children or of a collection also takes the newest Tombstone of the
+lists involved. A representation no tombstone covers sends no Last-Modified
+and only answers If-None-Match. """
+import hashlib
+from django.db.models import Count, DateTimeField, IntegerField, Max, \
+    OuterRef, Q, Subquery, Sum
+from django.db.models import prefetch_related_objects
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, \
+    quote_etag
+from rest_framework import status
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from taskMaster.models import TaskList, Tombstone, UserListRelation
+
+
+class ConditionalMixin(object):
+    # Reverse relations whose rows are part of the representation.
+    validator_children = ()
+    # Fields besides date_created that change without bumping it.
+    validator_fields = ()
+    # Path from the model to the pk of its list, whose tombstones tell
+    # Last-Modified about deleted rows. None for models outside lists.
+    tombstone_list = None
+
+    def validator_annotations(self, model, prefix="_etag_"):
+        """ The newest date_created and the row count of every child of
+        model, as subqueries against the row they annotate. """
+        annotations = dict()
+        for child in self.validator_children:
+            relation = model._meta.get_field(child)
+            rows = relation.related_model.objects.filter(**{
+                relation.field.name: OuterRef("pk")}) \
+                .order_by().values(relation.field.name)
+            annotations[prefix + child + "_modified"] = Subquery(
+                rows.annotate(modified=Max("date_created"))
+                .values("modified"), output_field=DateTimeField())
+            annotations[prefix + child + "_count"] = Subquery(
+                rows.annotate(count=Count("pk")).values("count"),
+                output_field=IntegerField())
+        return annotations
+
+    def validators(self, values):
+        """ (ETag, last modified) of the validator values. The request's
+        query and media type go into the ETag too, ?fields= or a different
+        renderer make a different representation. The ETag is weak since
+        the views in the body arent part of it. """
+        modified = [value for name, value in sorted(values.items())
+                    if (name == "date_created" or name.endswith("modified"))
+                    and value is not None]
+        digest = hashlib.md5(repr((
+            sorted(values.items()), self.request.user.pk,
+            sorted(self.request.query_params.lists()),
+            self.request.accepted_media_type)).encode("utf-8")).hexdigest()
+        return "W/" + quote_etag(digest), max(modified) if modified else None
+
+    def not_modified(self, etag, last_modified):
+        request = self.request
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            # If-None-Match uses the weak comparison.
+            etags = [tag[2:] if tag.startswith("W/") else tag
+                     for tag in parse_etags(if_none_match)]
+            return "*" in etags or etag[2:] in etags
+        since = parse_http_date_safe(
+            request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+        return since is not None and last_modified is not None and \
+            int(last_modified.timestamp()) <= since
+
+    def newest_tombstone(self, lists):
+        """ Subquery for the date_created of the newest tombstone in lists,
+        a pk or a queryset of them. For a queryset the ones addressed to
+        the user count too. """
+        if hasattr(lists, "query"):
+            # Lists the user lost dont show up in lists any more.
+            lookup = Q(user=None, list_id__in=lists) | \
+                Q(user=self.request.user)
+        else:
+            lookup = Q(user=None, list_id=lists)
+        return Subquery(Tombstone.objects.filter(lookup)
+                        .order_by("-date_created").values("date_created")[:1],
+                        output_field=DateTimeField())
+
+    def conditional_response(self, values, render, dated=True):
+        """ 304 if the client has the representation values describe, else
+        render() as a Response. Both carry ETag and, if dated, Last-Modified.
+        """
+        etag, last_modified = self.validators(values)
+        if not dated:
+            last_modified = None
+        if self.not_modified(etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = render()
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
+
+
+class ConditionalRetrieveMixin(ConditionalMixin):
+    """ For the RUD views. load_object() replaces the get_object_or_404 +
+    check_object_permissions pair; on GET it fetches the object with its
+    validators and holds the queryset's prefetches back until the body is
+    actually needed. """
+    deferred_lookups = ()
+
+    def load_object(self):
+        queryset = self.get_queryset()
+        if self.request.method == "GET":
+            self.deferred_lookups = queryset._prefetch_related_lookups
+            queryset = queryset.prefetch_related(None) \
+                .annotate(**self.validator_annotations(queryset.model))
+            if self.validator_children and self.tombstone_list:
+                queryset = queryset.annotate(
+                    _etag_deleted_modified=self.newest_tombstone(
+                        OuterRef(self.tombstone_list)))
+        obj = get_object_or_404(queryset, pk=self.kwargs["pk"])
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def retrieve(self, request, *args, **kwargs):
+        obj = self.get_object()
+        values = dict((name, getattr(obj, name)) for name in
+                      ("pk", "date_created") + tuple(self.validator_fields))
+        for name in self.validator_annotations(type(obj)):
+            values[name[len("_etag_"):]] = getattr(obj, name)
+        if hasattr(obj, "_etag_deleted_modified"):
+            values["deleted_modified"] = obj._etag_deleted_modified
+
+        def render():
+            prefetch_related_objects([obj], *self.deferred_lookups)
+            return Response(self.get_serializer(obj).data)
+        # Children can be deleted without a trace in the row itself.
+        return self.conditional_response(
+            values, render, dated=not self.validator_children or
+            hasattr(obj, "_etag_deleted_modified"))
+
+
+class ConditionalListMixin(ConditionalMixin):
+    """ For the list views, the collection ETag covers the row count and
+    newest date_created of the whole filtered queryset, not just the page,
+    so it is one aggregate query and a 304 skips the page queries. The
+    count is handed to the paginator so page numbers cost no extra COUNT.
+    Cursor pages skip all of it, the point of them is to never count. """
+    # More aggregates for changes that dont bump date_created.
+    validator_aggregates = dict()
+
+    def list(self, request, *args, **kwargs):
+        paginator = self.paginator
+        if getattr(paginator, "is_cursor_request", None) and \
+                paginator.is_cursor_request(request):
+            return super(ConditionalListMixin, self).list(
+                request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        children = self.validator_annotations(queryset.model)
+        if self.tombstone_list:
+            children["_etag_deleted_modified"] = self.newest_tombstone(
+                self.tombstone_lists())
+        totals = dict()
+        for name in children:
+            aggregate = Max if name.endswith("_modified") else Sum
+            totals[name[len("_etag_"):]] = aggregate(name)
+        values = queryset.prefetch_related(None).order_by() \
+            .annotate(**children).aggregate(
+                count=Count("pk", distinct=True),
+                modified=Max("date_created"),
+                **dict(totals, **self.validator_aggregates))
+        if paginator is not None:
+            paginator.known_count = values["count"]
+        return self.conditional_response(
+            values, lambda: self.render_list(queryset),
+            dated=bool(self.tombstone_list))
+
+    def tombstone_lists(self):
+        """ Every list the user reaches, as SQL so the ACL isnt read again.
+        The rows of the collection arent enough, a list whose last row got
+        deleted has none left in it. """
+        user = self.request.user
+        return TaskList.objects.filter(
+            Q(owner=user) | Q(pk__in=UserListRelation.objects.filter(
+                Q(user=user) | Q(owner=user)).values("LinkedTaskList"))) \
+            .values("pk")
+
+    def render_list(self, queryset):
+        # ListModelMixin.list without its second get_queryset(), which
+        # would read the ACL from the cache again.
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
@@ -0,0 +1,48 @@
+""" This is membership.py and it answers "is the caller related to / an
+admin of this list" once per list and request. The permission classes and
+the views used to call TaskList.has_user_relation and user_is_admin back to
+back and each of those ran its own UserListRelation query. The answers come
+from the users cached ACL, see taskMaster/acl.py. """
+from taskMaster import acl
+
+
+class Membership(object):
+    """ Resolves (member, admin) per list for one user. Same rules as
+    TaskList.has_user_relation and user_is_admin: the list owner is both,
+    any relation makes the user a member and a relation with the admin role,
+    or one the user made himself, makes him an admin. """
+
+    def __init__(self, user):
+        self.user = user
+        self.acl = None
+
+    def resolve(self, task_list):
+        """ task_list is a TaskList or its pk. Reads the ACL at most once
+        per request and not at all if the user owns the TaskList given. """
+        try:  # request.data hands us pks as strings.
+            list_id = int(getattr(task_list, "pk", task_list))
+        except (TypeError, ValueError):
+            return False, False
+        if self.user is None or self.user.pk is None:
+            return False, False
+        if getattr(task_list, "owner_id", None) == self.user.pk:
+            return True, True
+        if self.acl is None:
+            self.acl = acl.load(self.user.pk)
+        return self.acl.get(list_id, (False, False))
+
+    def is_member(self, task_list):
+        return self.resolve(task_list)[0]
+
+    def is_admin(self, task_list):
+        return self.resolve(task_list)[1]
+
+
+def membership(request):
+    """ Returns the Membership of request.user, making it on first use so
+    every permission class and the view share the answers. """
+    resolver = getattr(request, "_membership", None)
+    if resolver is None or resolver.user is not request.user:
+        resolver = Membership(request.user)
+        request._membership = resolver
+    return resolver
@@ -0,0 +1,457 @@
+""" This is pagination.py and it holds the paginators that DRF doesnt ship.
+SearchPager pages through the four SearchAPI querysets as if they were one
+globally ordered result set, without ever loading more rows than the
+requested page needs. SyncPager walks the changes of a user for Sync/ the
+same way and ListPagination is what the list views page with. """
+import hashlib
+import heapq
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict, defaultdict
+from itertools import islice
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class SearchPager(object):
+    """
+    Lazily merges a list of querysets (one per model) into one ordering and
+    returns a single page of it. Every queryset is ordered by (field, pk) in
+    SQL and only the head of each one is fetched, heapq.merge does the rest.
+
+    Items are compared on (value, rank, pk) where rank is the position of the
+    queryset in the list, so ties between models are broken the same way on
+    every page. Without an order the value is constant and the result is the
+    querysets one after the other, which is what the search always returned.
+
+    next and previous are keyset cursors holding the (value, rank, pk) of the
+    first or last item on the page. The old page=N parameter still works for
+    the first jump, it just costs an OFFSET.
+
+    Relevance has no stable key to seek on, so when a ranker is given the
+    pager asks it for the best offset + page_size hits and cursors carry an
+    offset instead. ranker(limit) returns (score, model name, pk) tuples.
+    """
+    cursor_query_param = "cursor"
+    page_query_param = "page"
+    invalid_cursor_message = "Invalid cursor"
+    invalid_page_message = "Invalid page."
+
+    # order parameter -> (model field, descending)
+    orderings = {
+        "views": ("views", False),
+        "-views": ("views", True),
+        "date": ("date_created", False),
+        "-date": ("date_created", True),
+    }
+
+    def __init__(self, querysets, order=None, page_size=None, ranker=None):
+        self.querysets = list(querysets)
+        self.field, self.descending = self.orderings.get(order, (None, False))
+        self.page_size = page_size or api_settings.PAGE_SIZE
+        self.ranker = ranker
+        self.next_position = None
+        self.previous_position = None
+        self.next_offset = None
+        self.previous_offset = None
+
+    def paginate(self, request):
+        """ Returns the page as a list of (value, rank, pk) tuples. """
+        self.request = request
+        if self.ranker is not None:
+            return self.paginate_ranked(request)
+        position, reverse, offset = self.decode_cursor(request)
+        if position is None and offset == 0:
+            offset = (self.get_page_number(request) - 1) * self.page_size
+
+        # Reverse cursors walk backwards from the first item of a page.
+        ascending = self.descending is reverse
+        limit = offset + self.page_size + 1
+        streams = [self.stream(rank, queryset, position, ascending, limit)
+                   for rank, queryset in enumerate(self.querysets)]
+        merged = list(islice(heapq.merge(*streams, reverse=not ascending),
+                             offset, limit))
+
+        page = merged[:self.page_size]
+        has_more = len(merged) > self.page_size
+        if reverse:
+            page.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next = has_more
+            has_previous = position is not None or offset > 0
+
+        if page and has_next:
+            self.next_position = page[-1]
+        if page and has_previous:
+            self.previous_position = page[0]
+        return page
+
+    def paginate_ranked(self, request):
+        position, reverse, offset = self.decode_cursor(request)
+        if request.query_params.get(self.cursor_query_param) is None:
+            offset = (self.get_page_number(request) - 1) * self.page_size
+
+        ranks = dict((queryset.model.__name__, rank)
+                     for rank, queryset in enumerate(self.querysets))
+        hits = self.ranker(offset + self.page_size + 1)
+        page = [(score, ranks[kind], pk) for score, kind, pk in
+                hits[offset:offset + self.page_size]]
+        if len(hits) > offset + self.page_size:
+            self.next_offset = offset + self.page_size
+        if offset > 0:
+            self.previous_offset = max(offset - self.page_size, 0)
+        return page
+
+    def stream(self, rank, queryset, position, ascending, limit):
+        ordering = [name for name in (self.field, "pk") if name]
+        if not ascending:
+            ordering = ["-" + name for name in ordering]
+        queryset = queryset.order_by(*ordering)
+
+        if position is not None:
+            lookup = self.keyset_filter(rank, position, ascending)
+            if lookup is None:
+                return []
+            queryset = queryset.filter(lookup)
+
+        if self.field is None:
+            return [(0, rank, pk) for pk in
+                    queryset.values_list("pk", flat=True)[:limit]]
+        return [(value, rank, pk) for pk, value in
+                queryset.values_list("pk", self.field)[:limit]]
+
+    def keyset_filter(self, rank, position, ascending):
+        """ Q object for the rows of queryset rank that sort after position,
+        or None if none of them can. """
+        value, last_rank, last_pk = position
+        direction = "gt" if ascending else "lt"
+        if rank == last_rank:
+            tie = Q(**{"pk__" + direction: last_pk})
+        elif (rank > last_rank) is ascending:
+            tie = Q()
+        else:
+            tie = None
+
+        if self.field is None:
+            return tie
+        after = Q(**{"%s__%s" % (self.field, direction): value})
+        if tie is None:
+            return after
+        return after | (Q(**{self.field: value}) & tie)
+
+    def get_page_number(self, request):
+        try:
+            page = int(request.query_params.get(self.page_query_param, 1))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_page_message)
+        if page < 1:
+            raise NotFound(self.invalid_page_message)
+        return page
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def decode_cursor(self, request):
+        """ Returns (position, reverse, offset) of the cursor parameter. """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False, 0
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+            position = tokens.get("p")
+            if position is not None:
+                value, rank, pk = position
+                # The value goes into a filter on self.field, so it has to
+                # be one or the query blows up instead of the cursor.
+                if self.field == "date_created":
+                    value = parse_datetime(value)
+                    if value is None:
+                        raise ValueError()
+                elif self.field is not None:
+                    value = int(value)
+                position = (value, int(rank), int(pk))
+            offset = int(tokens.get("o", 0))
+            if offset < 0:
+                raise ValueError()
+            return position, bool(tokens.get("r")), offset
+        except (TypeError, ValueError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse=False, offset=0):
+        url = remove_query_param(self.request.build_absolute_uri(),
+                                 self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.cursor_token(position, reverse,
+                                                     offset))
+
+    def cursor_token(self, position, reverse=False, offset=0):
+        tokens = dict()
+        if position is not None:
+            value, rank, pk = position
+            if hasattr(value, "isoformat"):
+                value = value.isoformat()
+            tokens["p"] = [value, rank, pk]
+        if reverse:
+            tokens["r"] = 1
+        if offset:
+            tokens["o"] = offset
+        return urlsafe_b64encode(json.dumps(tokens).encode("ascii")) \
+            .decode("ascii")
+
+    def get_next_link(self):
+        if self.next_offset is not None:
+            return self.encode_cursor(None, offset=self.next_offset)
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_previous_link(self):
+        if self.previous_offset is not None:
+            return self.encode_cursor(None, offset=self.previous_offset)
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_results(self, page):
+        """ Groups the page by model name, the shape SearchAPI always had.
+        """
+        results = defaultdict(list)
+        for value, rank, pk in page:
+            model = self.querysets[rank].model
+            results[model.__name__].append(
+                model(pk=pk).get_api_url(self.request))
+        return results
+
+    def get_paginated_response(self, page):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("count", self.count()),
+            ("results", self.get_results(page)),
+        ]))
+
+
+class SyncPager(SearchPager):
+    """
+    Walks everything a user can reach oldest change first, for Sync/. It is
+    a SearchPager ordered on date_created, so the querysets are merged on
+    (date_created, rank, pk) and every page costs one bounded query per
+    queryset, but the page comes back as serialized rows instead of links.
+
+    serializers has one serializer class per queryset, None marks the
+    Tombstone queryset whose rows are returned as deletes. cursor in the
+    response is where the walk got to, a client keeps it and sends it back
+    to only get what changed since.
+    """
+    max_page_size = 500
+
+    def __init__(self, querysets, serializers, page_size=None):
+        super(SyncPager, self).__init__(
+            querysets, order="date",
+            page_size=min(page_size or api_settings.PAGE_SIZE,
+                          self.max_page_size))
+        self.serializers = serializers
+
+    def paginate(self, request):
+        self.position, reverse, offset = self.decode_cursor(request)
+        if reverse or offset:
+            raise NotFound(self.invalid_cursor_message)
+        self.start = self.position
+        page = super(SyncPager, self).paginate(request)
+        if page:
+            self.position = page[-1]
+        return page
+
+    def get_results(self, page):
+        """ Returns (upserts, deletes) of the page, the upserts grouped by
+        model name and in the order they changed. """
+        pks = defaultdict(list)
+        for value, rank, pk in page:
+            pks[rank].append(pk)
+
+        upserts, deletes = OrderedDict(), []
+        for rank, queryset in enumerate(self.querysets):
+            if not pks[rank]:
+                continue
+            queryset = queryset.filter(pk__in=pks[rank]) \
+                .order_by("date_created", "pk")
+            serializer = self.serializers[rank]
+            if serializer is None:
+                deletes.extend({"type": kind, "pk": object_id}
+                               for kind, object_id in
+                               queryset.values_list("kind", "object_id"))
+                continue
+            if hasattr(serializer, "prefetch_lookups"):
+                queryset = queryset.prefetch_related(
+                    *serializer.prefetch_lookups(
+                        serializer.requested_fields(self.request)))
+            upserts[queryset.model.__name__] = serializer(
+                queryset, many=True, context={"request": self.request}).data
+        return upserts, deletes
+
+    def get_paginated_response(self, page, resync=()):
+        """ resync are the pks of lists the client has to fetch whole, their
+        older rows are behind the cursor. """
+        upserts, deletes = self.get_results(page)
+        return Response(OrderedDict([
+            ("cursor", self.cursor_token(self.position)
+             if self.position is not None else None),
+            ("next", self.get_next_link()),
+            ("upserts", upserts),
+            ("deletes", deletes),
+            ("resync", list(resync)),
+        ]))
+
+
+class ListPagination(PageNumberPagination):
+    """
+    PageNumberPagination with a cursor mode a request can pick. ?page=N
+    works like it always did. ?pagination=cursor (and then the cursor links
+    it returns) pages newest first on (date_created, pk) with a keyset
+    filter instead, so a page costs the same however deep it is and there
+    is no COUNT. Add count=approx for a total that is cached for
+    LIST_COUNT_CACHE_TIMEOUT seconds.
+
+    date_created is auto_now, so a row edited while a client pages moves to
+    the front and is not seen again by that walk.
+    """
+    cursor_query_param = "cursor"
+    mode_query_param = "pagination"
+    count_query_param = "count"
+    invalid_cursor_message = "Invalid cursor"
+    ordering = ("date_created", "pk")
+
+    # Total the view already knows (see ConditionalListMixin), saves the
+    # page number mode its COUNT.
+    known_count = None
+
+    def django_paginator_class(self, object_list, per_page):
+        paginator = DjangoPaginator(object_list, per_page)
+        if self.known_count is not None:
+            paginator.count = self.known_count
+        return paginator
+
+    def is_cursor_request(self, request):
+        return request.query_params.get(self.cursor_query_param) is not None \
+            or request.query_params.get(self.mode_query_param) == "cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.is_cursor_request(request)
+        if not self.cursor_mode:
+            return super(ListPagination, self).paginate_queryset(
+                queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.approximate_count = None
+        if request.query_params.get(self.count_query_param) == "approx":
+            self.approximate_count = self.get_approximate_count(queryset)
+
+        position, reverse = self.decode_cursor(request)
+        # Newest first, a reverse cursor walks back up from a page.
+        descending = not reverse
+        ordering = ["-" + name if descending else name
+                    for name in self.ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position,
+                                                          descending))
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_position = self.position(page[-1]) \
+            if page and has_next else None
+        self.previous_position = self.position(page[0]) \
+            if page and has_previous else None
+        return page
+
+    def position(self, obj):
+        return tuple(getattr(obj, name) for name in self.ordering)
+
+    def keyset_filter(self, position, descending):
+        (field, last_value), (tie, last_pk) = zip(self.ordering, position)
+        direction = "lt" if descending else "gt"
+        return Q(**{"%s__%s" % (field, direction): last_value}) | \
+            Q(**{field: last_value, "%s__%s" % (tie, direction): last_pk})
+
+    def decode_cursor(self, request):
+        """ Returns (position, reverse) of the cursor parameter. """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+            value = parse_datetime(tokens["d"])
+            if value is None:
+                raise ValueError()
+            return (value, int(tokens["p"])), bool(tokens.get("r"))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse=False):
+        value, pk = position
+        tokens = {"d": value.isoformat(), "p": pk}
+        if reverse:
+            tokens["r"] = 1
+        encoded = urlsafe_b64encode(json.dumps(tokens).encode("ascii"))
+        url = remove_query_param(self.request.build_absolute_uri(),
+                                 self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   encoded.decode("ascii"))
+
+    def get_approximate_count(self, queryset):
+        """ COUNT of queryset, shared by every request with the same SQL
+        for LIST_COUNT_CACHE_TIMEOUT seconds. It lives in the default cache,
+        which is the database one in settings.CACHES and so shared by every
+        process. Point that at a locmem cache and each process keeps its own
+        counts, which only makes them stale for longer. """
+        sql, params = queryset.query.sql_with_params()
+        key = "listcount:%s" % hashlib.md5(
+            ("%s%r" % (sql, params)).encode("utf-8")).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count,
+                      getattr(settings, "LIST_COUNT_CACHE_TIMEOUT", 60))
+        return count
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super(ListPagination, self).get_next_link()
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super(ListPagination, self).get_previous_link()
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super(ListPagination, self).get_paginated_response(data)
+        response = OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+        ])
+        if self.approximate_count is not None:
+            response["count"] = self.approximate_count
+        response["results"] = data
+        return Response(response)
@@ -1,8 +1,8 @@
 from rest_framework import permissions, status
 from rest_framework.response import Response
 
-from taskMaster.models import TaskList, UserListRelation, Task, \
-    TaskComment, TaskListComment
+from taskMaster.models import Task, TaskComment, TaskListComment
+from .membership import membership
 
 
 class IsAdminOrUserRelatedReadOnlyOr401(permissions.BasePermission):
@@ -16,11 +16,12 @@ class IsAdminOrUserRelatedReadOnlyOr401(permissions.BasePermission):
     as "admin" without the marks, or the owner himself.
     """
     def has_object_permission(self, request, view, obj):
+        member, admin = membership(request).resolve(obj)
         if request.method in permissions.SAFE_METHODS:
-            if obj.has_user_relation(obj, request.user) is True:
+            if member is True:
                 return True
 
-        if obj.user_is_admin(obj, request.user) is True:
+        if admin is True:
             return True
 
         return False
@@ -29,8 +30,7 @@ class IsAdminOrUserRelatedReadOnlyOr401(permissions.BasePermission):
 class IsTaskListRelatedOr401(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if type(obj) in (Task, TaskComment, TaskListComment):
-            if obj.LinkedTaskList.has_user_relation(obj.LinkedTaskList,
-                                                    request.user):
+            if membership(request).is_member(obj.LinkedTaskList_id):
                 if request.method in permissions.SAFE_METHODS:
                     return True  # Allow view only.
             else:
@@ -51,18 +51,18 @@ class CRUDOnlyRelatedTaskList(permissions.BasePermission):
     """
     def has_object_permission(self, request, view, obj):
         # Restricted field manipulation should get rejected at runtime.
-        Task_list = obj.LinkedTaskList
+        resolver = membership(request)
         if request.data.get('LinkedTaskList') is not None:
-            temp = TaskList.objects.get(pk=request.data.get('LinkedTaskList'))
-            if temp.user_is_admin(temp, request.user) is True:
+            if resolver.is_admin(request.data.get('LinkedTaskList')) is True:
                 return True  # User is an admin or owner of the new list.
             else:
                 return False
 
-        if Task_list.has_user_relation(Task_list, request.user) is True:
+        member, admin = resolver.resolve(obj.LinkedTaskList_id)
+        if member is True:
             if request.method in permissions.SAFE_METHODS:
                 return True  # Allow view only.
-            if Task_list.user_is_admin(Task_list, request.user) is True:
+            if admin is True:
                 return True  # Allow edit.
 
         return False
@@ -77,7 +77,6 @@ class CRUDTaskComments(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # Get the relevant LinkedTaskList and from there find auth.
         task = obj.LinkedTask
-        Task_list = task.LinkedTaskList
         if request.data.get('LinkedTask') is not None:
             task = Task.objects.get(pk=request.data.get('LinkedTask'))
             if task.owner == request.user:
@@ -85,7 +84,7 @@ class CRUDTaskComments(permissions.BasePermission):
             else:
                 return False
 
-        if Task_list.has_user_relation(Task_list, request.user) is True:
+        if membership(request).is_member(task.LinkedTaskList_id) is True:
             if request.method in permissions.SAFE_METHODS:
                 return True  # Allow view only.
             if obj.owner == request.user:
@@ -101,18 +100,18 @@ class CRUDTaskListComments(permissions.BasePermission):
     you can get returned false. """
     def has_object_permission(self, request, view, obj):
         # Get the relevant LinkedTaskList and from there find auth.
-        Task_list = obj.LinkedTaskList
+        resolver = membership(request)
         if request.data.get('LinkedTaskList') is not None:
-            temp = TaskList.objects.get(pk=request.data.get('LinkedTaskList'))
-            if temp.user_is_admin(temp, request.user) is True:
+            if resolver.is_admin(request.data.get('LinkedTaskList')) is True:
                 return True  # User is an admin or owner of the new list.
             else:
                 return False
 
-        if Task_list.has_user_relation(Task_list, request.user) is True:
+        member, admin = resolver.resolve(obj.LinkedTaskList_id)
+        if member is True:
             if request.method in permissions.SAFE_METHODS:
                 return True  # Allow view only.
-            if Task_list.user_is_admin(Task_list, request.user) is True:
+            if admin is True:
                 return True  # Allow edit.
 
         if obj.owner == request.user:
@@ -129,11 +128,11 @@ class CRUDUserListRelation(permissions.BasePermission):
     It will grant object level permission to the owner or admin only.
     """
     def has_object_permission(self, request, view, obj):
-        temp = obj.LinkedTaskList
+        temp = obj.LinkedTaskList_id
         if request.data.get('LinkedTaskList') is not None:
             # Remarks temp so that it may fail at the bottom. No need to
             # Check immediately.
-            temp = TaskList.objects.get(pk=request.data.get('LinkedTaskList'))
+            temp = request.data.get('LinkedTaskList')
 
         # Checks if user is owner in order to alter owner field.
         if request.data.get("owner") is not None:
@@ -144,10 +143,11 @@ class CRUDUserListRelation(permissions.BasePermission):
         if obj.owner == request.user:
             return True  # Edit access granted to owner of model.
 
-        if temp.has_user_relation(temp, request.user) is True:
+        member, admin = membership(request).resolve(temp)
+        if member is True:
             if request.method in permissions.SAFE_METHODS is True:
                 return True  # Read only access granted by to a non admin
             else:
-                if temp.user_is_admin(temp, request.user) is True:
+                if admin is True:
                     return True
         return False
@@ -0,0 +1,83 @@
+""" This is renderers.py and it holds the renderers registered in the
+REST_FRAMEWORK settings. FastJSONRenderer writes the same bytes as DRF's
+JSONRenderer but lets orjson do the encoding when it is installed, and
+MessagePackRenderer answers clients that send Accept: application/msgpack.
+Both are optional at runtime, see the settings. """
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """ JSONRenderer on orjson, falling back to the stdlib encoder when
+    orjson isnt installed, when the client asks for an indent, or when the
+    JSON settings ask for something orjson doesnt do (ascii-only output,
+    spaced separators or NaN). Datetimes are
+    passed through to DRF's encoder so they keep DRF's formatting. """
+
+    def __init__(self):
+        self.encoder = self.encoder_class()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or \
+                not self.compact or not self.strict:
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+        indent = self.get_indent(accepted_media_type,
+                                 renderer_context or {})
+        if indent is not None:
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder.default,
+                           option=orjson.OPT_NON_STR_KEYS |
+                           orjson.OPT_PASSTHROUGH_DATETIME)
+        # Same javascript-subset escaping as JSONRenderer.
+        if b"\xe2\x80" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028") \
+                .replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    """ Compact binary rendering for clients sending
+    Accept: application/msgpack. Anything msgpack cant pack natively goes
+    through DRF's JSON encoder first, so values look like they do in JSON.
+    Only registered when msgpack is installed. """
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def __init__(self):
+        self.encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return msgpack.packb(data, default=self.encoder.default,
+                             use_bin_type=True)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """ Lets Notifications/stream/ accept Accept: text/event-stream. The
+    view writes the stream itself, this only renders the errors that can
+    happen before it starts, as a single error event. """
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return b"event: error\ndata: " + \
+            FastJSONRenderer().render(data) + b"\n\n"
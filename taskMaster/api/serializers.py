@@ -7,18 +7,78 @@ but you have to have them. The configuration varies little but i have
 explained the UserSerializer futher below as its the only one that actually
 deviates. """
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
+from taskMaster import viewcounts
 from taskMaster.models import TaskList, Task, TaskListComment, TaskComment, \
     UserListRelation, Notification
+from .urlfactory import url_factory
 
 
-class TaskListSerializer(serializers.ModelSerializer):  # forms.ModelForm
+class SparseFieldsMixin(object):
+    """ Lets a GET pick its fields with ?fields=pk,title or drop some with
+    ?omit=tasks,comments. Fields that arent wanted are removed from the
+    serializer before anything is serialized, so their SerializerMethodField
+    never runs, and the views ask requested_fields() which prefetches they
+    still need. Writes always get the full serializer. """
+
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        request = self.context.get("request")
+        wanted = self.requested_fields(request)
+        for name in list(self.fields):
+            if name not in wanted:
+                self.fields.pop(name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        fields = set(cls.Meta.fields)
+        if request is None or request.method not in ("GET", "HEAD"):
+            return fields
+        params = getattr(request, "query_params", request.GET)
+        if params.get("fields"):
+            fields &= set(params["fields"].split(","))
+        if params.get("omit"):
+            fields -= set(params["omit"].split(","))
+        return fields
+
+
+class ViewsField(serializers.ReadOnlyField):
+    """ views as stored plus the views this process counted but hasnt
+    flushed yet, so a reader sees his own visit right away. """
+
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        super(ViewsField, self).__init__(**kwargs)
+
+    def to_representation(self, obj):
+        return obj.views + viewcounts.pending(obj)
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ Looks the pk up in context["preloaded"], a {model: {pk: instance}}
+    dict, before asking the database. A view validating many rows at once
+    loads their parents with one in_bulk and hands them over that way. """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get("preloaded", {}) \
+            .get(self.get_queryset().model, {})
+        try:
+            return preloaded[int(data)]
+        except (KeyError, TypeError, ValueError):
+            return super(PreloadedPrimaryKeyRelatedField,
+                         self).to_internal_value(data)
+
+
+class TaskListSerializer(SparseFieldsMixin,
+                         serializers.ModelSerializer):  # forms.ModelForm
     url = serializers.SerializerMethodField(read_only=True)
     tasks = serializers.SerializerMethodField(read_only=True)
     tasksUrl = serializers.SerializerMethodField(read_only=True)
     comments = serializers.SerializerMethodField(read_only=True)
     commentsUrl = serializers.SerializerMethodField(read_only=True)
+    views = ViewsField()
 
     class Meta:
         model = TaskList
@@ -45,29 +105,46 @@ class TaskListSerializer(serializers.ModelSerializer):  # forms.ModelForm
         request = self.context.get("request")
         return obj.get_api_url(request=request)
 
+    # The children are read through the related managers so the views can
+    # load them for a whole page at once with prefetch_lookups. Only the
+    # children of requested fields are loaded.
+    @staticmethod
+    def prefetch_lookups(fields=None):
+        fields = set(TaskListSerializer.Meta.fields if fields is None
+                     else fields)
+        lookups = []
+        if fields & {"tasks", "tasksUrl"}:
+            lookups.append(Prefetch("task_set", queryset=Task.objects.only(
+                "pk", "LinkedTaskList").order_by("pk")))
+        if fields & {"comments", "commentsUrl"}:
+            lookups.append(Prefetch(
+                "tasklistcomment_set", queryset=TaskListComment.objects.only(
+                    "pk", "LinkedTaskList").order_by("pk")))
+        return lookups
+
     def get_tasks(self, obj):
         return obj.get_tasks()
 
     def get_tasksUrl(self, obj):
         request = self.context.get("request")
-        return [i.get_api_url(request=request) for i in Task.objects.filter(
-            LinkedTaskList=obj)]
+        return [i.get_api_url(request=request) for i in obj.task_set.all()]
 
     def get_commentsUrl(self, obj):
         request = self.context.get("request")
         return [i.get_api_url(request=request) for i in
-                TaskListComment.objects.filter(LinkedTaskList=obj)]
+                obj.tasklistcomment_set.all()]
 
     def get_comments(self, obj):
-        return [i.pk for i in
-                TaskListComment.objects.filter(LinkedTaskList=obj)]
+        return [i.pk for i in obj.tasklistcomment_set.all()]
 
 
-class TaskSerializer(serializers.ModelSerializer):
+class TaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     url = serializers.SerializerMethodField(read_only=True)
     linkedUrl = serializers.SerializerMethodField(read_only=True)
     comments = serializers.SerializerMethodField(read_only=True)
     commentsUrl = serializers.SerializerMethodField(read_only=True)
+    views = ViewsField()
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
 
     class Meta:
         model = Task
@@ -94,20 +171,34 @@ class TaskSerializer(serializers.ModelSerializer):
         request = self.context.get("request")
         return obj.get_api_url(request=request)
 
+    @staticmethod
+    def prefetch_lookups(fields=None):
+        fields = set(TaskSerializer.Meta.fields if fields is None
+                     else fields)
+        if not fields & {"comments", "commentsUrl"}:
+            return []
+        return [
+            Prefetch("taskcomment_set", queryset=TaskComment.objects.only(
+                "pk", "LinkedTask").order_by("pk")),
+        ]
+
     def get_linkedUrl(self, obj):
+        # Only the pk is needed, so dont load the list for it.
         request = self.context.get("request")
-        return obj.LinkedTaskList.get_api_url(request=request)
+        return url_factory(request).build("taskMaster-api:taskList-rud",
+                                          obj.LinkedTaskList_id)
 
     def get_commentsUrl(self, obj):
         request = self.context.get("request")
         return [i.get_api_url(request=request) for i in
-                TaskComment.objects.filter(LinkedTask=obj)]
+                obj.taskcomment_set.all()]
 
     def get_comments(self, obj):
-        return [i.pk for i in TaskComment.objects.filter(LinkedTask=obj)]
+        return [i.pk for i in obj.taskcomment_set.all()]
 
 
-class UserListRelationSerializer(serializers.ModelSerializer):
+class UserListRelationSerializer(SparseFieldsMixin,
+                                 serializers.ModelSerializer):
     url = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -129,8 +220,9 @@ class UserListRelationSerializer(serializers.ModelSerializer):
         return obj.get_api_url(request=request)
 
 
-class TaskCommentSerializer(serializers.ModelSerializer):
+class TaskCommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     url = serializers.SerializerMethodField(read_only=True)
+    views = ViewsField()
 
     class Meta:
         model = TaskComment
@@ -152,8 +244,10 @@ class TaskCommentSerializer(serializers.ModelSerializer):
         return obj.get_api_url(request=request)
 
 
-class TaskListCommentSerializer(serializers.ModelSerializer):
+class TaskListCommentSerializer(SparseFieldsMixin,
+                                serializers.ModelSerializer):
     url = serializers.SerializerMethodField(read_only=True)
+    views = ViewsField()
 
     class Meta:
         model = TaskListComment
@@ -175,7 +269,7 @@ class TaskListCommentSerializer(serializers.ModelSerializer):
         return obj.get_api_url(request=request)
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     url = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -188,7 +282,9 @@ class NotificationSerializer(serializers.ModelSerializer):
             "seen_on",
             "receiver",
             "date_created",
-            "deep_link_url"
+            "deep_link_url",
+            "changes",
+            "change_count",
         ]
 
     def get_url(self, obj):
@@ -7,7 +7,9 @@ from django.conf.urls import url
 from .views import TaskListAPIView, TaskListRudView, TaskAPIView, TaskRudView,\
     UserListRelationAPIView, UserListRelationRudView, TaskCommentAPIView, \
     TaskCommentRudView, TaskListCommentAPIView, TaskListCommentRudView, \
-    SearchAPI, NotificationListAPIView, UserCreateAPI, NotificationRUDView
+    SearchAPI, NotificationListAPIView, UserCreateAPI, NotificationRUDView, \
+    SuggestAPI, NotificationUnreadCountAPI, NotificationStreamAPI, \
+    NotificationSeenAPI, SyncAPI
 from rest_framework_jwt.views import obtain_jwt_token
 
 urlpatterns = [
@@ -43,10 +45,21 @@ urlpatterns = [
         name="notifications-api"),
     url(r'^Notifications/(?P<pk>\d+)/$', NotificationRUDView.as_view(),
         name="notifications-rud"),
+    url(r'^Notifications/unread_count/$',
+        NotificationUnreadCountAPI.as_view(),
+        name="notifications-unread-count"),
+    url(r'^Notifications/seen/$', NotificationSeenAPI.as_view(),
+        name="notifications-seen"),
+    url(r'^Notifications/stream/$', NotificationStreamAPI.as_view(),
+        name="notifications-stream"),
 
-    # Search algorithm endpoint... duh.
+    # Search algorithm endpoint... duh. Suggest has to come first.
+    url(r'^Search/suggest/$', SuggestAPI.as_view(), name="search-suggest"),
     url(r'^Search/', SearchAPI.as_view(), name="search-api"),
 
+    # Change feed for offline clients
+    url(r'^Sync/$', SyncAPI.as_view(), name="sync-api"),
+
     # User accounts system
     url(r'^Auth/login/$', obtain_jwt_token, name='api-login'),
     url(r'^Auth/Accounts/$', UserCreateAPI.as_view(),
@@ -1,16 +1,21 @@
 """ This is views.py and this is where most of the user facing data is
 handed off from the database to the user. """
 # Have you ever heard of this thing called boilerplate? Me neither.
-from collections import defaultdict
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
-from datetime import datetime
+import math
+import time
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db import transaction
+from django.db.models import Count, Q
 from rest_framework import generics, mixins
 from rest_framework.generics import get_object_or_404
-from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
+from taskMaster import acl, search, wakeup
 from taskMaster.models import (
     Task, TaskList, TaskComment, TaskListComment, Notification,
-    UserListRelation)
+    NotificationCounter, Tombstone, UserListRelation)
 from .serializers import TaskListSerializer, TaskSerializer, \
     UserListRelationSerializer, TaskCommentSerializer, \
     TaskListCommentSerializer, NotificationSerializer, UserSerializer
@@ -21,11 +26,33 @@ from .permissions import CRUDOnlyRelatedTaskList, \
     IsAdminOrUserRelatedReadOnlyOr401
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
-from TaskMasterAPI.settings import REST_FRAMEWORK
 from .request_reponse_examples import search_reponse_exampe
-
-
-class TaskListAPIView(mixins.CreateModelMixin, generics.ListAPIView):
+from .conditional import ConditionalListMixin, ConditionalRetrieveMixin
+from .pagination import ListPagination, SearchPager, SyncPager
+from .membership import membership
+from .renderers import EventStreamRenderer, FastJSONRenderer
+
+# Every list and RUD view takes these on GET, see SparseFieldsMixin.
+SPARSE_FIELD_PARAMS = (('fields',
+                        'String',
+                        'Comma separated fields to return, everything else '
+                        'is left out and never computed'),
+                       ('omit',
+                        'String',
+                        'Comma separated fields to leave out'))
+
+# And the list views these, see ListPagination.
+PAGINATION_PARAMS = (('pagination',
+                      'String',
+                      'cursor to page newest first with cursor links and '
+                      'no count, page numbers otherwise'),
+                     ('count',
+                      'String',
+                      'approx to get a cached total in cursor mode'))
+
+
+class TaskListAPIView(ConditionalListMixin, mixins.CreateModelMixin,
+                      generics.ListAPIView):
     """
     This is the list view of the task list model. It returns all the users
     task lists and allows him to create new ones.
@@ -41,17 +68,19 @@ class TaskListAPIView(mixins.CreateModelMixin, generics.ListAPIView):
     """
 
     lookup_field = 'pk'
+    extra_url_params = SPARSE_FIELD_PARAMS + PAGINATION_PARAMS
     serializer_class = TaskListSerializer
+    tombstone_list = "pk"
+    validator_children = ("task", "tasklistcomment")
     permission_classes = (IsAdminOrUserRelatedReadOnlyOr401,)
-    pagination_class = PageNumberPagination
+    pagination_class = ListPagination
 
     # Queryset defines the search space availablee to the querying user.
+    # It stays a QuerySet so the paginator slices it in SQL.
     def get_queryset(self, *args, **kwargs):
-        # Gets the QS of UserListRelations that the user has access to.
-        relations = UserListRelation.objects.filter(
-            Q(user=self.request.user) |
-            Q(owner=self.request.user)).distinct()
-        return [i.LinkedTaskList for i in relations]
+        return TaskList.reachable_by(self.request.user).order_by("pk") \
+            .prefetch_related(*TaskListSerializer.prefetch_lookups(
+                TaskListSerializer.requested_fields(self.request)))
 
     # Perform_create is called after post() and it works like django form
     def perform_create(self, serializer):
@@ -66,7 +95,8 @@ class TaskListAPIView(mixins.CreateModelMixin, generics.ListAPIView):
         return {"request": self.request}
 
 
-class TaskListRudView(generics.RetrieveUpdateDestroyAPIView):
+class TaskListRudView(ConditionalRetrieveMixin,
+                      generics.RetrieveUpdateDestroyAPIView):
     """ This is the RUD view of TaskList and it takes a Primary_Key to enter
     this layer of the API. It is responsible for updating or deleting as well
     as viewing the model at the object level.
@@ -85,24 +115,31 @@ class TaskListRudView(generics.RetrieveUpdateDestroyAPIView):
     """
 
     lookup_field = 'pk'  # slug, id # url(r'?P<pk>\d+')
+    extra_url_params = SPARSE_FIELD_PARAMS
     serializer_class = TaskListSerializer
+    tombstone_list = "pk"
+    validator_children = ("task", "tasklistcomment")
     permission_classes = (IsAdminOrUserRelatedReadOnlyOr401,)
 
     def get_serializer_context(self, *args, **kwargs):
         return {"request": self.request}
 
     def get_queryset(self):
-        obj = TaskList.objects.filter(pk=self.kwargs.get("pk"))
+        fields = TaskListSerializer.requested_fields(self.request)
+        obj = TaskList.objects.filter(pk=self.kwargs.get("pk")) \
+            .prefetch_related(*TaskListSerializer.prefetch_lookups(fields))
         return obj
 
     # Object level permission is handled manually in this class
     def get_object(self):
-        obj = get_object_or_404(self.get_queryset(), pk=self.kwargs["pk"])
-        self.check_object_permissions(self.request, obj)
+        obj = self.load_object()
+        if self.request.method == "GET":
+            obj.increment()  # Buffered, see taskMaster/viewcounts.py
         return obj
 
 
-class TaskAPIView(mixins.CreateModelMixin, generics.ListAPIView):
+class TaskAPIView(ConditionalListMixin, mixins.CreateModelMixin,
+                  generics.ListAPIView):
     """
     This is the generic list view of the task model. It returns all the users
     tasks (IF THEY ARE THE OWNER) and allows him to create new ones. If you
@@ -116,13 +153,28 @@ class TaskAPIView(mixins.CreateModelMixin, generics.ListAPIView):
 
     POST:
         Fill in the required fields and create a new task list and assign user
-        as the owner
+        as the owner. Send an array of them to create up to 5000 tasks at
+        once, the user has to be an admin of every list in it and either
+        all of them are created or none.
+
+    PATCH:
+        Changes many tasks at once. Send set, the fields to change (title,
+        completed and/or LinkedTaskList), and either ids, a list of task
+        pks, or filter, the same fields to pick tasks by. Tasks in lists
+        the user isnt an admin of are left alone and results says what
+        happened to every task. Moving needs admin rights on the new list.
+            {"filter": {"LinkedTaskList": 3}, "set": {"completed": true}}
     """
 
     lookup_field = 'pk'
+    extra_url_params = SPARSE_FIELD_PARAMS + PAGINATION_PARAMS
     serializer_class = TaskSerializer
+    tombstone_list = "LinkedTaskList"
+    validator_children = ("taskcomment",)
     permission_classes = (CRUDOnlyRelatedTaskList,)
-    pagination_class = PageNumberPagination
+    pagination_class = ListPagination
+    max_bulk_size = 5000
+    bulk_fields = ("title", "completed", "LinkedTaskList")
 
     # Find user auth on this layer.
     def perform_create(self, serializer):
@@ -130,10 +182,14 @@ class TaskAPIView(mixins.CreateModelMixin, generics.ListAPIView):
 
     def get_queryset(self):
         # Fix after implementing UserLIstRelation
-        temp = Task.objects.filter(owner=self.request.user)
+        fields = TaskSerializer.requested_fields(self.request)
+        temp = Task.objects.filter(owner=self.request.user) \
+            .prefetch_related(*TaskSerializer.prefetch_lookups(fields))
         return temp
 
     def post(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            return self.bulk_create(request)
         temp = TaskList.objects.get(pk=self.request.data.get("LinkedTaskList"))
         try:
             UserListRelation.objects.get(
@@ -142,18 +198,132 @@ class TaskAPIView(mixins.CreateModelMixin, generics.ListAPIView):
             return Response({"User-List-Relation conflict": "Duplicate found"},
                             status=status.HTTP_409_CONFLICT)
         except ObjectDoesNotExist:
-            if temp.user_is_admin(temp, self.request.user) is True:
+            if membership(request).is_admin(temp) is True:
                 return self.create(request, *args, **kwargs)
             else:
                 return Response({"User is not authorized to make this request":
                                      str(self.request.user)},
                                 status=status.HTTP_401_UNAUTHORIZED)
 
+    def bulk_create(self, request):
+        """ Checks admin rights once per list instead of once per task and
+        hands the validated tasks to Task.create_many. """
+        if not 0 < len(request.data) <= self.max_bulk_size:
+            return Response({"detail": "Send between 1 and %d tasks."
+                                       % self.max_bulk_size},
+                            status=status.HTTP_400_BAD_REQUEST)
+        list_ids = set()
+        for item in request.data:
+            try:
+                list_ids.add(int(item.get("LinkedTaskList")))
+            except (AttributeError, TypeError, ValueError):
+                pass  # The serializer tells him what is wrong with it.
+        task_lists = TaskList.objects.in_bulk(list_ids)
+        resolver = membership(request)
+        for task_list in task_lists.values():
+            if resolver.is_admin(task_list) is not True:
+                return Response({"User is not authorized to make this request":
+                                     str(self.request.user)},
+                                status=status.HTTP_401_UNAUTHORIZED)
+
+        context = self.get_serializer_context()
+        context["preloaded"] = {TaskList: task_lists}
+        serializer = TaskSerializer(data=request.data, many=True,
+                                    context=context)
+        serializer.is_valid(raise_exception=True)
+        tasks = Task.create_many([Task(owner=request.user, **data)
+                                  for data in serializer.validated_data])
+        # Brand new tasks have no comments, no need to ask the database.
+        for task in tasks:
+            task._prefetched_objects_cache = {
+                "taskcomment_set": TaskComment.objects.none()}
+        return Response(TaskSerializer(tasks, many=True,
+                                       context=context).data,
+                        status=status.HTTP_201_CREATED)
+
+    def patch(self, request, *args, **kwargs):
+        """ Checks admin rights once per list and hands the tasks that pass
+        to Task.update_many, so the cost goes with the number of lists. """
+        invalid = Response({"detail": "Send set with some of %s and either "
+                                      "ids or filter, at most %d tasks."
+                                      % (", ".join(self.bulk_fields),
+                                         self.max_bulk_size)},
+                           status=status.HTTP_400_BAD_REQUEST)
+        if not hasattr(request.data, "get"):
+            return invalid
+        changes = request.data.get("set")
+        ids, lookup = request.data.get("ids"), request.data.get("filter")
+        if not isinstance(changes, dict) or not changes or \
+                set(changes) - set(self.bulk_fields) or \
+                (ids is None) == (lookup is None):
+            return invalid
+        if isinstance(ids, list):
+            # Before any query, a huge body shouldnt cost one per chunk.
+            try:
+                ids = list(dict.fromkeys(int(pk) for pk in ids))
+            except (TypeError, ValueError):
+                return invalid
+            if len(ids) > self.max_bulk_size:
+                return invalid
+
+        tasks = Task.objects.filter(
+            LinkedTaskList__in=TaskList.reachable_by(request.user))
+        found = dict()
+        try:
+            if isinstance(ids, list):
+                for i in range(0, len(ids), 500):
+                    found.update(tasks.filter(pk__in=ids[i:i + 500])
+                                 .values_list("pk", "LinkedTaskList_id"))
+            elif ids is None and isinstance(lookup, dict) and \
+                    not set(lookup) - set(self.bulk_fields):
+                found.update(tasks.filter(**lookup).order_by("pk")
+                             .values_list("pk", "LinkedTaskList_id")
+                             [:self.max_bulk_size + 1])
+                ids = list(found)
+            else:
+                return invalid
+        except (TypeError, ValueError, ValidationError):
+            return invalid
+        if len(ids) > self.max_bulk_size:
+            return invalid
+
+        list_ids = set(found.values())
+        try:
+            target = int(changes.get("LinkedTaskList"))
+            list_ids.add(target)
+        except (TypeError, ValueError):
+            target = None
+        context = self.get_serializer_context()
+        context["preloaded"] = {TaskList: TaskList.objects.in_bulk(list_ids)}
+        serializer = TaskSerializer(data=changes, partial=True,
+                                    context=context)
+        serializer.is_valid(raise_exception=True)
+        resolver = membership(request)
+        if target is not None and resolver.is_admin(
+                context["preloaded"][TaskList][target]) is not True:
+            return Response({"User is not authorized to make this request":
+                                 str(self.request.user)},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+        admin = dict((list_id, resolver.is_admin(
+            context["preloaded"][TaskList][list_id]) is True)
+            for list_id in set(found.values()))
+        allowed = [pk for pk in ids if admin.get(found.get(pk))]
+        if allowed:
+            Task.update_many(allowed, serializer.validated_data)
+        return Response({
+            "updated": len(allowed),
+            "results": [{"pk": pk,
+                         "status": "updated" if admin.get(found.get(pk))
+                         else "forbidden" if pk in found else "not_found"}
+                        for pk in ids]})
+
     def get_serializer_context(self, *args, **kwargs):
         return {"request": self.request}
 
 
-class TaskRudView(generics.RetrieveUpdateDestroyAPIView):
+class TaskRudView(ConditionalRetrieveMixin,
+                  generics.RetrieveUpdateDestroyAPIView):
     """
     This is the RUD view of Task. It takes a Primary_Key to enter
     this layer of the API. It is responsible for updating or deleting as well
@@ -173,24 +343,31 @@ class TaskRudView(generics.RetrieveUpdateDestroyAPIView):
     """
 
     lookup_field = 'pk'  # slug, id # url(r'?P<pk>\d+')
+    extra_url_params = SPARSE_FIELD_PARAMS
     serializer_class = TaskSerializer
+    tombstone_list = "LinkedTaskList"
+    validator_children = ("taskcomment",)
     permission_classes = (CRUDOnlyRelatedTaskList,)
 
     def get_queryset(self):
         # Fix after implementing UserLIstRelation
-        temp = Task.objects.filter(pk=self.kwargs['pk'])
+        fields = TaskSerializer.requested_fields(self.request)
+        temp = Task.objects.filter(pk=self.kwargs['pk']) \
+            .prefetch_related(*TaskSerializer.prefetch_lookups(fields))
         return temp
 
     def get_object(self):
-        obj = get_object_or_404(self.get_queryset(), pk=self.kwargs["pk"])
-        self.check_object_permissions(self.request, obj)
+        obj = self.load_object()
+        if self.request.method == "GET":
+            obj.increment()  # Buffered, see taskMaster/viewcounts.py
         return obj
 
     def get_serializer_context(self, *args, **kwargs):
         return {"request": self.request}
 
 
-class UserListRelationAPIView(mixins.CreateModelMixin, generics.ListAPIView):
+class UserListRelationAPIView(ConditionalListMixin, mixins.CreateModelMixin,
+                              generics.ListAPIView):
     """
     This is the generic list view of the UserListRelation model.
     It returns all the users relations if they are the owner or the user
@@ -214,9 +391,11 @@ class UserListRelationAPIView(mixins.CreateModelMixin, generics.ListAPIView):
     """
 
     lookup_field = 'pk'
+    extra_url_params = SPARSE_FIELD_PARAMS + PAGINATION_PARAMS
     serializer_class = UserListRelationSerializer
+    tombstone_list = "LinkedTaskList"
     permission_classes = (CRUDUserListRelation,)
-    pagination_class = PageNumberPagination
+    pagination_class = ListPagination
 
     def get_queryset(self):
         return UserListRelation.objects.filter(Q(owner=self.request.user) |
@@ -226,6 +405,10 @@ class UserListRelationAPIView(mixins.CreateModelMixin, generics.ListAPIView):
         serializer.save(owner=self.request.user)
 
     def post(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            # Only Task/ takes an array.
+            return Response({"detail": "Send one object."},
+                            status=status.HTTP_400_BAD_REQUEST)
         temp = TaskList.objects.get(pk=self.request.data.get("LinkedTaskList"))
         try:
             UserListRelation.objects.get(
@@ -234,7 +417,7 @@ class UserListRelationAPIView(mixins.CreateModelMixin, generics.ListAPIView):
             return Response({"User-List-Relation conflict": "Duplicate found"},
                             status=status.HTTP_409_CONFLICT)
         except ObjectDoesNotExist:
-            if temp.user_is_admin(temp, self.request.user) is True:
+            if membership(request).is_admin(temp) is True:
                 return self.create(request, *args, **kwargs)
             else:
                 return Response({"User is not authorized to make this request":
@@ -265,6 +448,7 @@ class UserListRelationRudView(generics.RetrieveUpdateDestroyAPIView):
     """
 
     lookup_field = 'pk'
+    extra_url_params = SPARSE_FIELD_PARAMS
     serializer_class = UserListRelationSerializer
     permission_classes = (CRUDUserListRelation,)
 
@@ -281,7 +465,8 @@ class UserListRelationRudView(generics.RetrieveUpdateDestroyAPIView):
         return obj
 
 
-class TaskCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
+class TaskCommentAPIView(ConditionalListMixin, mixins.CreateModelMixin,
+                         generics.ListAPIView):
     """
     This is the generic list view of the Task-Comment model.
     It returns all the (task) comments where the user is  the owner.
@@ -299,9 +484,11 @@ class TaskCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
     """
 
     lookup_field = "pk"
+    extra_url_params = SPARSE_FIELD_PARAMS + PAGINATION_PARAMS
     serializer_class = TaskCommentSerializer
+    tombstone_list = "LinkedTask__LinkedTaskList"
     permission_classes = (CRUDTaskComments,)
-    pagination_class = PageNumberPagination
+    pagination_class = ListPagination
 
     def get_queryset(self):
         return TaskComment.objects.filter(owner=self.request.user)
@@ -310,6 +497,10 @@ class TaskCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
         serializer.save(owner=self.request.user)
 
     def post(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            # Only Task/ takes an array.
+            return Response({"detail": "Send one object."},
+                            status=status.HTTP_400_BAD_REQUEST)
         task = Task.objects.get(pk=request.data.get("LinkedTask"))
         temp = task.LinkedTaskList
         try:
@@ -319,7 +510,7 @@ class TaskCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
             return Response({"User-List-Relation conflict": "Duplicate found"},
                             status=status.HTTP_409_CONFLICT)
         except ObjectDoesNotExist:
-            if temp.user_is_admin(temp, self.request.user) is True:
+            if membership(request).is_admin(temp) is True:
                 return self.create(request, *args, **kwargs)
             else:
                 return Response({"User is not authorized to make this request":
@@ -330,7 +521,8 @@ class TaskCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
         return {"request": self.request}
 
 
-class TaskCommentRudView(generics.RetrieveUpdateDestroyAPIView):
+class TaskCommentRudView(ConditionalRetrieveMixin,
+                         generics.RetrieveUpdateDestroyAPIView):
     """
     This is the RUD view of Task Comment Model. It takes a Primary_Key to enter
     this layer of the API. It is responsible for updating or deleting as well
@@ -350,21 +542,23 @@ class TaskCommentRudView(generics.RetrieveUpdateDestroyAPIView):
     """
 
     lookup_field = "pk"
+    extra_url_params = SPARSE_FIELD_PARAMS
     serializer_class = TaskCommentSerializer
     permission_classes = (CRUDTaskComments,)
 
     def get_queryset(self):
         obj = TaskComment.objects.filter(pk=self.kwargs["pk"])
-        [i.increment() for i in obj]
         return obj
 
     def get_object(self):
-        obj = get_object_or_404(self.get_queryset(), pk=self.kwargs["pk"])
-        self.check_object_permissions(self.request, obj)
+        obj = self.load_object()
+        if self.request.method == "GET":
+            obj.increment()  # Buffered, see taskMaster/viewcounts.py
         return obj
 
 
-class TaskListCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
+class TaskListCommentAPIView(ConditionalListMixin, mixins.CreateModelMixin,
+                             generics.ListAPIView):
     """
     This is the generic list view of the Task-List-Comment model.
     It returns all the (task-list) comments where the user is the owner.
@@ -382,9 +576,11 @@ class TaskListCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
     """
 
     lookup_field = "pk"
+    extra_url_params = SPARSE_FIELD_PARAMS + PAGINATION_PARAMS
     serializer_class = TaskListCommentSerializer
+    tombstone_list = "LinkedTaskList"
     permission_classes = (CRUDTaskListComments,)
-    pagination_class = PageNumberPagination
+    pagination_class = ListPagination
 
     def get_queryset(self):
         return TaskListComment.objects.filter(owner=self.request.user)
@@ -393,6 +589,10 @@ class TaskListCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
         serializer.save(owner=self.request.user)
 
     def post(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            # Only Task/ takes an array.
+            return Response({"detail": "Send one object."},
+                            status=status.HTTP_400_BAD_REQUEST)
         temp = TaskList.objects.get(pk=self.request.data.get("LinkedTaskList"))
         try:
             UserListRelation.objects.get(
@@ -401,7 +601,7 @@ class TaskListCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
             return Response({"User-List-Relation conflict": "Duplicate found"},
                             status=status.HTTP_409_CONFLICT)
         except ObjectDoesNotExist:
-            if temp.user_is_admin(temp, self.request.user) is True:
+            if membership(request).is_admin(temp) is True:
                 return self.create(request, *args, **kwargs)
             else:
                 return Response({"User is not authorized to make this request":
@@ -412,7 +612,8 @@ class TaskListCommentAPIView(mixins.CreateModelMixin, generics.ListAPIView):
         return {"request": self.request}
 
 
-class TaskListCommentRudView(generics.RetrieveUpdateDestroyAPIView):
+class TaskListCommentRudView(ConditionalRetrieveMixin,
+                             generics.RetrieveUpdateDestroyAPIView):
     """
     This is the RUD view of Task-List-Comment Model. It takes a Primary_Key to
     enter this layer of the API. It is responsible for updating or deleting as
@@ -432,21 +633,22 @@ class TaskListCommentRudView(generics.RetrieveUpdateDestroyAPIView):
     """
 
     lookup_field = "pk"
+    extra_url_params = SPARSE_FIELD_PARAMS
     serializer_class = TaskListCommentSerializer
     permission_classes = (CRUDTaskListComments,)
 
     def get_queryset(self):
         temp = TaskListComment.objects.filter(pk=self.kwargs.get("pk"))
-        [i.increment() for i in temp]
         return temp
 
     def get_object(self):
-        obj = get_object_or_404(self.get_queryset(), pk=self.kwargs["pk"])
-        self.check_object_permissions(self.request, obj)
+        obj = self.load_object()
+        if self.request.method == "GET":
+            obj.increment()  # Buffered, see taskMaster/viewcounts.py
         return obj
 
 
-class NotificationListAPIView(generics.ListAPIView):
+class NotificationListAPIView(ConditionalListMixin, generics.ListAPIView):
     """
     This is the generic list view of the Notification model.
     It returns all the Notifications where the receiver is the user.
@@ -455,32 +657,42 @@ class NotificationListAPIView(generics.ListAPIView):
 
     GET:
         Returns a list of all Notifications available to the requesting user.
-        Don't confuse with the primary key filter on the next tab. This
-        function doesnt take ANY parameters.
+        Don't confuse with the primary key filter on the next tab. Pass
+        seen=false to only get the unseen ones (or seen=true for the rest).
 
     POST:
         POST is disabled here. The system creates notifications internally.
     """
 
     lookup_field = "pk"
+    extra_url_params = SPARSE_FIELD_PARAMS + PAGINATION_PARAMS + (
+        ('seen', 'Boolean', 'true or false to only list seen or unseen'),)
     serializer_class = NotificationSerializer
-    pagination_class = PageNumberPagination
+    validator_aggregates = {"seen": Count("pk", filter=Q(seen=True))}
+    pagination_class = ListPagination
 
     def get_queryset(self):
         temp = Notification.objects.filter(receiver=self.request.user)
+        seen = self.request.query_params.get("seen", "").lower()
+        if seen in ("true", "false"):
+            temp = temp.filter(seen=seen == "true")
         return temp.order_by("-date_created")
 
     def get_object(self):
         obj = get_object_or_404(self.get_queryset(), pk=self.kwargs["pk"])
         self.check_object_permissions(self.request, obj)
         if not obj.seen:
-            obj.seen_on = datetime.now()
+            obj.seen_on = timezone.now()
             obj.seen = True
-            obj.save()
+            # Only the request that actually flips it takes it off the
+            # unread counter, two tabs opening it at once count once.
+            if Notification.objects.filter(pk=obj.pk, seen=False).update(
+                    seen=True, seen_on=obj.seen_on):
+                NotificationCounter.add([obj.receiver_id], -1)
         return obj
 
 
-class NotificationRUDView(generics.RetrieveAPIView):
+class NotificationRUDView(ConditionalRetrieveMixin, generics.RetrieveAPIView):
     """
     This is the Retreive view of the Notification Model. It takes a Primary
     Key to enter this layer of the API. It is responsible for updating and
@@ -496,7 +708,9 @@ class NotificationRUDView(generics.RetrieveAPIView):
     """
 
     lookup_field = "pk"
+    extra_url_params = SPARSE_FIELD_PARAMS
     serializer_class = NotificationSerializer
+    validator_fields = ("seen", "change_count")
     pagination_class = PageNumberPagination
 
     def get_queryset(self):
@@ -504,15 +718,197 @@ class NotificationRUDView(generics.RetrieveAPIView):
         return temp
 
     def get_object(self):
-        obj = get_object_or_404(self.get_queryset(), pk=self.kwargs["pk"])
-        self.check_object_permissions(self.request, obj)
+        obj = self.load_object()
         if not obj.seen:
-            obj.seen_on = datetime.now()
+            obj.seen_on = timezone.now()
             obj.seen = True
-            obj.save()
+            # Only the request that actually flips it takes it off the
+            # unread counter, two tabs opening it at once count once.
+            if Notification.objects.filter(pk=obj.pk, seen=False).update(
+                    seen=True, seen_on=obj.seen_on):
+                NotificationCounter.add([obj.receiver_id], -1)
         return obj
 
 
+class NotificationSeenAPI(APIView):
+    """
+    Marks many notifications as seen at once, with one UPDATE, instead of
+    opening them one by one.
+
+    post:
+    Marks the users unseen notifications as seen. With ids only those, with
+    after and/or before (ISO timestamps) only the ones created in between,
+    and with neither all of them. Returns how many were marked and how many
+    are still unread.
+
+    Request:
+        {"ids": [1, 2, 3]} or {"after": "2026-10-01T00:00:00Z"} or {}
+    """
+    chunk_size = 500  # ids per UPDATE, sqlite allows 999 parameters.
+
+    def post(self, request, format='json'):
+        if not isinstance(request.data, dict):  # QueryDicts are dicts too
+            return Response({"detail": "Expected an object with ids, after "
+                                       "or before."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        unseen = Notification.objects.filter(receiver=request.user,
+                                             seen=False)
+        for field, lookup in (("after", "date_created__gte"),
+                              ("before", "date_created__lt")):
+            if request.data.get(field) is None:
+                continue
+            value = parse_datetime(str(request.data[field]))
+            if value is None:
+                return Response({field: "Has to be an ISO timestamp."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            unseen = unseen.filter(**{lookup: value})
+
+        ids = request.data.get("ids")
+        if isinstance(ids, str):  # Form posts send ids=1,2,3
+            ids = ids.split(",")
+        if ids is None:
+            chunks = [unseen]
+        else:
+            try:
+                ids = [int(pk) for pk in ids]
+            except (TypeError, ValueError):
+                return Response({"ids": "Has to be a list of ids."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            chunks = [unseen.filter(pk__in=ids[i:i + self.chunk_size])
+                      for i in range(0, len(ids), self.chunk_size)]
+
+        now = timezone.now()
+        with transaction.atomic():
+            marked = sum(chunk.update(seen=True, seen_on=now)
+                         for chunk in chunks)
+            if marked:
+                NotificationCounter.add([request.user.pk], -marked)
+        return Response({"marked": marked,
+                         "unread": NotificationCounter.unread_for(
+                             request.user)})
+
+
+class NotificationUnreadCountAPI(APIView):
+    """
+    Returns how many of the users notifications havent been seen yet, for
+    badges. Its a single row read, so poll it instead of the list.
+
+    GET:
+        Returns {"unread": <number>}
+    """
+
+    def get(self, request, format='json'):
+        return Response({"unread": NotificationCounter.unread_for(
+            request.user)})
+
+
+class NotificationStreamAPI(APIView):
+    """
+    Waits for new notifications instead of being polled for them. The
+    request is held until the user gets notifications after the since cursor
+    or timeout seconds pass.
+
+    get:
+    Long-poll: returns {"results": [...], "since": <cursor>} as soon as
+    there is something, or an empty results after the timeout. Send since
+    back on the next request. A number is a notification id and only finds
+    new notifications, a timestamp also finds unseen ones that were bumped
+    by another change since. Without since it starts at the newest one.
+
+    With Accept: text/event-stream (or ?format=sse) it is an event stream
+    instead, one "notification" event per notification with its id as the
+    event id, until the timeout ends it and the client reconnects with
+    Last-Event-ID.
+
+    A held request takes up one of the threads of a gthread worker. It is
+    woken right away by notifications written in its own process only, the
+    rest it finds by polling, so they can take up to
+    NOTIFICATION_STREAM_POLL seconds to arrive.
+
+    Request:
+        /api/v1.0/TaskMaster/Notifications/stream/?since=120&timeout=25
+    """
+    renderer_classes = (FastJSONRenderer, EventStreamRenderer)
+    extra_url_params = (('since',
+                         'String',
+                         'Notification id or ISO timestamp to wait past'),
+                        ('timeout',
+                         'Number',
+                         'Seconds to wait, 25 by default and at most that'))
+
+    def get(self, request, format=None):
+        try:
+            timeout = float(request.GET.get("timeout", 25))
+        except ValueError:
+            timeout = None
+        # min() and max() let nan through, which never reaches a deadline.
+        if timeout is None or not math.isfinite(timeout):
+            return Response({"timeout": "Has to be a number."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        timeout = min(max(timeout, 0), settings.NOTIFICATION_STREAM_TIMEOUT)
+        since = request.GET.get("since",
+                                request.META.get("HTTP_LAST_EVENT_ID"))
+        mine = Notification.objects.filter(receiver=request.user)
+        if since is None:
+            since = mine.order_by("-pk").values_list("pk", flat=True) \
+                .first() or 0
+        elif since.isdigit():
+            since = int(since)
+        else:
+            since = parse_datetime(since.replace(" ", "+"))
+            if since is None:
+                return Response({"since": "Has to be an id or a timestamp."},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        deadline = time.monotonic() + timeout
+        if request.accepted_renderer.format == "sse":
+            response = StreamingHttpResponse(
+                self.events(request, mine, since, deadline),
+                content_type="text/event-stream")
+            response["Cache-Control"] = "no-cache"
+            return response
+        results, since = self.wait(request, mine, since, deadline)
+        return Response({"results": results, "since": since})
+
+    def wait(self, request, mine, since, deadline):
+        """ Returns (notifications after since, cursor to continue from),
+        blocking until there are some or the deadline passes. """
+        while True:
+            generation = wakeup.generation(request.user.pk)
+            if isinstance(since, int):
+                found = mine.filter(pk__gt=since).order_by("pk")
+            else:
+                found = mine.filter(date_created__gt=since) \
+                    .order_by("date_created", "pk")
+            found = list(found[:100])
+            if found:
+                since = found[-1].pk if isinstance(since, int) else \
+                    found[-1].date_created.isoformat()
+                return NotificationSerializer(
+                    found, many=True, context={"request": request}).data, \
+                    since
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], since if isinstance(since, int) else \
+                    since.isoformat()
+            # Also wake up now and then for notifications other processes
+            # wrote, see taskMaster/wakeup.py
+            wakeup.wait(request.user.pk, generation,
+                        min(remaining, settings.NOTIFICATION_STREAM_POLL))
+
+    def events(self, request, mine, since, deadline):
+        renderer = FastJSONRenderer()
+        yield b"retry: 1000\n\n"
+        while time.monotonic() < deadline:
+            results, cursor = self.wait(request, mine, since, deadline)
+            since = int(cursor) if isinstance(since, int) else \
+                parse_datetime(cursor)
+            for notification in results:
+                yield b"id: %d\nevent: notification\ndata: %s\n\n" % (
+                    notification["pk"], renderer.render(notification))
+            yield b": keep-alive\n\n"
+
+
 class SearchAPI(mixins.ListModelMixin, APIView):
     """
     This is the multi-model 'global' search that queryes four different
@@ -525,41 +921,59 @@ class SearchAPI(mixins.ListModelMixin, APIView):
     Lastly permissions arent included except for the is-logged-in one and that
     is because the user can only GET data based on that user's profile. So
     permissions are hard coded in this case.
+    Results are cached per user and query string, the X-Search-Cache header
+    says whether this response was a hit or a miss.
 
     Request:
         /api/v1.0/TaskMaster/Search/&order=-views&page=1&q=test
     """
-    renderer_classes = (BrowsableAPIRenderer, JSONRenderer,)
-    pagination_class = PageNumberPagination
+    pagination_class = SearchPager
     extra_url_params = (('q',
                          'String',
-                         'Simple filter, will match for any substring in '
-                         'titles and descriptions of relevant models'),
+                         'Full-text filter, every word has to start a word '
+                         'in the titles, descriptions or owner names of '
+                         'relevant models'),
                         ('order',
                          'String',
                          'only accepts views, -views, date, -date and returns '
-                         'models in that order.'),
+                         'models in that order. relevance returns the best '
+                         'BM25 matches first, title hits outweigh the rest'),
                         ('page',
                          'Integer',
                          'Still will flip the output to a paginated view and '
-                         'include "deeplinks" for next and previous pages '))
+                         'include "deeplinks" for next and previous pages '),
+                        ('cursor',
+                         'String',
+                         'Opaque position taken from the next and previous '
+                         'deeplinks of a paginated search'))
 
     def get(self, request, *args, **kwargs):
+        # Repeated searches are answered from the cache until something the
+        # user can see changes, see search.forget_results.
+        key = search.results_key(request.user.pk, acl.load(request.user.pk),
+                                 request.build_absolute_uri())
+        data = search.get_cached_results(key)
+        if data is not None:
+            response = Response(data)
+            response["X-Search-Cache"] = "hit"
+            return response
+
+        response = self.search(request)
+        search.set_cached_results(key, response.data)
+        response["X-Search-Cache"] = "miss"
+        return response
+
+    def search(self, request):
         data = dict()
         data["user"] = request.user.username
+        orderable_qs_list = []
 
         # The search filter 'algorithm' starts here
         if request.GET.get("q") is not None:
             query = request.GET.get("q")
 
-            # Gets the QS of UserListRelations that the user has access to.
-            relations = UserListRelation.objects.filter(
-                Q(user=self.request.user) |
-                Q(owner=self.request.user)).distinct()
-
             # Gets the entire search-space available to the user.
-            task_list_list = TaskList.objects.filter(
-                userlistrelation__in=relations).distinct()
+            task_list_list = TaskList.reachable_by(self.request.user)
 
             task_list = Task.objects.filter(
                 LinkedTaskList__in=task_list_list).distinct()
@@ -570,134 +984,178 @@ class SearchAPI(mixins.ListModelMixin, APIView):
             task_comments_list = TaskComment.objects.filter(
                 LinkedTask__in=task_list).distinct()
 
-            # Apply the query filters
-            taskList_list_unserialized = task_list_list.filter(
-                Q(owner__first_name__icontains=query) |
-                Q(owner__last_name__icontains=query) |
-                Q(owner__username__icontains=query) |
-                Q(title__icontains=query) |
-                Q(description__icontains=query)
-            )
-            task_list_unserialized = task_list.filter(
-                Q(owner__first_name__icontains=query) |
-                Q(owner__last_name__icontains=query) |
-                Q(owner__username__icontains=query) |
-                Q(title__icontains=query)
-            )
-            task_list_comments_list_unserialized = \
-                task_list_comments_list.filter(
-                    Q(owner__first_name__icontains=query) |
-                    Q(owner__last_name__icontains=query) |
-                    Q(owner__username__icontains=query) |
-                    Q(title__icontains=query) |
-                    Q(description__icontains=query)
-                )
-            task_comments_list_unserialized = task_comments_list.filter(
-                Q(owner__first_name__icontains=query) |
-                Q(owner__last_name__icontains=query) |
-                Q(owner__username__icontains=query) |
-                Q(title__icontains=query) |
-                Q(description__icontains=query)
-            )
-
-            # Obey the ordering.
+            # Apply the query through the full-text index.
+            taskList_list_unserialized = search.filter_queryset(
+                task_list_list, query)
+            task_list_unserialized = search.filter_queryset(task_list, query)
+            task_list_comments_list_unserialized = search.filter_queryset(
+                task_list_comments_list, query)
+            task_comments_list_unserialized = search.filter_queryset(
+                task_comments_list, query)
+
             orderable_qs_list = [taskList_list_unserialized,
                                  task_list_unserialized,
                                  task_list_comments_list_unserialized,
                                  task_comments_list_unserialized]
-            order_params = ("views", "-views", "date", "-date")
-            if request.GET.get("order") in order_params:
-                order = request.GET.get("order")
-
-                if order == "views" or order == "-views":
-                    for i in range(len(orderable_qs_list)):
-                        orderable_qs_list[i] = \
-                            orderable_qs_list[i].order_by(str(order))
-
-                if order == "date" or order == "-date":
-                    for i in range(len(orderable_qs_list)):
-                        orderable_qs_list[i] = \
-                            orderable_qs_list[i].order_by(str(order) +
-                                                          "_created")
-
-            # Finally serialize the links in the form of a list of lists.
-            for i in orderable_qs_list:
-                data[i.model.__name__] = [x.get_api_url(request) for x in i]
-
-        # Reinvent the paginator because that Tom Christie guy fucked it up.
-        if request.GET.get("page") is not None:
-            page_response = dict()
-            page_size = int(REST_FRAMEWORK['PAGE_SIZE'])
-            page = request.GET.get("page")
-            page_response["next"] = None
-            page_response["previous"] = None
-
-            # Just counts the user as 1.
-            page_response["count"] = 1
-            for i in orderable_qs_list:
-                for j in list(data[i.model.__name__]):
-                    page_response["count"] += 1
-
-            # Start at -1 otherwise we get an off-by-one error on the
-            # page_divided_data divides the list of lists into pages of lists
-            page_divided_data = defaultdict(list)
-            n = -1
-            for i in orderable_qs_list:
-                for j in list(data[i.model.__name__]):
-                    n += 1
-                    page_number = n.__floordiv__(int(page_size)) + 1
-                    page_divided_data["page" + str(page_number)].append(
-                        {i.model.__name__: j})
-
-            # Takes the nested dicts of page_divided_data and collapses them
-            paginated_nested_dict = defaultdict(list)
-            for pages in page_divided_data:
-                page_builder = defaultdict(list)
-                for i in page_divided_data[str(pages)]:
-                    for key, value in i.items():
-                        if key in page_builder:
-                            page_builder[key].append(value)
-                        else:
-                            page_builder[key] = [value]
-                paginated_nested_dict[str(pages)] = page_builder
-
-            """ I would have normally done this using a reverse_api filter
-            but kwargs is an immutable field and reverse_api requires you to
-            use that type of field. So its not suitable for anything that 
-            isnt attatched to a serializer at the other end. Which this isnt
-            So yes. The Next button reburies no less than 9 lines for itself.
-            Same goes for the previous call. Im so sorry if this ever breaks.
-            """
-            if int(page) * int(page_size) <= int(page_response["count"]):
-                GetText = str(request.get_raw_uri()).split("/")
-                updated = GetText[-1]
-                substring = GetText[-1].find("page=")
-                prelim = updated[:substring + 5] + str(
-                    int(updated[substring + 5:substring + 6]) + 1
-                )
-                newUrl = '/'.join(GetText[:-1]) + prelim
-                page_response["next"] = newUrl
-
-            # Does the same as the one above it but instead of +1 it goes -1
-            if int(page) > 1:
-                GetText = str(request.get_raw_uri()).split("/")
-                updated = GetText[-1]
-                substring = GetText[-1].find("page=")
-                prelim = updated[:substring + 5] + str(
-                    int(updated[substring + 5:substring + 6]) - 1
-                )
-                newUrl = '/'.join(GetText[:-1]) + prelim
-                page_response["previous"] = newUrl
-
-            # And just like that i can never come back to this code ever again.
-            page_response["results"] = paginated_nested_dict[
-                "page" + str(page)]
-            return Response(page_response)
+
+        # Relevance ranks inside the index and only keeps the top hits, so
+        # it is always paginated.
+        ranker = None
+        if request.GET.get("order") == "relevance" and orderable_qs_list:
+            def ranker(limit):
+                return search.rank(query, task_list_list, limit)
+
+        # Paginated searches only ever fetch the rows of the requested page.
+        if request.GET.get("page") is not None or \
+                request.GET.get("cursor") is not None or ranker is not None:
+            pager = self.pagination_class(orderable_qs_list,
+                                          order=request.GET.get("order"),
+                                          ranker=ranker)
+            page = pager.paginate(request)
+            return pager.get_paginated_response(page)
+
+        # Obey the ordering.
+        order = request.GET.get("order")
+        if order in SearchPager.orderings:
+            field, descending = SearchPager.orderings[order]
+            ordering = "-" + field if descending else field
+            orderable_qs_list = [i.order_by(ordering)
+                                 for i in orderable_qs_list]
+
+        # Finally serialize the links in the form of a list of lists.
+        for i in orderable_qs_list:
+            data[i.model.__name__] = [x.get_api_url(request) for x in i]
 
         # Return the final data no matter what it looks like.
         return Response(data)
 
 
+class SuggestAPI(APIView):
+    """
+    This is the typeahead companion of the search. It only looks at titles
+    and answers from the edge n-gram index (TitleGram), so it is cheap
+    enough to call on every keystroke.
+    get:
+    Returns up to limit titles with a word starting with the last word of q,
+    from lists the user reaches through a UserListRelation. Titles where the
+    match is an earlier word come first, shorter titles before longer ones.
+
+    Request:
+        /api/v1.0/TaskMaster/Search/suggest/?q=gro&limit=5
+    """
+    max_limit = 50
+    extra_url_params = (('q',
+                         'String',
+                         'What the user has typed so far'),
+                        ('limit',
+                         'Integer',
+                         'How many titles to return, 10 by default and at '
+                         'most 50'))
+    models = dict((model.__name__, model) for model in
+                  (TaskList, Task, TaskListComment, TaskComment))
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.GET.get("limit", 10)), self.max_limit)
+        except ValueError:
+            return Response({"limit": "Has to be a number."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        suggestions = search.suggest(request.GET.get("q", ""),
+                                     TaskList.reachable_by(request.user),
+                                     max(limit, 0))
+        return Response({"results": [
+            {"title": title,
+             "type": kind,
+             "url": self.models[kind](pk=pk).get_api_url(request)}
+            for kind, pk, title in suggestions]})
+
+
+class SyncAPI(APIView):
+    """
+    The change feed of the offline clients. Instead of downloading every
+    list, task and comment on each launch a client asks for what changed
+    since the cursor it got last time and applies that.
+    get:
+    Returns up to limit changed rows of everything the user can reach, the
+    oldest changes first. upserts holds the rows that were made or edited
+    grouped by model, deletes the type and pk of the rows that are gone.
+    Keep cursor and send it next time, and keep going while next isnt null.
+    Without a cursor it starts from the beginning, which is a full sync.
+
+    Lists that somebody shares with the user show up as a UserListRelation
+    and their pk in resync, their rows are older than the cursor though so
+    sync them once with list=<pk> and no cursor. A list the user loses comes
+    back as a delete.
+    View counts are left alone, they dont move the cursor.
+
+    Request:
+        /api/v1.0/TaskMaster/Sync/?cursor=eyJwIjogWy...&limit=100
+    """
+    extra_url_params = (('cursor',
+                         'String',
+                         'The cursor of the last sync, leave it out for a '
+                         'full sync'),
+                        ('limit',
+                         'Integer',
+                         'How many rows to return, 100 by default and at '
+                         'most 500'),
+                        ('list',
+                         'Integer',
+                         'Only sync the list with this pk'))
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = int(request.GET.get("limit", settings.SYNC_PAGE_SIZE))
+            list_id = request.GET.get("list")
+            list_id = int(list_id) if list_id is not None else None
+        except ValueError:
+            return Response({"detail": "limit and list have to be numbers."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        task_lists = TaskList.reachable_by(request.user)
+        lost = Tombstone.objects.filter(user=request.user)
+        if list_id is not None:
+            task_lists = task_lists.filter(pk=list_id)
+            lost = lost.filter(object_id=list_id)
+        list_ids = task_lists.values("pk")
+        # A list the user got back (or still owns) isnt lost, and a task
+        # (or its comment) that moved to another of his lists isnt gone.
+        tombstones = (Tombstone.objects.filter(user=None,
+                                               list_id__in=list_ids) |
+                      lost.exclude(object_id__in=list_ids)) \
+            .exclude(kind="Task", object_id__in=Task.objects.filter(
+                LinkedTaskList__in=list_ids).values("pk")) \
+            .exclude(kind="TaskComment",
+                     object_id__in=TaskComment.objects.filter(
+                         LinkedTask__LinkedTaskList__in=list_ids)
+                     .values("pk"))
+
+        # Parents come before their children when they changed together.
+        pager = SyncPager(
+            [task_lists,
+             UserListRelation.objects.filter(LinkedTaskList__in=list_ids),
+             Task.objects.filter(LinkedTaskList__in=list_ids),
+             TaskListComment.objects.filter(LinkedTaskList__in=list_ids),
+             TaskComment.objects.filter(
+                 LinkedTask__LinkedTaskList__in=list_ids),
+             tombstones],
+            [TaskListSerializer, UserListRelationSerializer, TaskSerializer,
+             TaskListCommentSerializer, TaskCommentSerializer, None],
+            page_size=max(limit, 1))
+        page = pager.paginate(request)
+        resync = []
+        # Rank 1 is the UserListRelation queryset. The users own relations
+        # on this page mean lists to fetch whole, unless this is a full sync
+        # which has everything in them anyway.
+        relations = [pk for value, rank, pk in page if rank == 1]
+        if pager.start is not None and relations:
+            resync = UserListRelation.objects.filter(
+                pk__in=relations, user=request.user) \
+                .values_list("LinkedTaskList_id", flat=True).distinct()
+        return pager.get_paginated_response(page, resync)
+
+
 class UserCreateAPI(APIView):
     """
     post:
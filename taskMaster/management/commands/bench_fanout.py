@@ -0,0 +1,55 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from taskMaster.models import TaskList, Task, UserListRelation
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Times a Task save on lists shared with more and more members. " \
+           "Everything runs in a transaction that is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, nargs="+",
+                            default=[1, 10, 100, 500])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                for members in options["members"]:
+                    self.bench(members, options["repeat"])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def bench(self, members, repeat):
+        owner = User.objects.create_user("bench-owner-%d" % members)
+        task_list = TaskList.objects.create(title="Bench", description="",
+                                            owner=owner)
+        User.objects.bulk_create(
+            [User(username="bench-%d-%d" % (members, i))
+             for i in range(members)])
+        users = User.objects.filter(username__startswith="bench-%d-" %
+                                    members)
+        UserListRelation.objects.bulk_create(
+            [UserListRelation(LinkedTaskList=task_list, user=user,
+                              owner=owner, role="user") for user in users])
+        task = Task.objects.create(title="Bench", owner=owner,
+                                   LinkedTaskList=task_list)
+
+        timings = []
+        for i in range(repeat):
+            task.title = "Bench %d" % i  # New title, new notifications.
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                task.save()
+                timings.append(time.perf_counter() - start)
+        self.stdout.write("%5d members %8.2f ms per save %4d queries" % (
+            members, min(timings) * 1000, len(queries)))
@@ -0,0 +1,70 @@
+import timeit
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ReturnList
+
+from taskMaster.api import renderers
+
+
+class Command(BaseCommand):
+    help = "Compares size and encode time of the API renderers on a page " \
+           "of TaskList payloads shaped like TaskListSerializer output."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lists", type=int, default=100,
+                            help="TaskLists in the payload.")
+        parser.add_argument("--tasks", type=int, default=25,
+                            help="Tasks and comments per TaskList.")
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        data = self.payload(options["lists"], options["tasks"])
+        candidates = [("JSONRenderer (stdlib)", JSONRenderer())]
+        if renderers.orjson is not None:
+            candidates.append(("FastJSONRenderer (orjson)",
+                               renderers.FastJSONRenderer()))
+        else:
+            self.stderr.write("orjson not installed, FastJSONRenderer "
+                              "would fall back to the stdlib.")
+        if renderers.msgpack is not None:
+            candidates.append(("MessagePackRenderer",
+                               renderers.MessagePackRenderer()))
+        else:
+            self.stderr.write("msgpack not installed, skipping it.")
+
+        baseline = None
+        for name, renderer in candidates:
+            size = len(renderer.render(data))
+            seconds = min(timeit.repeat(lambda: renderer.render(data),
+                                        number=options["repeat"],
+                                        repeat=3)) / options["repeat"]
+            baseline = baseline or seconds
+            self.stdout.write("%-28s %10d bytes %9.3f ms %6.2fx" % (
+                name, size, seconds * 1000, baseline / seconds))
+
+    @staticmethod
+    def payload(lists, tasks):
+        base = "https://evening-shelf-60759.herokuapp.com/api/v1.0/" \
+               "TaskMaster/"
+        now = timezone.now()
+        data = ReturnList(serializer=None)
+        for pk in range(1, lists + 1):
+            task_pks = range(pk * tasks, pk * tasks + tasks)
+            data.append({
+                "url": "%sTaskList/%d/" % (base, pk),
+                "tasks": ", ".join(str(i) for i in task_pks),
+                "tasksUrl": ["%sTask/%d/" % (base, i) for i in task_pks],
+                "comments": list(task_pks),
+                "commentsUrl": ["%sTaskListComment/%d/" % (base, i)
+                                for i in task_pks],
+                "pk": pk,
+                "title": "Groceries for week %d" % pk,
+                "description": "Milk, eggs, bread and whatever is on sale. "
+                               "Dont forget the coffee ☕",
+                "owner": pk % 7 + 1,
+                "views": pk * 13,
+                "date_created": (now - timedelta(minutes=pk)).isoformat(),
+            })
+        return data
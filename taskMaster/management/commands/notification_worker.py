@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+
+from taskMaster import outbox
+
+
+class Command(BaseCommand):
+    help = "Turns queued NotificationEvents into Notifications. Run as " \
+           "many as you like, events are leased to one worker at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--lease", type=int, default=60,
+                            help="Seconds before an event a worker claimed "
+                                 "but never finished is handed out again.")
+        parser.add_argument("--poll", type=float, default=1.0,
+                            help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument("--once", action="store_true",
+                            help="Drain the outbox and exit.")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                delivered = outbox.process(options["batch_size"],
+                                           options["lease"])
+                if delivered:
+                    self.stdout.write("Delivered %d events." % delivered)
+                    continue
+                if options["once"]:
+                    return
+                time.sleep(options["poll"])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,102 @@
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from taskMaster.models import Notification, NotificationCounter
+
+
+class Command(BaseCommand):
+    help = "Deletes notifications past the retention policy in small " \
+           "chunks, optionally archiving them to gzipped NDJSON first."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.NOTIFICATION_RETENTION_DAYS,
+            help="Delete seen notifications older than this.")
+        parser.add_argument(
+            "--unseen-days", type=int,
+            default=settings.NOTIFICATION_UNSEEN_RETENTION_DAYS,
+            help="Delete unseen ones older than this too. Kept by default.")
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="Rows per DELETE, each in its own "
+                                 "transaction so no lock is held for long.")
+        parser.add_argument("--pause", type=float, default=0.05,
+                            help="Seconds to sleep between chunks.")
+        parser.add_argument("--archive", metavar="DIR",
+                            help="Write the pruned rows to a "
+                                 "notifications-<time>.ndjson.gz in DIR.")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only count what would be deleted.")
+
+    def handle(self, *args, **options):
+        expired = self.expired(options["days"], options["unseen_days"])
+        if options["dry_run"]:
+            self.stdout.write("Would delete %d notifications." %
+                              expired.count())
+            return
+        if not 0 < options["chunk_size"] <= 900:
+            raise CommandError("--chunk-size has to be between 1 and 900.")
+
+        archive = None
+        if options["archive"]:
+            path = os.path.join(options["archive"], "notifications-%s.ndjson"
+                                ".gz" % timezone.now().strftime(
+                                    "%Y%m%dT%H%M%S"))
+            archive = gzip.open(path, "wt", encoding="utf-8")
+        deleted = 0
+        try:
+            while True:
+                rows = list(expired.order_by("pk")
+                            .values()[:options["chunk_size"]])
+                if not rows:
+                    break
+                if archive is not None:
+                    for row in rows:
+                        archive.write(json.dumps(row, cls=DjangoJSONEncoder)
+                                      + "\n")
+                    archive.flush()
+                deleted += self.delete(expired, rows)
+                time.sleep(options["pause"])
+        finally:
+            if archive is not None:
+                archive.close()
+                self.stdout.write("Archived to %s" % path)
+        self.stdout.write("Deleted %d notifications." % deleted)
+
+    @staticmethod
+    def expired(days, unseen_days):
+        now = timezone.now()
+        lookup = Q(seen=True, date_created__lt=now - timedelta(days=days))
+        if unseen_days is not None:
+            lookup |= Q(seen=False,
+                        date_created__lt=now - timedelta(days=unseen_days))
+        return Notification.objects.filter(lookup)
+
+    @staticmethod
+    def delete(expired, rows):
+        """ Deletes one chunk and takes its unseen rows off the unread
+        counters in the same short transaction. Going through expired again
+        spares a row that got bumped since it was read, and the unseen ones
+        go per receiver with their own seen=False filter so I only subtract
+        what really went out unread. A row marked seen after the read was
+        already taken off by the seen path. """
+        chunk = expired.filter(pk__in=[row["id"] for row in rows])
+        deleted = 0
+        with transaction.atomic():
+            for user_id in {row["receiver_id"] for row in rows
+                            if not row["seen"]}:
+                count, _ = chunk.filter(receiver_id=user_id,
+                                        seen=False).delete()
+                if count:
+                    NotificationCounter.add([user_id], -count)
+                deleted += count
+            count, _ = chunk.delete()
+        return deleted + count
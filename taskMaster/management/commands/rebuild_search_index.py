@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS, transaction
+
+from taskMaster import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index from the model tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if search.backend(connection.alias) is None:
+            self.stderr.write("No search index installed on %s, searches "
+                              "use the icontains fallback." % connection.alias)
+            return
+        with transaction.atomic(using=connection.alias):
+            search.populate(connection)
+        self.stdout.write("Search index rebuilt.")
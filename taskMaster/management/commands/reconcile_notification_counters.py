@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from taskMaster.models import NotificationCounter
+
+
+class Command(BaseCommand):
+    help = "Recounts unread notifications and fixes the counters that " \
+           "drifted from them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("users", nargs="*", type=int,
+                            help="User ids to check, everybody by default.")
+
+    def handle(self, *args, **options):
+        wrong = NotificationCounter.reconcile(options["users"] or None)
+        self.stdout.write("Fixed %d counters." % wrong)
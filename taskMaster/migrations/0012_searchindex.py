@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from taskMaster import search
+
+
+def create_index(apps, schema_editor):
+    if search.install(schema_editor.connection):
+        search.populate(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskMaster', '0011_notification_deep_link_url'),
+        ('auth', '0009_alter_user_last_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
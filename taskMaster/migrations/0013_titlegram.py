@@ -0,0 +1,56 @@
+# Generated by Django 2.1 on 2026-10-18 18:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from taskMaster.search import edge_ngrams
+
+
+def populate_grams(apps, schema_editor):
+    TitleGram = apps.get_model('taskMaster', 'TitleGram')
+    sources = (
+        ('TaskList', 'id'),
+        ('Task', 'LinkedTaskList'),
+        ('TaskListComment', 'LinkedTaskList'),
+        ('TaskComment', 'LinkedTask__LinkedTaskList'),
+    )
+    for kind, list_field in sources:
+        model = apps.get_model('taskMaster', kind)
+        grams = [
+            TitleGram(gram=gram, position=position, kind=kind, object_id=pk,
+                      LinkedTaskList_id=list_id, title=title)
+            for pk, title, list_id in model.objects.values_list(
+                'pk', 'title', list_field)
+            for gram, position in edge_ngrams(title)]
+        TitleGram.objects.bulk_create(grams, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskMaster', '0012_searchindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TitleGram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=10)),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('title', models.CharField(max_length=55)),
+                ('position', models.IntegerField(default=0)),
+                ('LinkedTaskList', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='taskMaster.TaskList')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='titlegram',
+            index=models.Index(fields=['gram', 'LinkedTaskList'], name='taskMaster__gram_7a1618_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='titlegram',
+            index=models.Index(fields=['kind', 'object_id'], name='taskMaster__kind_8ab22b_idx'),
+        ),
+        migrations.RunPython(populate_grams, migrations.RunPython.noop),
+    ]
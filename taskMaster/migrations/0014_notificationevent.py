@@ -0,0 +1,26 @@
+# Generated by Django 2.1 on 2026-10-18 18:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskMaster', '0013_titlegram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=250)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=32)),
+                ('claimed_on', models.DateTimeField(null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('LinkedTaskList', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='taskMaster.TaskList')),
+            ],
+        ),
+    ]
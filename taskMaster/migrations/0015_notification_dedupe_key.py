@@ -0,0 +1,38 @@
+# Generated by Django 2.1 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskMaster', '0014_notificationevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='change_count',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='dedupe_key',
+            field=models.CharField(db_index=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='notificationevent',
+            name='changes',
+            field=models.CharField(default='', max_length=250),
+        ),
+        migrations.AddField(
+            model_name='notificationevent',
+            name='kind',
+            field=models.CharField(default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='notificationevent',
+            name='object_id',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.1 on 2026-10-18 19:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_unread(apps, schema_editor):
+    Notification = apps.get_model('taskMaster', 'Notification')
+    NotificationCounter = apps.get_model('taskMaster', 'NotificationCounter')
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id, unread=unread)
+         for user_id, unread in Notification.objects.filter(seen=False)
+         .values('receiver').annotate(unread=models.Count('pk'))
+         .values_list('receiver', 'unread')], batch_size=400)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0009_alter_user_last_name_max_length'),
+        ('taskMaster', '0015_notification_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
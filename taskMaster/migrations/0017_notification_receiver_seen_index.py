@@ -0,0 +1,17 @@
+# Generated by Django 2.1 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskMaster', '0016_notificationcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['receiver', 'seen', 'date_created'], name='taskMaster__receive_49d960_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.1 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskMaster', '0017_notification_receiver_seen_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['receiver', 'date_created', 'id'], name='taskMaster__receive_c342f3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['owner', 'date_created', 'id'], name='taskMaster__owner_i_a680f6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskcomment',
+            index=models.Index(fields=['owner', 'date_created', 'id'], name='taskMaster__owner_i_ce95ee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tasklist',
+            index=models.Index(fields=['date_created', 'id'], name='taskMaster__date_cr_403ec6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tasklistcomment',
+            index=models.Index(fields=['owner', 'date_created', 'id'], name='taskMaster__owner_i_7b1985_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlistrelation',
+            index=models.Index(fields=['date_created', 'id'], name='taskMaster__date_cr_409788_idx'),
+        ),
+    ]
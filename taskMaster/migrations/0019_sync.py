@@ -0,0 +1,51 @@
+# Generated by Django 2.1 on 2026-10-18 19:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('taskMaster', '0018_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('list_id', models.IntegerField(null=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['date_created', 'id'], name='taskMaster__date_cr_952cd7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskcomment',
+            index=models.Index(fields=['date_created', 'id'], name='taskMaster__date_cr_0d53e5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tasklistcomment',
+            index=models.Index(fields=['date_created', 'id'], name='taskMaster__date_cr_31e7d6_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['date_created', 'id'], name='taskMaster__date_cr_519e7d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['list_id', 'date_created'], name='taskMaster__list_id_ef3afc_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1 on 2026-10-18 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskMaster', '0020_cache_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='last_event_id',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.1 on 2026-10-19 09:12
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def clear_duplicate_keys(apps, schema_editor):
+    # Races before the index could leave two unseen rows for one object.
+    # The newest keeps the key, the rest stay unread but stop coalescing.
+    Notification = apps.get_model("taskMaster", "Notification")
+    newest = Notification.objects.filter(seen=False).exclude(dedupe_key="") \
+        .values("dedupe_key").annotate(rows=Count("pk"), newest=Max("pk")) \
+        .filter(rows__gt=1)
+    for row in newest:
+        Notification.objects.filter(
+            seen=False, dedupe_key=row["dedupe_key"],
+            pk__lt=row["newest"]).update(dedupe_key="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskMaster', '0021_notification_last_event_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicate_keys, migrations.RunPython.noop),
+        # Lists, a plain string would need sqlparse to be split.
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX "taskMaster_notification_unseen_dedupe" '
+             'ON "taskMaster_notification" ("dedupe_key") '
+             'WHERE NOT "seen" AND "dedupe_key" <> \'\''],
+            ['DROP INDEX "taskMaster_notification_unseen_dedupe"']),
+    ]
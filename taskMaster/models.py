@@ -1,11 +1,14 @@
-from django.db import models
+from collections import OrderedDict, defaultdict
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
 # Create your models here.
 from django.dispatch import receiver
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.reverse import reverse as api_reverse
 from django.core import signals
 from rest_framework.response import Response
+from taskMaster import acl, outbox, search, viewcounts
+from taskMaster.api.urlfactory import url_factory
 
 
 class TaskList(models.Model):
@@ -20,22 +23,41 @@ class TaskList(models.Model):
                     "date_created"]
     fields = ["title", "description"]
 
+    class Meta:
+        # ListPagination's cursor mode pages on (date_created, pk).
+        indexes = [models.Index(fields=["date_created", "id"])]
+
     def get_api_url(self, request=None):
-        return api_reverse("taskMaster-api:taskList-rud",
-                           kwargs={'pk': self.pk}, request=request)
+        return url_factory(request).build("taskMaster-api:taskList-rud",
+                                          self.pk)
 
     def get_tasks(self):
-        return ', '.join([str(Task.pk) for Task in
-                          Task.objects.filter(LinkedTaskList=self.pk)])
+        # Goes through the related manager so a prefetched task_set is used.
+        return ', '.join([str(Task.pk) for Task in self.task_set.all()])
 
     def increment(self):
-        self.views += 1
-        self.save()
+        viewcounts.record(self)
+
+    @staticmethod
+    def reachable_by(user):
+        """ QuerySet of the lists user owns or reaches through a
+        UserListRelation, either as the related user or as the one who made
+        the relation. The ids come from the cached ACL so the relation table
+        isnt touched, and every list shows up once without a DISTINCT while
+        the result can still be ordered, sliced and prefetched in SQL. """
+        list_ids = acl.load(user.pk)
+        if len(list_ids) <= acl.MAX_IN_IDS:
+            return TaskList.objects.filter(pk__in=list(list_ids))
+        relations = UserListRelation.objects.filter(
+            models.Q(user=user) | models.Q(owner=user)) \
+            .values("LinkedTaskList")
+        return TaskList.objects.filter(
+            models.Q(owner=user) | models.Q(pk__in=relations))
 
     @staticmethod
     def has_user_relation(obj, user):
         try:  # Keep calm and ignore best practices
-            if obj.owner == user:
+            if obj.owner_id == user.pk:
                 return True
             if UserListRelation.objects.get(user=user, LinkedTaskList=obj):
                 return True
@@ -47,7 +69,7 @@ class TaskList(models.Model):
     @staticmethod
     def user_is_admin(obj, user):
         try:  # Keep calm and ignore best practices
-            if obj.owner == user:
+            if obj.owner_id == user.pk:
                 return True
             temp = UserListRelation.objects.get(LinkedTaskList=obj, user=user)
             if temp.role.lower() == "admin" or temp.owner == user:
@@ -71,13 +93,90 @@ class Task(models.Model):
                     "views", "date_created"]
     fields = ["title", "LinkedTaskList", "completed"]
 
+    class Meta:
+        # The second one is for Sync/, which walks every list at once.
+        indexes = [models.Index(fields=["owner", "date_created", "id"]),
+                   models.Index(fields=["date_created", "id"])]
+
     def get_api_url(self, request=None):
-        return api_reverse("taskMaster-api:task-rud",
-                           kwargs={'pk': self.pk}, request=request)
+        return url_factory(request).build("taskMaster-api:task-rud",
+                                          self.pk)
 
     def increment(self):
-        self.views += 1
-        self.save()
+        viewcounts.record(self)
+
+    @staticmethod
+    def create_many(tasks):
+        """ Saves the unsaved tasks with bulk INSERTs in one transaction and
+        does what execute_after_save does for a task for all of them, with
+        one notification per list instead of one per task. LinkedTaskList
+        has to be set to the TaskList itself. Returns the tasks, pks set. """
+        with transaction.atomic():
+            Task.objects.bulk_create(tasks)
+            if tasks and tasks[0].pk is None:
+                # Only PostgreSQL hands the pks back. The INSERT holds
+                # SQLite's write lock until the commit though, so the
+                # newest len(tasks) rows are these, in order.
+                pks = Task.objects.order_by("-pk") \
+                    .values_list("pk", flat=True)[:len(tasks)]
+                for task, pk in zip(tasks, sorted(pks)):
+                    task.pk = pk
+
+            search.index_new(tasks)
+            search.index_new_titles(tasks)
+            lists = OrderedDict()
+            for task in tasks:
+                lists.setdefault(task.LinkedTaskList, []).append(task)
+            for task_list, added in lists.items():
+                search.forget_lists({task_list.pk})
+                outbox.enqueue(
+                    task_list.pk,
+                    f"{len(added)} tasks have been added to the "
+                    f"{type(task_list)}, called {task_list.title}",
+                    changes=", ".join(task.title for task in added))
+        return tasks
+
+    @staticmethod
+    def update_many(pks, changes):
+        """ Sets the fields in changes on the tasks in pks with one UPDATE
+        per 500 tasks and does what execute_after_save does for a task once
+        per list, both the lists the tasks were in and the one they moved
+        to. An UPDATE skips auto_now, date_created is set here instead. """
+        pks = list(pks)
+        titles = defaultdict(list)
+        target = changes.get("LinkedTaskList")
+        with transaction.atomic():
+            for i in range(0, len(pks), 500):
+                chunk = Task.objects.filter(pk__in=pks[i:i + 500])
+                moves = dict()
+                for pk, list_id, title in chunk.values_list(
+                        "pk", "LinkedTaskList_id", "title"):
+                    title = changes.get("title", title)
+                    titles[list_id].append(title)
+                    if target is not None and target.pk != list_id:
+                        titles[target.pk].append(title)
+                        moves[pk] = list_id
+                chunk.update(date_created=timezone.now(), **changes)
+                if moves:
+                    Tombstone.moved_tasks(moves)
+
+                # Titles and lists are what the search index holds, the
+                # comments of a moved task are in its list too.
+                if "title" in changes or target is not None:
+                    search.reindex(list(chunk.select_related("owner")))
+                if target is not None:
+                    search.reindex_many(TaskComment.objects.filter(
+                        LinkedTask__in=chunk)
+                        .select_related("owner", "LinkedTask"))
+
+            task_lists = TaskList.objects.in_bulk(list(titles))
+            search.forget_lists(titles)
+            for list_id, changed in titles.items():
+                outbox.enqueue(
+                    list_id,
+                    f"{len(changed)} tasks have been changed in the "
+                    f"{TaskList}, called {task_lists[list_id].title}",
+                    changes=", ".join(changed))
 
 
 class UserListRelation(models.Model):
@@ -94,9 +193,12 @@ class UserListRelation(models.Model):
                     "owner"]
     fields = ["LinkedTaskList", "user", "role"]
 
+    class Meta:
+        indexes = [models.Index(fields=["date_created", "id"])]
+
     def get_api_url(self, request=None):
-        return api_reverse("taskMaster-api:userListRelation-rud",
-                           kwargs={'pk': self.pk}, request=request)
+        return url_factory(request).build(
+            "taskMaster-api:userListRelation-rud", self.pk)
 
 
 class TaskComment(models.Model):
@@ -112,13 +214,16 @@ class TaskComment(models.Model):
                     "date_created"]
     fields = ["title", "description", "LinkedTask"]
 
+    class Meta:
+        indexes = [models.Index(fields=["owner", "date_created", "id"]),
+                   models.Index(fields=["date_created", "id"])]
+
     def get_api_url(self, request=None):
-        return api_reverse("taskMaster-api:taskComment-rud",
-                           kwargs={'pk': self.pk}, request=request)
+        return url_factory(request).build("taskMaster-api:taskComment-rud",
+                                          self.pk)
 
     def increment(self):
-        self.views += 1
-        self.save()
+        viewcounts.record(self)
 
 
 class TaskListComment(models.Model):
@@ -134,13 +239,16 @@ class TaskListComment(models.Model):
                     "date_created"]
     fields = ["title", "description", "LinkedTaskList"]
 
+    class Meta:
+        indexes = [models.Index(fields=["owner", "date_created", "id"]),
+                   models.Index(fields=["date_created", "id"])]
+
     def get_api_url(self, request=None):
-        return api_reverse("taskMaster-api:taskListComment-rud",
-                           kwargs={'pk': self.pk}, request=request)
+        return url_factory(request).build("taskMaster-api:taskListComment-rud",
+                                          self.pk)
 
     def increment(self):
-        self.views += 1
-        self.save()
+        viewcounts.record(self)
 
 
 class Notification(models.Model):
@@ -159,77 +267,301 @@ class Notification(models.Model):
     receiver = models.ForeignKey(User, on_delete=models.CASCADE,
                                  related_name="Notification_receiver")
     date_created = models.DateTimeField(auto_now=True)
+    # Hash of (receiver, model, pk) of what changed. Further changes to the
+    # same object bump change_count on the unseen row instead of adding rows.
+    # Migration 0022 makes it unique among the unseen rows, Django 2.1 cant
+    # declare a partial index here.
+    dedupe_key = models.CharField(max_length=40, default="", db_index=True)
+    change_count = models.IntegerField(default=1)
+    # The NotificationEvent that last created or bumped this row, so an
+    # event that gets delivered twice only counts once.
+    last_event_id = models.IntegerField(null=True)
 
     list_display = ["pk", "title", "seen", "seen_on", "receiver",
-                    "date_created", "deep_link_url"]
+                    "date_created", "deep_link_url", "change_count"]
     fields = ["title", "seen", "seen_on", "receiver", "deep_link_url"]
 
+    class Meta:
+        # Serves the users list, unseen first or only, newest first.
+        indexes = [
+            models.Index(fields=["receiver", "seen", "date_created"]),
+            models.Index(fields=["receiver", "date_created", "id"]),
+        ]
+
     def get_api_url(self, request=None):
-        return api_reverse("taskMaster-api:notifications-rud",
-                           kwargs={'pk': self.pk}, request=request)
+        return url_factory(request).build("taskMaster-api:notifications-rud",
+                                          self.pk)
+
+
+class NotificationCounter(models.Model):
+    """ Unread notifications of a user, kept next to the notifications so
+    a badge is a one row read instead of a COUNT. outbox.notify_members adds
+    to it, NotificationRUDView takes from it when a notification is seen and
+    manage.py reconcile_notification_counters puts it right if it drifts. """
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="notification_counter")
+    unread = models.IntegerField(default=0)
+
+    @staticmethod
+    def add(user_ids, amount=1):
+        """ Adds amount to the counter of every user in user_ids with one
+        UPDATE per chunk, creating the counters that dont exist yet. """
+        user_ids = list(set(user_ids))
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            counters = NotificationCounter.objects.filter(user_id__in=chunk)
+            existing = set(counters.values_list("user_id", flat=True))
+            counters.update(unread=models.F("unread") + amount)
+            missing = [NotificationCounter(user_id=user_id,
+                                           unread=max(amount, 0))
+                       for user_id in chunk if user_id not in existing]
+            try:
+                with transaction.atomic():
+                    NotificationCounter.objects.bulk_create(missing)
+            except IntegrityError:  # Somebody else made them meanwhile.
+                NotificationCounter.objects.filter(
+                    user_id__in=[counter.user_id for counter in missing]) \
+                    .update(unread=models.F("unread") + amount)
+
+    @staticmethod
+    def unread_for(user):
+        return NotificationCounter.objects.filter(user=user) \
+            .values_list("unread", flat=True).first() or 0
+
+    @staticmethod
+    def reconcile(user_ids=None):
+        """ Recounts the unread notifications of user_ids, or of everybody,
+        and returns how many counters were wrong. """
+        users = User.objects.all()
+        if user_ids is not None:
+            users = users.filter(pk__in=user_ids)
+        unread = dict(Notification.objects.filter(
+            seen=False, receiver__in=users).values("receiver")
+            .annotate(unread=models.Count("pk"))
+            .values_list("receiver", "unread"))
+        counters = dict(NotificationCounter.objects.filter(user__in=users)
+                        .values_list("user_id", "unread"))
+        wrong = 0
+        for user_id in set(unread) | set(counters):
+            count = unread.get(user_id, 0)
+            if counters.get(user_id) == count:
+                continue
+            wrong += 1
+            NotificationCounter.objects.update_or_create(
+                user_id=user_id, defaults={"unread": count})
+        return wrong
+
+
+class NotificationEvent(models.Model):
+    """ Outbox row for one change to a list. The save receivers write one of
+    these in the writers transaction and outbox.process turns it into a
+    Notification per member later. claimed_by/claimed_on lease the row to
+    one worker, a worker that dies lets the lease run out and the next one
+    picks the event up again. """
+    LinkedTaskList = models.ForeignKey(TaskList, on_delete=models.CASCADE)
+    title = models.CharField(max_length=250)
+    changes = models.CharField(max_length=250, default="")
+    # What changed, the notifications link to it and coalesce on it.
+    kind = models.CharField(max_length=20, default="")
+    object_id = models.IntegerField(null=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    claimed_by = models.CharField(max_length=32, default="", blank=True)
+    claimed_on = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0)
+
+
+class Tombstone(models.Model):
+    """ Left behind by every deleted row a client could have synced, so
+    Sync/ can tell it to drop its copy. Rows of a list are found through
+    list_id, it isnt a ForeignKey since the list may be gone too. Somebody
+    who loses a whole list (it was deleted or his relation was) gets a
+    TaskList tombstone addressed to him in user instead. """
+    kind = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    list_id = models.IntegerField(null=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Sync/ walks these on (date_created, pk) like the synced models.
+        indexes = [models.Index(fields=["date_created", "id"]),
+                   models.Index(fields=["list_id", "date_created"])]
+
+    @staticmethod
+    def moved_tasks(moves):
+        """ moves is {task pk: the list it left}. Tells the old lists the
+        tasks and their comments are gone from them, and bumps the comments
+        so the members of the new list sync them too. Sync/ drops these for
+        users who still reach the rows. """
+        comments = TaskComment.objects.filter(LinkedTask__in=list(moves))
+        rows = [Tombstone(kind="Task", object_id=pk, list_id=list_id)
+                for pk, list_id in moves.items()]
+        rows += [Tombstone(kind="TaskComment", object_id=pk,
+                           list_id=moves[task_id])
+                 for pk, task_id in comments.values_list("pk",
+                                                         "LinkedTask_id")]
+        Tombstone.objects.bulk_create(rows)
+        comments.update(date_created=timezone.now())
+
+    @staticmethod
+    def lost_list(list_id, user_ids):
+        Tombstone.objects.bulk_create(
+            Tombstone(kind="TaskList", object_id=list_id, list_id=list_id,
+                      user_id=user_id) for user_id in user_ids if user_id)
+
+
+class TitleGram(models.Model):
+    """ Edge n-grams of every searchable title, one row per word prefix.
+    Backs the Search/suggest/ typeahead and is maintained by the receivers
+    below through search.index_title. """
+    gram = models.CharField(max_length=search.MAX_GRAM)
+    kind = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    LinkedTaskList = models.ForeignKey(TaskList, on_delete=models.CASCADE)
+    title = models.CharField(max_length=55)
+    # Which word of the title the gram came from, earlier words rank higher.
+    position = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["gram", "LinkedTaskList"]),
+            models.Index(fields=["kind", "object_id"]),
+        ]
+
+
+@receiver(models.signals.post_init, sender=TaskList, weak=False)
+@receiver(models.signals.post_init, sender=UserListRelation, weak=False)
+def execute_after_init(sender, instance, *args, **kwargs):
+    # Remembers who the ACL of the row belonged to when it was loaded so
+    # the save receivers can tell if it moved. Read from __dict__ so a
+    # deferred field isnt fetched for this.
+    instance._acl_users = {instance.__dict__.get("owner_id"),
+                           instance.__dict__.get("user_id")}
+
+
+@receiver(models.signals.post_init, sender=Task, weak=False)
+def execute_after_task_init(sender, instance, *args, **kwargs):
+    # The list the task was loaded in, so the save receiver can tell that
+    # it moved.
+    instance._loaded_list_id = instance.__dict__.get("LinkedTaskList_id")
 
 
 @receiver(models.signals.post_save, sender=TaskList, weak=False)
 def execute_after_save(sender, instance, created, *args, **kwargs):
-    receivers = UserListRelation.objects.filter(LinkedTaskList=instance)
-    for i in receivers:
-        notification, created = Notification.objects.get_or_create(
-            title=f"A change has been made to the {type(instance)}, "
-                  f"called {instance.title}",
-            seen=False,
-            deep_link_url=i.get_api_url(),
-            receiver=i.user,
-        )
+    search.index(instance)
+    search.index_title(instance)
+    search.forget_lists({instance.pk})
+    # Most saves are edits of the title or description, the ACL only cares
+    # about new lists and ones that changed owner.
+    if created or instance.owner_id not in instance._acl_users:
+        acl.forget(instance._acl_users | {instance.owner_id})
+    instance._acl_users = {instance.owner_id, None}
+    outbox.enqueue(
+        instance.pk,
+        f"A change has been made to the {type(instance)}, "
+        f"called {instance.title}", instance, created)
 
 
 @receiver(models.signals.post_save, sender=Task, weak=False)
 def execute_after_save(sender, instance, created, *args, **kwargs):
-    receivers = UserListRelation.objects.filter(LinkedTaskList=
-                                                instance.LinkedTaskList)
-    for i in receivers:
-        notification, created = Notification.objects.get_or_create(
-            title=f"A change has been made to the {type(instance)}, "
-                  f"called {instance.title}",
-            seen=False,
-            deep_link_url=i.get_api_url(),
-            receiver=i.user,
-        )
+    search.index(instance)
+    search.index_title(instance)
+    old_list_id = instance._loaded_list_id
+    if not created and old_list_id not in (None, instance.LinkedTaskList_id):
+        # The comments are indexed under the list of their task, and the
+        # members of the old list shouldnt find them anymore.
+        search.reindex_many(TaskComment.objects.filter(LinkedTask=instance)
+                            .select_related("owner", "LinkedTask"))
+        Tombstone.moved_tasks({instance.pk: old_list_id})
+    search.forget_lists({instance.LinkedTaskList_id, old_list_id})
+    instance._loaded_list_id = instance.LinkedTaskList_id
+    outbox.enqueue(
+        instance.LinkedTaskList_id,
+        f"A change has been made to the {type(instance)}, "
+        f"called {instance.title}", instance, created)
 
 
 @receiver(models.signals.post_save, sender=TaskListComment, weak=False)
 def execute_after_save(sender, instance, created, *args, **kwargs):
-    receivers = UserListRelation.objects.filter(LinkedTaskList=
-                                                instance.LinkedTaskList)
-    for i in receivers:
-        notification, created = Notification.objects.get_or_create(
-            title=f"A change has been made to the {type(instance)}, "
-                  f"called {instance.title}",
-            seen=False,
-            deep_link_url=i.get_api_url(),
-            receiver=i.user,
-        )
+    search.index(instance)
+    search.index_title(instance)
+    search.forget_lists({instance.LinkedTaskList_id})
+    outbox.enqueue(
+        instance.LinkedTaskList_id,
+        f"A change has been made to the {type(instance)}, "
+        f"called {instance.title}", instance, created)
 
 
 @receiver(models.signals.post_save, sender=TaskComment, weak=False)
 def execute_after_save(sender, instance, created, *args, **kwargs):
-    receivers = UserListRelation.objects. \
-        filter(LinkedTaskList=instance.LinkedTask.LinkedTaskList)
-    for i in receivers:
-        notification, created = Notification.objects.get_or_create(
-            title=f"A change has been made to the {type(instance)}, "
-                  f"called {instance.title}",
-            seen=False,
-            deep_link_url=i.get_api_url(),
-            receiver=i.user,
-        )
+    search.index(instance)
+    search.index_title(instance)
+    search.forget_lists({instance.LinkedTask.LinkedTaskList_id})
+    outbox.enqueue(
+        instance.LinkedTask.LinkedTaskList_id,
+        f"A change has been made to the {type(instance)}, "
+        f"called {instance.title}", instance, created)
 
 
 @receiver(models.signals.post_save, sender=UserListRelation, weak=False)
 def execute_after_save(sender, instance, created, *args, **kwargs):
-    notification, created = Notification.objects.get_or_create(
-        title=f"A change has been made to the {type(instance)}, "
-              f"with the list called {instance.LinkedTaskList.title}",
-        seen=False,
-        receiver=instance.user,
-        deep_link_url=instance.get_api_url(),
-    )
+    search.forget_results(instance._acl_users |
+                          {instance.user_id, instance.owner_id})
+    acl.forget(instance._acl_users | {instance.user_id, instance.owner_id})
+    instance._acl_users = {instance.user_id, instance.owner_id}
+    # Only the related user hears about it, so there is nothing to queue.
+    outbox.notify_members(
+        UserListRelation.objects.filter(pk=instance.pk),
+        f"A change has been made to the {type(instance)}, "
+        f"with the list called {instance.LinkedTaskList.title}",
+        "UserListRelation", instance.pk)
+
+
+@receiver(models.signals.post_delete, sender=TaskList, weak=False)
+@receiver(models.signals.post_delete, sender=Task, weak=False)
+@receiver(models.signals.post_delete, sender=TaskListComment, weak=False)
+@receiver(models.signals.post_delete, sender=TaskComment, weak=False)
+def execute_after_delete(sender, instance, *args, **kwargs):
+    search.unindex(instance)
+    search.unindex_title(instance)
+    if sender is TaskList:
+        list_id = instance.pk
+    elif sender is TaskComment:
+        # The task is already gone when this is a cascade from its deletion,
+        # and the task's own receiver has taken care of the list then.
+        list_id = Task.objects.filter(pk=instance.LinkedTask_id) \
+            .values_list("LinkedTaskList_id", flat=True).first()
+    else:
+        list_id = instance.LinkedTaskList_id
+    search.forget_lists({list_id})
+    if sender is TaskList:
+        acl.forget({instance.owner_id})
+        Tombstone.lost_list(instance.pk, {instance.owner_id})
+    elif list_id is not None:
+        Tombstone.objects.create(kind=sender.__name__, object_id=instance.pk,
+                                 list_id=list_id)
+
+
+@receiver(models.signals.post_delete, sender=UserListRelation, weak=False)
+def execute_after_relation_delete(sender, instance, *args, **kwargs):
+    search.forget_results({instance.user_id, instance.owner_id})
+    acl.forget({instance.user_id, instance.owner_id})
+    # Both sides may have lost the list, Sync/ drops the tombstone for
+    # whoever can still reach it.
+    Tombstone.objects.create(kind="UserListRelation", object_id=instance.pk,
+                             list_id=instance.LinkedTaskList_id)
+    Tombstone.lost_list(instance.LinkedTaskList_id,
+                        {instance.user_id, instance.owner_id})
+
+
+@receiver(models.signals.post_save, sender=User, weak=False)
+def execute_after_user_save(sender, instance, created, update_fields=None,
+                            *args, **kwargs):
+    # Owner names are part of the search index. Logins only touch last_login
+    # so they are skipped.
+    name_fields = {"first_name", "last_name", "username"}
+    if created or (update_fields and not name_fields & set(update_fields)):
+        return
+    for model in (TaskList, Task, TaskListComment, TaskComment):
+        search.index_many(model.objects.filter(owner=instance))
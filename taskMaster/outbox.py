@@ -0,0 +1,227 @@
+""" This is outbox.py and it moves notification fan-out out of the write
+path. A save used to create a Notification for every member of the list
+before it returned, now it writes one NotificationEvent in the same
+transaction and process() expands the events into Notification rows later,
+either from manage.py notification_worker or from a small thread pool in the
+web process when NOTIFICATION_WORKER_THREADS is set.
+
+Delivery is at least once. An event is leased to one worker and deleted
+once its notifications are written, a worker that dies in between leaves
+the lease to run out so the event is delivered again. Every notification
+remembers the last event applied to it and a second delivery skips the
+rows that already carry its id, so change_count is only bumped once. An
+event that failed NOTIFICATION_MAX_ATTEMPTS times is not handed out any
+more, it stays in the table with its attempts so somebody can look at it. """
+import hashlib
+import logging
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from taskMaster import wakeup
+from taskMaster.api.urlfactory import url_factory
+
+logger = logging.getLogger(__name__)
+
+# Existing notifications are looked up this many receivers at a time, which
+# keeps the IN clause under sqlite's 999 parameter limit.
+NOTIFY_CHUNK_SIZE = 500
+
+# Where a notification about a model links to.
+DEEP_LINKS = {
+    "TaskList": "taskMaster-api:taskList-rud",
+    "Task": "taskMaster-api:task-rud",
+    "TaskListComment": "taskMaster-api:taskListComment-rud",
+    "TaskComment": "taskMaster-api:taskComment-rud",
+    "UserListRelation": "taskMaster-api:userListRelation-rud",
+}
+
+_executor = None
+
+
+def enqueue(list_id, title, target=None, created=False, changes=""):
+    """ Records that every member of list_id should be told title. target
+    is the object that changed, members get one notification per target
+    that counts the changes until they see it. Without one it is about the
+    list itself. """
+    NotificationEvent = apps.get_model("taskMaster", "NotificationEvent")
+    event = NotificationEvent(LinkedTaskList_id=list_id, title=title,
+                              changes=changes[:250])
+    if target is not None:
+        event.kind = type(target).__name__
+        event.object_id = target.pk
+        event.changes = ("%s \"%s\" was %s" % (
+            event.kind, target.title,
+            "created" if created else "changed"))[:250]
+    event.save()
+    if getattr(settings, "NOTIFICATION_WORKER_THREADS", 0):
+        transaction.on_commit(_kick)
+    return event
+
+
+def _kick():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            settings.NOTIFICATION_WORKER_THREADS,
+            thread_name_prefix="notifications")
+    _executor.submit(_process_in_thread)
+
+
+def _process_in_thread():
+    # Pool threads live past the request that kicked them, so they drop
+    # broken or expired connections like a request would.
+    close_old_connections()
+    try:
+        process()
+    finally:
+        close_old_connections()
+
+
+def claim(batch_size=100, lease=60):
+    """ Leases up to batch_size events nobody holds, or whose lease of lease
+    seconds ran out, and returns them oldest first. Events that used up
+    their attempts are skipped. """
+    NotificationEvent = apps.get_model("taskMaster", "NotificationEvent")
+    now = timezone.now()
+    free = (Q(claimed_on__isnull=True) |
+            Q(claimed_on__lt=now - timedelta(seconds=lease))) & \
+        Q(attempts__lt=settings.NOTIFICATION_MAX_ATTEMPTS)
+    pks = list(NotificationEvent.objects.filter(free).order_by("pk")
+               .values_list("pk", flat=True)[:batch_size])
+    if not pks:
+        return []
+    # The filter is repeated so a worker that leased the same rows in the
+    # meantime wins and this one only gets what is left.
+    token = uuid.uuid4().hex
+    NotificationEvent.objects.filter(free, pk__in=pks).update(
+        claimed_by=token, claimed_on=now, attempts=F("attempts") + 1)
+    return list(NotificationEvent.objects.filter(claimed_by=token)
+                .order_by("pk"))
+
+
+def process(batch_size=100, lease=60):
+    """ Delivers one batch of events and returns how many were delivered.
+    An event that fails stays leased and is retried once the lease ends,
+    until it runs out of attempts. """
+    NotificationEvent = apps.get_model("taskMaster", "NotificationEvent")
+    delivered = []
+    for event in claim(batch_size, lease):
+        try:
+            with transaction.atomic():
+                deliver(event)
+                NotificationEvent.objects.filter(
+                    pk=event.pk, claimed_by=event.claimed_by).delete()
+        except Exception:
+            logger.exception("Delivering notification event %d failed "
+                             "(attempt %d of %d)", event.pk, event.attempts,
+                             settings.NOTIFICATION_MAX_ATTEMPTS)
+            continue
+        delivered.append(event)
+    return len(delivered)
+
+
+def deliver(event):
+    UserListRelation = apps.get_model("taskMaster", "UserListRelation")
+    # Events queued before they had a target count as list changes.
+    kind = event.kind or "TaskList"
+    object_id = event.object_id or event.LinkedTaskList_id
+    return notify_members(UserListRelation.objects.filter(
+        LinkedTaskList_id=event.LinkedTaskList_id), event.title, kind,
+        object_id, event.changes, event_id=event.pk)
+
+
+def dedupe_key(user_id, kind, object_id):
+    return hashlib.sha1(("%s:%s:%s" % (user_id, kind, object_id))
+                        .encode("ascii")).hexdigest()
+
+
+def notify_members(relations, title, kind, object_id, changes="",
+                   event_id=None):
+    """ Tells the user of every relation in relations that the kind with
+    object_id changed. Users with an unseen notification about that object
+    get it bumped (change_count, title, changes and date) and everybody
+    else gets a new one, so it is one query for the relations, one to find
+    the unseen rows, one UPDATE and one bulk INSERT however big the list.
+    Users whose notification already has event_id are left alone.
+    Returns the new notifications. """
+    Notification = apps.get_model("taskMaster", "Notification")
+    link = url_factory().build(DEEP_LINKS[kind], object_id)
+    receivers = OrderedDict()
+    for user_id in relations.values_list("user_id", flat=True):
+        receivers[dedupe_key(user_id, kind, object_id)] = user_id
+    if not receivers:
+        return []
+
+    user_ids = set(receivers.values())
+    keys = list(receivers)
+    now = timezone.now()
+
+    def bump(taken):
+        unseen = Notification.objects.filter(seen=False,
+                                             dedupe_key__in=taken)
+        if event_id is not None:
+            unseen = unseen.exclude(last_event_id=event_id)
+        unseen.update(
+            change_count=F("change_count") + 1, title=title, changes=changes,
+            deep_link_url=link, date_created=now, last_event_id=event_id)
+
+    for i in range(0, len(keys), NOTIFY_CHUNK_SIZE):
+        chunk = Notification.objects.filter(
+            dedupe_key__in=keys[i:i + NOTIFY_CHUNK_SIZE])
+        applied, existing = set(), set()
+        if event_id is not None:
+            chunk = chunk.filter(Q(seen=False) | Q(last_event_id=event_id))
+        else:
+            chunk = chunk.filter(seen=False)
+        for key, seen, last_event_id in chunk.values_list(
+                "dedupe_key", "seen", "last_event_id"):
+            if event_id is not None and last_event_id == event_id:
+                applied.add(key)
+            elif not seen:
+                existing.add(key)
+        existing -= applied
+        if existing:
+            bump(existing)
+        for key in existing | applied:
+            del receivers[key]
+    rows = [Notification(title=title, changes=changes, seen=False,
+                         deep_link_url=link, receiver_id=user_id,
+                         dedupe_key=key, last_event_id=event_id)
+            for key, user_id in receivers.items()]
+    created = insert_unseen(rows, bump)
+    # Coalesced rows were already unread, only new ones move the badge.
+    NotificationCounter = apps.get_model("taskMaster", "NotificationCounter")
+    NotificationCounter.add(row.receiver_id for row in created)
+    transaction.on_commit(lambda: wakeup.notify(user_ids))
+    return created
+
+
+def insert_unseen(rows, bump):
+    """ Inserts rows, new unseen notifications, and returns the ones that
+    went in. Another worker may have written the unseen row for one of the
+    objects since notify_members looked, the unique index on unseen dedupe
+    keys turns that into an IntegrityError and then it goes row by row and
+    calls bump with the keys that were taken. """
+    Notification = apps.get_model("taskMaster", "Notification")
+    try:
+        with transaction.atomic():
+            return Notification.objects.bulk_create(rows)
+    except IntegrityError:
+        pass
+    created = []
+    for row in rows:
+        try:
+            with transaction.atomic():
+                row.save(force_insert=True)
+        except IntegrityError:
+            bump([row.dedupe_key])
+        else:
+            created.append(row)
+    return created
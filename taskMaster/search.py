@@ -0,0 +1,600 @@
+""" This is search.py and it owns the full-text index that SearchAPI reads
+from. Titles, descriptions and owner names of TaskList, Task,
+TaskListComment and TaskComment are copied into one index table so a search
+only touches the rows that actually match instead of scanning four tables
+and auth_user with icontains.
+
+SQLite gets an FTS5 virtual table and PostgreSQL gets a plain table with a
+weighted tsvector column behind a GIN index. Both are created by migration
+0012 and kept current by the post_save/post_delete receivers in models.py.
+Any other database (or a SQLite build without FTS5) falls back to the old
+icontains filters so nothing breaks, it just stays slow.
+
+Search responses are cached in the "search" cache, which is local memory
+and so one per process, under a key that embeds a version of the user and
+one of every list the user reaches. The versions live in the shared
+default cache, read with one get_many, so a change invalidates the cached
+searches of every process at once, the stale copies just arent looked up
+anymore. A change to a list replaces the version of that list, one key
+however many members it has, and forget_results replaces the versions of
+users whose access changed. """
+import hashlib
+import heapq
+import math
+import re
+import uuid
+from bisect import bisect_left
+from collections import defaultdict, OrderedDict
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.functions import Length
+
+INDEX_TABLE = "taskMaster_searchindex"
+
+# The position of a model in this tuple is baked into the sqlite rowid, so
+# only ever append to it.
+INDEXED_MODELS = ("TaskList", "Task", "TaskListComment", "TaskComment")
+
+# Longest edge n-gram kept for typeahead, longer prefixes are matched on
+# their first MAX_GRAM characters and checked against the title afterwards.
+MAX_GRAM = 10
+
+# Relevance weights of the indexed columns, a title hit counts four times as
+# much as a description hit.
+WEIGHTS = (("title", 4.0), ("description", 1.0), ("owner", 0.5))
+
+# How to reach the TaskList of every indexed model, used to keep relevance
+# searches inside the lists a user can see.
+_LIST_LOOKUPS = {
+    "TaskList": "pk__in",
+    "Task": "LinkedTaskList__in",
+    "TaskListComment": "LinkedTaskList__in",
+    "TaskComment": "LinkedTask__LinkedTaskList__in",
+}
+
+# Which backends have the index installed, filled in on first use.
+_installed = dict()
+
+
+def backend(using=DEFAULT_DB_ALIAS):
+    """ Returns the vendor name if the index table exists, otherwise None. """
+    connection = connections[using]
+    if connection.alias not in _installed:
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+        _installed[connection.alias] = INDEX_TABLE in tables
+    if _installed[connection.alias] and \
+            connection.vendor in ("sqlite", "postgresql"):
+        return connection.vendor
+    return None
+
+
+def tokenize(text):
+    return re.findall(r"\w+", str(text).lower())
+
+
+def owner_text(user):
+    return " ".join([user.first_name, user.last_name, user.username])
+
+
+def _list_id(instance):
+    kind = type(instance).__name__
+    if kind == "TaskList":
+        return instance.pk
+    if kind == "TaskComment":
+        return instance.LinkedTask.LinkedTaskList_id
+    return instance.LinkedTaskList_id
+
+
+def _rowid(kind, pk):
+    return pk * len(INDEXED_MODELS) + INDEXED_MODELS.index(kind)
+
+
+def index(instance, using=DEFAULT_DB_ALIAS):
+    """ Inserts or refreshes the index row of a single object. """
+    vendor = backend(using)
+    if vendor is None:
+        return
+    kind = type(instance).__name__
+    row = [kind, instance.pk, _list_id(instance), instance.title,
+           getattr(instance, "description", ""), owner_text(instance.owner)]
+    table = connections[using].ops.quote_name(INDEX_TABLE)
+    with connections[using].cursor() as cursor:
+        if vendor == "sqlite":
+            # FTS5 only has an index on the rowid, so that is what we key on.
+            rowid = _rowid(kind, instance.pk)
+            cursor.execute("DELETE FROM %s WHERE rowid = %%s" % table,
+                           [rowid])
+            cursor.execute(
+                "INSERT INTO %s (rowid, kind, object_id, list_id, title, "
+                "description, owner) VALUES (%%s, %%s, %%s, %%s, %%s, %%s, "
+                "%%s)" % table, [rowid] + row)
+        else:
+            cursor.execute(
+                "INSERT INTO %s (kind, object_id, list_id, title, "
+                "description, owner) VALUES (%%s, %%s, %%s, %%s, %%s, %%s) "
+                "ON CONFLICT (kind, object_id) DO UPDATE SET "
+                "list_id = EXCLUDED.list_id, title = EXCLUDED.title, "
+                "description = EXCLUDED.description, owner = EXCLUDED.owner"
+                % table, row)
+            cursor.execute(
+                "UPDATE %s SET document = %s WHERE kind = %%s AND "
+                "object_id = %%s" % (table, _PG_DOCUMENT),
+                [kind, instance.pk])
+
+
+def index_new(instances, using=DEFAULT_DB_ALIAS):
+    """ index() for many objects of one model that were just created, with
+    one executemany instead of a statement or three per object. """
+    vendor = backend(using)
+    if vendor is None or not instances:
+        return
+    kind = type(instances[0]).__name__
+    rows = [[kind, instance.pk, _list_id(instance), instance.title,
+             getattr(instance, "description", ""),
+             owner_text(instance.owner)] for instance in instances]
+    table = connections[using].ops.quote_name(INDEX_TABLE)
+    with connections[using].cursor() as cursor:
+        if vendor == "sqlite":
+            cursor.executemany(
+                "INSERT INTO %s (rowid, kind, object_id, list_id, title, "
+                "description, owner) VALUES (%%s, %%s, %%s, %%s, %%s, %%s, "
+                "%%s)" % table,
+                [[_rowid(kind, row[1])] + row for row in rows])
+            return
+        cursor.executemany(
+            "INSERT INTO %s (kind, object_id, list_id, title, description, "
+            "owner) VALUES (%%s, %%s, %%s, %%s, %%s, %%s)" % table, rows)
+        pks = [row[1] for row in rows]
+        for i in range(0, len(pks), 500):
+            chunk = pks[i:i + 500]
+            cursor.execute(
+                "UPDATE %s SET document = %s WHERE kind = %%s AND "
+                "object_id IN (%s)" % (table, _PG_DOCUMENT,
+                                       ", ".join(["%s"] * len(chunk))),
+                [kind] + chunk)
+
+
+def reindex(instances, using=DEFAULT_DB_ALIAS):
+    """ Throws away the index rows and grams of instances, at most 500
+    objects of one model, and writes them again with index_new and
+    index_new_titles. For objects changed with a queryset update(). """
+    if not instances:
+        return
+    TitleGram = apps.get_model("taskMaster", "TitleGram")
+    kind = type(instances[0]).__name__
+    pks = [instance.pk for instance in instances]
+    TitleGram.objects.filter(kind=kind, object_id__in=pks).delete()
+    vendor = backend(using)
+    if vendor is not None:
+        table = connections[using].ops.quote_name(INDEX_TABLE)
+        placeholders = ", ".join(["%s"] * len(pks))
+        with connections[using].cursor() as cursor:
+            if vendor == "sqlite":
+                cursor.execute("DELETE FROM %s WHERE rowid IN (%s)"
+                               % (table, placeholders),
+                               [_rowid(kind, pk) for pk in pks])
+            else:
+                cursor.execute("DELETE FROM %s WHERE kind = %%s AND "
+                               "object_id IN (%s)" % (table, placeholders),
+                               [kind] + pks)
+    index_new(instances, using=using)
+    index_new_titles(instances)
+
+
+def reindex_many(queryset, using=DEFAULT_DB_ALIAS):
+    """ reindex() for a queryset of any size, 500 objects at a time. The
+    queryset should select_related what _list_id and owner_text read. """
+    pks = list(queryset.values_list("pk", flat=True))
+    for i in range(0, len(pks), 500):
+        reindex(list(queryset.filter(pk__in=pks[i:i + 500])), using=using)
+
+
+def index_many(queryset, using=DEFAULT_DB_ALIAS):
+    for instance in queryset.select_related("owner"):
+        index(instance, using=using)
+
+
+def unindex(instance, using=DEFAULT_DB_ALIAS):
+    vendor = backend(using)
+    if vendor is None:
+        return
+    kind = type(instance).__name__
+    table = connections[using].ops.quote_name(INDEX_TABLE)
+    with connections[using].cursor() as cursor:
+        if vendor == "sqlite":
+            cursor.execute("DELETE FROM %s WHERE rowid = %%s" % table,
+                           [_rowid(kind, instance.pk)])
+        else:
+            cursor.execute("DELETE FROM %s WHERE kind = %%s AND "
+                           "object_id = %%s" % table, [kind, instance.pk])
+
+
+def edge_ngrams(title):
+    """ Every prefix of every word of title up to MAX_GRAM characters, as
+    (gram, word position) pairs. """
+    grams = set()
+    for position, token in enumerate(tokenize(title)):
+        for length in range(1, min(len(token), MAX_GRAM) + 1):
+            grams.add((token[:length], position))
+    return sorted(grams)
+
+
+def index_title(instance):
+    """ Refreshes the TitleGram rows of instance, unless the title and list
+    are the same as last time which is the common case on save. """
+    TitleGram = apps.get_model("taskMaster", "TitleGram")
+    kind = type(instance).__name__
+    list_id = _list_id(instance)
+    existing = TitleGram.objects.filter(kind=kind, object_id=instance.pk)
+    if existing.values_list("title", "LinkedTaskList_id").first() == \
+            (instance.title, list_id):
+        return
+    existing.delete()
+    TitleGram.objects.bulk_create([
+        TitleGram(gram=gram, position=position, kind=kind,
+                  object_id=instance.pk, LinkedTaskList_id=list_id,
+                  title=instance.title)
+        for gram, position in edge_ngrams(instance.title)])
+
+
+def index_new_titles(instances):
+    """ index_title() for objects that were just created and so have no
+    grams yet, one bulk INSERT for all of them. """
+    TitleGram = apps.get_model("taskMaster", "TitleGram")
+    TitleGram.objects.bulk_create([
+        TitleGram(gram=gram, position=position,
+                  kind=type(instance).__name__, object_id=instance.pk,
+                  LinkedTaskList_id=_list_id(instance), title=instance.title)
+        for instance in instances
+        for gram, position in edge_ngrams(instance.title)])
+
+
+def unindex_title(instance):
+    TitleGram = apps.get_model("taskMaster", "TitleGram")
+    TitleGram.objects.filter(kind=type(instance).__name__,
+                             object_id=instance.pk).delete()
+
+
+def suggest(prefix, lists, limit):
+    """ Titles in the TaskList queryset lists with a word starting with the
+    last word of prefix, as (kind, pk, title) tuples. Any earlier words of
+    prefix have to appear in the title as well. """
+    TitleGram = apps.get_model("taskMaster", "TitleGram")
+    tokens = tokenize(prefix)
+    if not tokens:
+        return []
+    last = tokens[-1]
+    grams = TitleGram.objects.filter(gram=last[:MAX_GRAM],
+                                     LinkedTaskList__in=lists)
+    for token in tokens[:-1]:
+        grams = grams.filter(title__icontains=token)
+    grams = grams.order_by("position", Length("title"), "title", "pk")
+
+    # A title repeating the prefix has a gram per matching word, so fetch a
+    # few extra rows and keep the first of each object.
+    suggestions = OrderedDict()
+    rows = grams.values_list("kind", "object_id", "title")[:limit * 3]
+    for kind, pk, title in rows:
+        if len(last) > MAX_GRAM and not any(
+                word.startswith(last) for word in tokenize(title)):
+            continue
+        suggestions.setdefault((kind, pk), title)
+    return [(kind, pk, title) for (kind, pk), title in
+            list(suggestions.items())[:limit]]
+
+
+def match_expression(query, vendor):
+    """ Every word of the query has to prefix-match a word in the document,
+    which is as close as a token index gets to the old substring search. """
+    tokens = tokenize(query)
+    if not tokens:
+        return None
+    if vendor == "sqlite":
+        return " ".join('"%s"*' % token for token in tokens)
+    return " & ".join("%s:*" % token for token in tokens)
+
+
+def filter_queryset(queryset, query):
+    """ Narrows one of the INDEXED_MODELS querysets down to the objects that
+    match query. The result is still a lazy QuerySet so ordering, slicing
+    and access filters keep running in SQL. """
+    model = queryset.model
+    vendor = backend(queryset.db)
+    if vendor is None:
+        return queryset.filter(_legacy_filter(model, query))
+
+    expression = match_expression(query, vendor)
+    if expression is None:
+        return queryset.none()
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(INDEX_TABLE)
+    pk_column = "%s.%s" % (connection.ops.quote_name(model._meta.db_table),
+                           connection.ops.quote_name(model._meta.pk.column))
+    if vendor == "sqlite":
+        where = "%s IN (SELECT object_id FROM %s WHERE %s MATCH %%s AND " \
+                "kind = %%s)" % (pk_column, table, table)
+    else:
+        where = "%s IN (SELECT object_id FROM %s WHERE document @@ " \
+                "to_tsquery('simple', %%s) AND kind = %%s)" % (pk_column,
+                                                                table)
+    return queryset.extra(where=[where], params=[expression, model.__name__])
+
+
+def rank(query, lists, limit):
+    """ Scores every indexed object in the TaskList queryset lists against
+    query and returns the best limit of them as (score, kind, pk) tuples,
+    best first. FTS5 ranks with its built-in bm25() and postgres with
+    ts_rank over the weighted document, both inside the index query.
+    Anything else builds an InvertedIndex of the lists on the fly. """
+    vendor = backend(lists.db)
+    if vendor is None:
+        return _rank_in_python(query, lists, limit)
+    expression = match_expression(query, vendor)
+    if expression is None:
+        return []
+
+    connection = connections[lists.db]
+    table = connection.ops.quote_name(INDEX_TABLE)
+    lists_sql, lists_params = lists.values("pk").query.sql_with_params()
+    if vendor == "sqlite":
+        # bm25() takes a weight per column, unindexed ones included, and
+        # returns lower-is-better scores.
+        weights = ", ".join(["0"] * 3 + [str(w) for name, w in WEIGHTS])
+        sql = "SELECT -bm25(%s, %s) AS score, kind, object_id FROM %s " \
+              "WHERE %s MATCH %%s AND list_id IN (%s) ORDER BY score DESC " \
+              "LIMIT %%s" % (table, weights, table, table, lists_sql)
+        params = [expression] + list(lists_params) + [limit]
+    else:
+        # ts_rank wants the weights of D, C, B and A in that order.
+        sql = "SELECT ts_rank('{0.1, %s, %s, %s}', document, " \
+              "to_tsquery('simple', %%s)) AS score, kind, object_id FROM " \
+              "%s WHERE document @@ to_tsquery('simple', %%s) AND list_id " \
+              "IN (%s) ORDER BY score DESC LIMIT %%s" % (
+                  WEIGHTS[2][1] / WEIGHTS[0][1],
+                  WEIGHTS[1][1] / WEIGHTS[0][1], 1.0, table, lists_sql)
+        params = [expression, expression] + list(lists_params) + [limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(score, kind, pk) for score, kind, pk in cursor.fetchall()]
+
+
+def _rank_in_python(query, lists, limit):
+    inverted_index = InvertedIndex()
+    for kind in INDEXED_MODELS:
+        model = apps.get_model("taskMaster", kind)
+        rows = model.objects.using(lists.db).filter(
+            **{_LIST_LOOKUPS[kind]: lists.values("pk")}).select_related(
+            "owner").only("title", "owner__first_name", "owner__last_name",
+                          "owner__username",
+                          *(["description"] if kind != "Task" else []))
+        for row in rows:
+            inverted_index.add((kind, row.pk), title=row.title,
+                               description=getattr(row, "description", ""),
+                               owner=owner_text(row.owner))
+    return [(score, kind, pk) for score, (kind, pk) in
+            inverted_index.search(query, limit)]
+
+
+class InvertedIndex(object):
+    """
+    A small in-memory BM25 index, the ranking fallback for databases that
+    cant rank on their own. Every field is scored separately and the scores
+    are summed using WEIGHTS, which is what FTS5 does with bm25() weights.
+    Query words prefix-match indexed terms like match_expression does and
+    every word has to match for a document to be returned.
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, weights=WEIGHTS):
+        self.weights = dict(weights)
+        # term -> {document: {field: term frequency}}
+        self.postings = defaultdict(dict)
+        # document -> {field: number of terms}
+        self.lengths = dict()
+        self.total_lengths = defaultdict(int)
+        self._terms = None
+
+    def add(self, document, **fields):
+        self.lengths[document] = dict()
+        for field in self.weights:
+            tokens = tokenize(fields.get(field, ""))
+            self.lengths[document][field] = len(tokens)
+            self.total_lengths[field] += len(tokens)
+            for token in tokens:
+                frequencies = self.postings[token].setdefault(document, {})
+                frequencies[field] = frequencies.get(field, 0) + 1
+        self._terms = None
+
+    def expand(self, prefix):
+        """ All indexed terms starting with prefix. """
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        start = bisect_left(self._terms, prefix)
+        for term in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def search(self, query, limit):
+        """ Returns the best limit (score, document) pairs, best first. Only
+        the top limit are kept, in a heap, rather than sorting every hit. """
+        tokens = set(tokenize(query))
+        count = len(self.lengths)
+        if not tokens or not count:
+            return []
+        average = dict((field, self.total_lengths[field] / count or 1)
+                       for field in self.weights)
+
+        scores = defaultdict(float)
+        matches = defaultdict(int)
+        for token in tokens:
+            frequencies = defaultdict(lambda: defaultdict(int))
+            for term in self.expand(token):
+                for document, fields in self.postings[term].items():
+                    for field, frequency in fields.items():
+                        frequencies[document][field] += frequency
+            df = len(frequencies)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for document, fields in frequencies.items():
+                matches[document] += 1
+                for field, tf in fields.items():
+                    norm = 1 - self.b + self.b * \
+                        self.lengths[document][field] / average[field]
+                    scores[document] += self.weights[field] * idf * \
+                        tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+        hits = ((score, document) for document, score in scores.items()
+                if matches[document] == len(tokens))
+        return heapq.nlargest(limit, hits)
+
+
+def _cache():
+    return caches["search"]
+
+
+def _version_key(user_id):
+    return "search:version:%s" % user_id
+
+
+def _list_version_key(list_id):
+    return "search:listversion:%s" % list_id
+
+
+def _new_version():
+    # Random rather than counted, so a new one can be written without
+    # reading the old one, and a version key that fell out of the cache
+    # never comes back as one some old cached page was stored under.
+    return uuid.uuid4().hex
+
+
+def results_key(user_id, list_ids, uri):
+    """ Cache key of one search response of user_id, who reaches list_ids.
+    It embeds the current versions from the shared cache, so replacing one
+    orphans every result cached before in every process. """
+    keys = [_version_key(user_id)] + \
+        [_list_version_key(list_id) for list_id in sorted(list_ids)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+    digest = hashlib.md5(repr((
+        [versions[key] for key in keys], uri)).encode("utf-8")).hexdigest()
+    return "search:results:%s:%s" % (user_id, digest)
+
+
+def forget_results(user_ids):
+    """ Invalidates the cached searches of every user in user_ids. """
+    cache.set_many(dict((_version_key(user_id), _new_version())
+                        for user_id in user_ids if user_id is not None),
+                   None)
+
+
+def forget_lists(list_ids):
+    """ Invalidates every cached search that could have found something in
+    list_ids, whoever made it. """
+    cache.set_many(dict((_list_version_key(list_id), _new_version())
+                        for list_id in list_ids if list_id is not None),
+                   None)
+
+
+def get_cached_results(key):
+    return _cache().get(key)
+
+
+def set_cached_results(key, data):
+    _cache().set(key, data, getattr(settings, "SEARCH_CACHE_TIMEOUT", 60))
+
+
+def _legacy_filter(model, query):
+    lookup = (Q(owner__first_name__icontains=query) |
+              Q(owner__last_name__icontains=query) |
+              Q(owner__username__icontains=query) |
+              Q(title__icontains=query))
+    if model.__name__ != "Task":
+        lookup |= Q(description__icontains=query)
+    return lookup
+
+
+# Title beats description beats owner name when postgres ranks the matches.
+_PG_DOCUMENT = "setweight(to_tsvector('simple', title), 'A') || " \
+               "setweight(to_tsvector('simple', description), 'B') || " \
+               "setweight(to_tsvector('simple', owner), 'C')"
+
+# kind, the table, its list_id expression, description expression and any
+# extra join needed to reach the list.
+_SOURCES = (
+    ("TaskList", "taskMaster_tasklist", "o.id", "o.description", ""),
+    ("Task", "taskMaster_task", 'o."LinkedTaskList_id"', "''", ""),
+    ("TaskListComment", "taskMaster_tasklistcomment",
+     'o."LinkedTaskList_id"', "o.description", ""),
+    ("TaskComment", "taskMaster_taskcomment", 't."LinkedTaskList_id"',
+     "o.description", 'JOIN "taskMaster_task" t ON t.id = o."LinkedTask_id"'),
+)
+
+
+def install(connection):
+    """ Creates the index table. Returns False when the database cant host
+    one, in which case SearchAPI keeps using the icontains fallback. """
+    table = connection.ops.quote_name(INDEX_TABLE)
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            try:
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE %s USING fts5(kind UNINDEXED, "
+                    "object_id UNINDEXED, list_id UNINDEXED, title, "
+                    "description, owner, tokenize='unicode61')" % table)
+            except Exception:  # This sqlite was compiled without FTS5.
+                return False
+        elif connection.vendor == "postgresql":
+            cursor.execute(
+                "CREATE TABLE %s (kind varchar(20) NOT NULL, object_id "
+                "integer NOT NULL, list_id integer NOT NULL, title text NOT "
+                "NULL, description text NOT NULL, owner text NOT NULL, "
+                "document tsvector, PRIMARY KEY (kind, object_id))" % table)
+            cursor.execute(
+                "CREATE INDEX %s ON %s USING GIN (document)" %
+                (connection.ops.quote_name(INDEX_TABLE + "_document"), table))
+        else:
+            return False
+    _installed.pop(connection.alias, None)
+    return True
+
+
+def uninstall(connection):
+    _installed.pop(connection.alias, None)
+    if connection.vendor in ("sqlite", "postgresql"):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS %s" %
+                           connection.ops.quote_name(INDEX_TABLE))
+
+
+def populate(connection):
+    """ Rebuilds the whole index straight from the model tables in one
+    INSERT ... SELECT per model. """
+    if connection.vendor not in ("sqlite", "postgresql"):
+        return
+    table = connection.ops.quote_name(INDEX_TABLE)
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s" % table)
+        for kind, source, list_id, description, join in _SOURCES:
+            columns = "kind, object_id, list_id, title, description, owner"
+            values = "%%s, o.id, %s, o.title, %s, u.first_name || ' ' || " \
+                     "u.last_name || ' ' || u.username" % (list_id,
+                                                             description)
+            if connection.vendor == "sqlite":
+                columns = "rowid, " + columns
+                values = "o.id * %d + %d, " % (
+                    len(INDEXED_MODELS), INDEXED_MODELS.index(kind)) + values
+            cursor.execute(
+                'INSERT INTO %s (%s) SELECT %s FROM "%s" o %s JOIN auth_user '
+                'u ON u.id = o.owner_id' % (table, columns, values, source,
+                                            join), [kind])
+        if connection.vendor == "postgresql":
+            cursor.execute("UPDATE %s SET document = %s" %
+                           (table, _PG_DOCUMENT))
@@ -1,3 +1,1335 @@
-from django.test import TestCase
+import threading
+import time
+import gzip
+import json
+import os
+import tempfile
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient, APIRequestFactory
+from taskMaster.api import renderers
+from taskMaster import acl, outbox, search, viewcounts
+from taskMaster.api import urls
+from taskMaster.api.membership import Membership
+from taskMaster.api.urlfactory import URLFactory, url_factory
+from taskMaster.management.commands.prune_notifications import \
+    Command as PruneCommand
+from taskMaster.models import TaskList, Task, TaskComment, TaskListComment, \
+    UserListRelation, Notification, NotificationCounter, \
+    NotificationEvent, TitleGram
 
-# Create your tests here.
+
+class APITestCase(TestCase):
+    """ Gives every test a user with a logged in JSON client. The caches are
+    cleared because sqlite hands out the same pks again after a rollback. """
+
+    def setUp(self):
+        cache.clear()
+        caches["search"].clear()
+        self.user = User.objects.create_user("tester", "tester@example.com",
+                                             "password123")
+        self.client = APIClient(HTTP_ACCEPT="application/json")
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        # Writes buffered views while the test database is still there.
+        viewcounts.flush()
+
+    def make_list(self, tasks=0, comments=0, user=None):
+        user = user or self.user
+        task_list = TaskList.objects.create(title="List", description="...",
+                                            owner=user)
+        UserListRelation.objects.create(LinkedTaskList=task_list, user=user,
+                                        owner=user, role="admin")
+        for i in range(tasks):
+            task = Task.objects.create(title="Task %d" % i, owner=user,
+                                       LinkedTaskList=task_list)
+            for j in range(comments):
+                TaskComment.objects.create(title="Comment %d" % j,
+                                           description="...", owner=user,
+                                           LinkedTask=task)
+        for j in range(comments):
+            TaskListComment.objects.create(title="Comment %d" % j,
+                                           description="...", owner=user,
+                                           LinkedTaskList=task_list)
+        return task_list
+
+    def count_queries(self, url, **params):
+        # The ACL is built once per user, not per page, so it is warmed
+        # up first to keep it out of the count.
+        acl.load(self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+class QueryCountTests(APITestCase):
+    """ The serializers read children from prefetched data, so the cost of
+    a page can't depend on how many objects or children are on it. """
+
+    def test_task_list_list_view(self):
+        self.make_list(tasks=1, comments=1)
+        small = self.count_queries("/api/v1.0/TaskMaster/TaskList/")
+        for i in range(3):
+            self.make_list(tasks=4, comments=3)
+        large = self.count_queries("/api/v1.0/TaskMaster/TaskList/")
+        self.assertEqual(small, large)
+
+    def test_task_list_detail_view(self):
+        small = self.make_list(tasks=1, comments=1)
+        large = self.make_list(tasks=6, comments=4)
+        self.assertEqual(
+            self.count_queries("/api/v1.0/TaskMaster/TaskList/%d/" % small.pk),
+            self.count_queries("/api/v1.0/TaskMaster/TaskList/%d/" % large.pk))
+
+    def test_task_list_view(self):
+        self.make_list(tasks=1, comments=1)
+        small = self.count_queries("/api/v1.0/TaskMaster/Task/")
+        self.make_list(tasks=3, comments=4)
+        large = self.count_queries("/api/v1.0/TaskMaster/Task/")
+        self.assertEqual(small, large)
+
+    def test_task_detail_view(self):
+        task_list = self.make_list(tasks=2, comments=5)
+        Task.objects.create(title="Lonely", owner=self.user,
+                            LinkedTaskList=task_list)
+        busy, lonely = Task.objects.filter(LinkedTaskList=task_list) \
+            .order_by("pk")[1:]
+        self.assertEqual(
+            self.count_queries("/api/v1.0/TaskMaster/Task/%d/" % busy.pk),
+            self.count_queries("/api/v1.0/TaskMaster/Task/%d/" % lonely.pk))
+
+
+class TaskListQuerySetTests(APITestCase):
+
+    def test_owned_and_shared_lists_show_up_once(self):
+        other = User.objects.create_user("other", "other@example.com",
+                                         "password123")
+        shared = self.make_list()
+        UserListRelation.objects.create(LinkedTaskList=shared, user=other,
+                                        owner=self.user, role="user")
+        owned = TaskList.objects.create(title="No relation", owner=self.user)
+        theirs = self.make_list(user=other)
+        UserListRelation.objects.create(LinkedTaskList=theirs,
+                                        user=self.user, owner=other,
+                                        role="user")
+        self.make_list(user=other)
+
+        response = self.client.get("/api/v1.0/TaskMaster/TaskList/")
+        self.assertEqual(response.json()["count"], 3)
+        self.assertEqual([item["pk"] for item in response.json()["results"]],
+                         [shared.pk, owned.pk, theirs.pk])
+
+
+class MembershipTests(APITestCase):
+
+    def setUp(self):
+        super(MembershipTests, self).setUp()
+        self.other = User.objects.create_user("other", "other@example.com",
+                                              "password123")
+        self.task_list = self.make_list(user=self.other)
+
+    def test_each_list_costs_one_query(self):
+        UserListRelation.objects.create(LinkedTaskList=self.task_list,
+                                        user=self.user, owner=self.other,
+                                        role="user")
+        acl.load(self.user.pk)
+        resolver = Membership(self.user)
+        # The one query is the read of the cached ACL.
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.resolve(self.task_list), (True, False))
+            self.assertTrue(resolver.is_member(str(self.task_list.pk)))
+            self.assertFalse(resolver.is_admin(self.task_list.pk))
+
+    def test_admin_role_and_owner(self):
+        UserListRelation.objects.create(LinkedTaskList=self.task_list,
+                                        user=self.user, owner=self.other,
+                                        role="Admin")
+        self.assertTrue(Membership(self.user).is_admin(self.task_list.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(Membership(self.other).is_admin(self.task_list))
+
+    def test_strangers_and_missing_lists(self):
+        resolver = Membership(self.user)
+        self.assertEqual(resolver.resolve(self.task_list), (False, False))
+        self.assertEqual(resolver.resolve(0), (False, False))
+        self.assertEqual(resolver.resolve("nope"), (False, False))
+
+    def test_patch_checks_the_relation_once(self):
+        UserListRelation.objects.create(LinkedTaskList=self.task_list,
+                                        user=self.user, owner=self.other,
+                                        role="admin")
+        task = Task.objects.create(title="Task", owner=self.other,
+                                   LinkedTaskList=self.task_list)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                "/api/v1.0/TaskMaster/Task/%d/" % task.pk,
+                {"completed": True}, format="json")
+        self.assertEqual(response.status_code, 200)
+        # Everything after the UPDATE is the save signals, not permissions.
+        checks = []
+        for query in queries.captured_queries:
+            if query["sql"].startswith("UPDATE"):
+                break
+            if "userlistrelation" in query["sql"].lower():
+                checks.append(query)
+        self.assertEqual(len(checks), 1)
+
+
+class ACLTests(APITestCase):
+
+    def setUp(self):
+        super(ACLTests, self).setUp()
+        self.other = User.objects.create_user("other", "other@example.com",
+                                              "password123")
+        self.task_list = self.make_list(user=self.other)
+
+    def test_acl_is_cached_across_requests(self):
+        self.assertNotIn(self.task_list.pk, acl.load(self.user.pk))
+        # Cache reads only, the relation table isnt touched again.
+        with CaptureQueriesContext(connection) as queries:
+            Membership(self.user).resolve(self.task_list.pk)
+            acl.load(self.user.pk)
+        self.assertEqual(len(queries), 2)
+        self.assertFalse([query for query in queries
+                          if "userlistrelation" in query["sql"]])
+
+    def test_per_process_cache_is_refused(self):
+        self.assertEqual(acl.check_shared_cache(None), [])
+        with override_settings(CACHES={"default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.assertEqual([error.id for error in
+                              acl.check_shared_cache(None)],
+                             ["taskMaster.E001"])
+
+    def test_relations_invalidate(self):
+        acl.load(self.user.pk)
+        relation = UserListRelation.objects.create(
+            LinkedTaskList=self.task_list, user=self.user, owner=self.other,
+            role="user")
+        self.assertEqual(acl.load(self.user.pk)[self.task_list.pk],
+                         (True, False))
+        relation.role = "admin"
+        relation.save()
+        self.assertEqual(acl.load(self.user.pk)[self.task_list.pk],
+                         (True, True))
+        relation.delete()
+        self.assertNotIn(self.task_list.pk, acl.load(self.user.pk))
+
+    def test_task_lists_invalidate_on_owner_changes_only(self):
+        acl.load(self.user.pk)
+        task_list = TaskList.objects.get(pk=self.task_list.pk)
+        task_list.views += 1
+        task_list.save()
+        self.assertNotIn(self.task_list.pk, acl.load(self.user.pk))
+        task_list.owner = self.user
+        task_list.save()
+        self.assertEqual(acl.load(self.user.pk)[self.task_list.pk],
+                         (True, True))
+        task_list.delete()
+        self.assertNotIn(self.task_list.pk, acl.load(self.user.pk))
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=3600)
+class ViewCountTests(APITestCase):
+
+    def test_reads_are_buffered_and_flushed_in_one_update(self):
+        task_list = self.make_list(tasks=1)
+        task = task_list.task_set.get()
+        notifications = Notification.objects.count()
+        for views in (1, 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    "/api/v1.0/TaskMaster/TaskList/%d/" % task_list.pk)
+            self.assertEqual(response.json()["views"], views)
+            self.assertFalse([query for query in queries.captured_queries
+                              if not query["sql"].startswith("SELECT")])
+        self.client.get("/api/v1.0/TaskMaster/Task/%d/" % task.pk)
+        self.assertEqual(TaskList.objects.get(pk=task_list.pk).views, 0)
+
+        with self.assertNumQueries(2):
+            viewcounts.flush()
+        self.assertEqual(TaskList.objects.get(pk=task_list.pk).views, 2)
+        self.assertEqual(Task.objects.get(pk=task.pk).views, 1)
+        self.assertEqual(Notification.objects.count(), notifications)
+
+    def test_writes_dont_count(self):
+        task_list = self.make_list()
+        self.client.patch("/api/v1.0/TaskMaster/TaskList/%d/" % task_list.pk,
+                          {"title": "Renamed"}, format="json")
+        self.assertEqual(viewcounts.pending(task_list), 0)
+
+
+class ViewCountTimerTests(TransactionTestCase):
+    """ Needs real commits, the timer flushes from its own thread. """
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=0.2)
+    def test_quiet_processes_flush_too(self):
+        user = User.objects.create_user("tester")
+        task_list = TaskList.objects.create(title="List", owner=user)
+        viewcounts.record(task_list)
+        views = TaskList.objects.filter(pk=task_list.pk) \
+            .values_list("views", flat=True)
+        for i in range(50):
+            if views.get():
+                break
+            time.sleep(0.1)
+        self.assertEqual(views.get(), 1)
+        self.assertEqual(viewcounts.pending(task_list), 0)
+
+
+class FanOutTests(APITestCase):
+
+    def share(self, task_list, members):
+        for i in range(members):
+            user = User.objects.create_user("member%d-%d" %
+                                            (task_list.pk, i))
+            UserListRelation.objects.create(LinkedTaskList=task_list,
+                                            user=user, owner=self.user,
+                                            role="user")
+
+    def save_queries(self, task):
+        with CaptureQueriesContext(connection) as queries:
+            task.save()
+        return len(queries)
+
+    def test_fan_out_cost_doesnt_grow_with_members(self):
+        small, large = self.make_list(tasks=1), self.make_list(tasks=1)
+        self.share(small, 1)
+        self.share(large, 20)
+        small_task, large_task = small.task_set.get(), large.task_set.get()
+        self.assertEqual(self.save_queries(small_task),
+                         self.save_queries(large_task))
+        outbox.process()
+        self.assertEqual(Notification.objects.filter(
+            title__contains="called Task 0",
+            receiver__username__startswith="member").count(), 21)
+
+    def test_unseen_notifications_arent_repeated(self):
+        task_list = self.make_list(tasks=1)
+        self.share(task_list, 3)
+        task = task_list.task_set.get()
+        task.save()
+        outbox.process()
+        count = Notification.objects.count()
+        task.save()
+        outbox.process()
+        self.assertEqual(Notification.objects.count(), count)
+        Notification.objects.filter(receiver__username__endswith="-0") \
+            .update(seen=True)
+        task.save()
+        outbox.process()
+        self.assertEqual(Notification.objects.count(), count + 1)
+
+    def test_saves_only_write_an_event(self):
+        task_list = self.make_list(tasks=1)
+        self.share(task_list, 3)
+        outbox.process()
+        notifications = Notification.objects.count()
+        task = task_list.task_set.get()
+        task.title = "Renamed"
+        task.save()
+        self.assertEqual(Notification.objects.count(), notifications)
+        self.assertEqual(NotificationEvent.objects.count(), 1)
+        self.assertEqual(outbox.process(), 1)
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertEqual(Notification.objects.filter(
+            title__endswith="called Renamed").count(), 4)
+
+    def test_changes_to_one_object_coalesce(self):
+        task_list = self.make_list(tasks=2)
+        self.share(task_list, 2)
+        first, second = task_list.task_set.order_by("pk")
+        for title in ("One", "Two", "Three"):
+            first.title = title
+            first.save()
+        second.save()
+        outbox.process()
+        member = User.objects.get(username__endswith="-0")
+        notifications = Notification.objects.filter(
+            receiver=member, deep_link_url__contains="/Task/")
+        self.assertEqual(notifications.count(), 2)
+        notification = notifications.get(
+            deep_link_url__endswith="/Task/%d/" % first.pk)
+        self.assertEqual(notification.change_count, 4)
+        self.assertEqual(notification.changes, 'Task "Three" was changed')
+
+        notification.seen = True
+        notification.save()
+        first.save()
+        outbox.process()
+        self.assertEqual(notifications.count(), 3)
+
+    def test_abandoned_events_are_delivered_again(self):
+        task_list = self.make_list(tasks=1)
+        self.share(task_list, 2)
+        outbox.process()
+        task_list.task_set.get().save()
+        self.assertEqual(len(outbox.claim()), 1)  # and the worker dies.
+        self.assertEqual(outbox.process(), 0)
+        NotificationEvent.objects.update(
+            claimed_on=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(outbox.process(), 1)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    def test_racing_workers_share_one_unseen_row(self):
+        task_list = self.make_list(tasks=1)
+        task = task_list.task_set.get()
+        outbox.process()
+        Notification.objects.update(seen=True)
+        NotificationCounter.reconcile()
+        insert_unseen = outbox.insert_unseen
+
+        def other_worker_first(rows, bump):
+            # The other worker inserts between the lookup and the insert.
+            Notification.objects.create(title="Other", receiver=self.user,
+                                        dedupe_key=rows[0].dedupe_key)
+            NotificationCounter.add([self.user.pk])
+            return insert_unseen(rows, bump)
+        with mock.patch.object(outbox, "insert_unseen", other_worker_first):
+            task.save()
+            outbox.process()
+        unseen = Notification.objects.filter(receiver=self.user, seen=False)
+        self.assertEqual(unseen.count(), 1)
+        self.assertEqual(unseen.get().change_count, 2)
+        self.assertEqual(NotificationCounter.reconcile(), 0)
+
+    def test_redelivery_counts_once(self):
+        task_list = self.make_list(tasks=1)
+        self.share(task_list, 2)
+        outbox.process()
+        task_list.task_set.get().save()
+        # The worker writes the notifications but its lease runs out before
+        # it deletes the event, so another worker delivers it again.
+        event, = outbox.claim()
+        outbox.deliver(event)
+        Notification.objects.filter(receiver=self.user).update(seen=True)
+        NotificationEvent.objects.update(
+            claimed_on=timezone.now() - timedelta(minutes=5))
+        before = list(Notification.objects.order_by("pk").values_list(
+            "pk", "change_count"))
+        self.assertEqual(outbox.process(), 1)
+        self.assertEqual(list(Notification.objects.order_by("pk")
+                              .values_list("pk", "change_count")), before)
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2)
+    def test_poison_events_are_kept(self):
+        task_list = self.make_list(tasks=1)
+        outbox.process()
+        task_list.task_set.get().save()
+        expired = timezone.now() - timedelta(minutes=5)
+        for attempt in range(2):
+            self.assertEqual(len(outbox.claim()), 1)
+            NotificationEvent.objects.update(claimed_on=expired)
+        self.assertEqual(outbox.claim(), [])
+        self.assertEqual(NotificationEvent.objects.get().attempts, 2)
+
+
+class UnreadCountTests(APITestCase):
+    url = "/api/v1.0/TaskMaster/Notifications/unread_count/"
+
+    def setUp(self):
+        super(UnreadCountTests, self).setUp()
+        self.task_list = self.make_list(tasks=2)
+        outbox.process()
+
+    def unread(self):
+        with self.assertNumQueries(1):
+            return self.client.get(self.url).json()["unread"]
+
+    def test_counter_follows_notifications(self):
+        self.assertEqual(self.unread(), Notification.objects.filter(
+            receiver=self.user, seen=False).count())
+        self.assertEqual(self.unread(), 4)  # relation, list and two tasks
+        for task in self.task_list.task_set.all():
+            task.save()  # Coalesced into the existing rows.
+        outbox.process()
+        self.assertEqual(self.unread(), 4)
+
+        notification = Notification.objects.filter(receiver=self.user)[0]
+        url = "/api/v1.0/TaskMaster/Notifications/%d/" % notification.pk
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(self.unread(), 3)
+
+    def test_reconcile(self):
+        NotificationCounter.objects.filter(user=self.user).update(unread=40)
+        self.assertEqual(NotificationCounter.reconcile(), 1)
+        self.assertEqual(self.unread(), 4)
+        self.assertEqual(NotificationCounter.reconcile([self.user.pk]), 0)
+
+
+class MarkSeenTests(APITestCase):
+    url = "/api/v1.0/TaskMaster/Notifications/seen/"
+
+    def setUp(self):
+        super(MarkSeenTests, self).setUp()
+        self.make_list(tasks=3)
+        outbox.process()
+        self.notifications = Notification.objects.filter(
+            receiver=self.user).order_by("pk")
+
+    def test_marks_ids_with_one_update(self):
+        first, second = self.notifications[:2]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {
+                "ids": [first.pk, second.pk, 0]}, format="json")
+        self.assertEqual(response.json(), {"marked": 2, "unread": 3})
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if query["sql"].startswith("UPDATE") and
+                              "notification\"" in query["sql"]]), 1)
+        self.assertEqual(self.client.post(self.url, {
+            "ids": [first.pk]}, format="json").json()["marked"], 0)
+
+    def test_marks_everything_or_a_range(self):
+        newest = self.notifications.last()
+        response = self.client.post(self.url, {
+            "after": newest.date_created.isoformat()}, format="json")
+        self.assertEqual(response.json()["marked"], 1)
+        response = self.client.post(self.url, {}, format="json")
+        self.assertEqual(response.json(), {"marked": 4, "unread": 0})
+        self.assertEqual(NotificationCounter.reconcile(), 0)
+
+    def test_bodies_that_are_not_objects(self):
+        for body in ([1, 2], "1,2", 7):
+            response = self.client.post(self.url, body, format="json")
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.notifications.filter(seen=True).exists())
+
+    def test_seen_filter(self):
+        self.client.post(self.url, {"ids": [self.notifications[0].pk]},
+                         format="json")
+        response = self.client.get("/api/v1.0/TaskMaster/Notifications/",
+                                   {"seen": "false"})
+        self.assertEqual(response.json()["count"], 4)
+        response = self.client.get("/api/v1.0/TaskMaster/Notifications/",
+                                   {"seen": "true"})
+        self.assertEqual(response.json()["count"], 1)
+
+
+class PruneTests(APITestCase):
+
+    def setUp(self):
+        super(PruneTests, self).setUp()
+        self.make_list(tasks=3)
+        outbox.process()
+        pks = Notification.objects.order_by("pk").values_list("pk",
+                                                              flat=True)
+        Notification.objects.filter(pk__in=list(pks[:3])).update(
+            date_created=timezone.now() - timedelta(days=100))
+        Notification.objects.filter(pk=pks[0]).update(seen=True)
+        NotificationCounter.reconcile()
+
+    def prune(self, **options):
+        call_command("prune_notifications", chunk_size=1, pause=0,
+                     stdout=open(os.devnull, "w"), **options)
+
+    def test_only_old_seen_notifications_go(self):
+        self.prune()
+        self.assertEqual(Notification.objects.count(), 4)
+        self.prune(unseen_days=30)
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(NotificationCounter.unread_for(self.user), 2)
+        self.assertEqual(NotificationCounter.reconcile(), 0)
+
+    def test_seen_between_read_and_delete(self):
+        expired = PruneCommand.expired(90, 30)
+        rows = list(expired.order_by("pk").values())
+        # The user reads one of them before the chunk gets deleted.
+        Notification.objects.filter(pk=rows[1]["id"]).update(seen=True)
+        NotificationCounter.add([self.user.pk], -1)
+        self.assertEqual(PruneCommand.delete(expired, rows), 3)
+        self.assertEqual(NotificationCounter.reconcile(), 0)
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.prune(archive=directory, unseen_days=30)
+            name, = os.listdir(directory)
+            with gzip.open(os.path.join(directory, name), "rt") as archive:
+                rows = [json.loads(line) for line in archive]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]["receiver_id"], self.user.pk)
+        self.assertFalse(Notification.objects.filter(
+            pk__in=[row["id"] for row in rows]).exists())
+
+
+class StreamTests(APITestCase):
+    url = "/api/v1.0/TaskMaster/Notifications/stream/"
+
+    def setUp(self):
+        super(StreamTests, self).setUp()
+        self.task_list = self.make_list(tasks=1)
+        outbox.process()
+        self.latest = Notification.objects.latest("pk")
+
+    def test_returns_what_is_already_there(self):
+        response = self.client.get(self.url, {"since": 0, "timeout": 5})
+        self.assertEqual(len(response.json()["results"]), 3)
+        self.assertEqual(response.json()["since"], self.latest.pk)
+
+    def test_times_out_empty(self):
+        started = time.monotonic()
+        response = self.client.get(self.url, {"timeout": 0.2})
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(response.json(), {"results": [],
+                                           "since": self.latest.pk})
+
+    def test_timestamps_find_coalesced_changes(self):
+        since = self.latest.date_created.isoformat()
+        self.task_list.task_set.get().save()
+        outbox.process()
+        response = self.client.get(self.url, {"since": since,
+                                              "timeout": 0})
+        self.assertEqual([item["change_count"] for item in
+                          response.json()["results"]], [2])
+
+    def test_event_stream(self):
+        response = self.client.get(self.url, {"since": 0, "timeout": 0.1},
+                                   HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode("utf-8")
+        self.assertEqual(body.count("event: notification"), 3)
+        self.assertIn("id: %d\n" % self.latest.pk, body)
+
+    def test_bad_since(self):
+        response = self.client.get(self.url, {"since": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_timeout(self):
+        for timeout in ("soon", "nan", "inf", "-inf"):
+            response = self.client.get(self.url, {"timeout": timeout})
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(NOTIFICATION_STREAM_POLL=30)
+class StreamWakeupTests(TransactionTestCase):
+    """ Needs real commits, the notification comes from another thread. """
+
+    def test_new_notifications_wake_the_request_up(self):
+        user = User.objects.create_user("tester")
+        client = APIClient(HTTP_ACCEPT="application/json")
+        client.force_authenticate(user)
+        task_list = TaskList.objects.create(title="List", owner=user)
+        relation = UserListRelation.objects.create(
+            LinkedTaskList=task_list, user=user, owner=user, role="admin")
+        since = Notification.objects.latest("pk").pk
+
+        def notify():
+            outbox.notify_members(
+                UserListRelation.objects.filter(pk=relation.pk),
+                "Wake up", "TaskList", task_list.pk)
+            connection.close()
+
+        threading.Timer(0.3, notify).start()
+        started = time.monotonic()
+        response = client.get("/api/v1.0/TaskMaster/Notifications/stream/",
+                              {"since": since, "timeout": 10})
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([item["title"] for item in
+                          response.json()["results"]], ["Wake up"])
+
+
+class CursorPaginationTests(APITestCase):
+    url = "/api/v1.0/TaskMaster/Task/"
+
+    def setUp(self):
+        super(CursorPaginationTests, self).setUp()
+        self.make_list(tasks=7)
+        self.newest_first = list(Task.objects.order_by(
+            "-date_created", "-pk").values_list("pk", flat=True))
+
+    def pks(self, response):
+        return [item["pk"] for item in response.json()["results"]]
+
+    def test_walks_both_ways_without_counting(self):
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(self.url, {"pagination": "cursor"})
+        self.assertFalse([query for query in queries.captured_queries
+                          if "COUNT(" in query["sql"]])
+        self.assertNotIn("count", first.json())
+        self.assertEqual(self.pks(first), self.newest_first[:5])
+        self.assertIsNone(first.json()["previous"])
+
+        second = self.client.get(first.json()["next"])
+        self.assertEqual(self.pks(second), self.newest_first[5:])
+        self.assertIsNone(second.json()["next"])
+        back = self.client.get(second.json()["previous"])
+        self.assertEqual(self.pks(back), self.newest_first[:5])
+        self.assertIsNone(back.json()["previous"])
+
+    def test_approximate_count_is_cached(self):
+        params = {"pagination": "cursor", "count": "approx"}
+        self.assertEqual(self.client.get(self.url, params).json()["count"], 7)
+        Task.objects.filter(pk=self.newest_first[0]).delete()
+        self.assertEqual(self.client.get(self.url, params).json()["count"], 7)
+
+    def test_page_numbers_still_work(self):
+        response = self.client.get(self.url, {"page": 2})
+        self.assertEqual(response.json()["count"], 7)
+        self.assertEqual(self.client.get(self.url, {
+            "cursor": "garbage"}).status_code, 404)
+
+
+class SearchTests(APITestCase):
+    search_url = "/api/v1.0/TaskMaster/Search/"
+    suggest_url = "/api/v1.0/TaskMaster/Search/suggest/"
+
+    def setUp(self):
+        super(SearchTests, self).setUp()
+        self.other = User.objects.create_user("other", "other@example.com",
+                                              "password123")
+
+    def share(self, task_list, user, role="guest"):
+        return UserListRelation.objects.create(
+            LinkedTaskList=task_list, user=user, owner=task_list.owner,
+            role=role)
+
+    def link(self, obj):
+        return "http://testserver" + obj.get_api_url()
+
+    def search(self, user, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get(self.search_url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def suggest(self, user, q):
+        self.client.force_authenticate(user)
+        return [item["title"] for item in
+                self.client.get(self.suggest_url, {"q": q}).json()["results"]]
+
+    def test_only_reachable_lists_are_searched(self):
+        mine = self.make_list()
+        theirs = self.make_list(user=self.other)
+        for task_list in (mine, theirs):
+            Task.objects.create(title="Groceries", owner=task_list.owner,
+                                LinkedTaskList=task_list)
+        data = self.search(self.user, q="grocer").json()
+        self.assertEqual(data["Task"], [
+            self.link(task) for task in mine.task_set.all()])
+        # The owner names are indexed too, but only his own rows match.
+        self.assertEqual(self.search(self.user, q="other").json()["TaskList"],
+                         [])
+        self.assertEqual(self.search(self.other, q="other").json()["TaskList"],
+                         [self.link(theirs)])
+
+    def test_pager_links_walk_ties_both_ways(self):
+        task_list = self.make_list()
+        task_list.title = "Item list"
+        task_list.save()
+        TaskList.objects.filter(pk=task_list.pk).update(views=2)
+        for i, views in enumerate((2, 2, 2, 1, 1, 0, 0)):
+            task = Task.objects.create(title="Item %d" % i, owner=self.user,
+                                       LinkedTaskList=task_list)
+            Task.objects.filter(pk=task.pk).update(views=views)
+
+        def items(data):
+            return sorted(url for urls in data["results"].values()
+                          for url in urls)
+
+        first = self.search(self.user, q="item", order="-views",
+                            page=1).json()
+        self.assertEqual(first["count"], 8)
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"]).json()
+        self.assertIsNone(second["next"])
+        self.assertEqual(len(items(first)), 5)
+        self.assertEqual(len(items(second)), 3)
+        self.assertFalse(set(items(first)) & set(items(second)))
+        # The views 2 tie between the list and three tasks is broken the
+        # same way on every page, so going back lands on the same page.
+        self.assertIn(self.link(task_list), items(first))
+        self.assertEqual(items(self.client.get(second["previous"]).json()),
+                         items(first))
+
+    def test_forged_cursors_are_invalid(self):
+        task_list = self.make_list()
+        task_list.title = "Item list"
+        task_list.save()
+        for order, position in (("views", ["x", 0, 1]),
+                                ("date", ["yesterday", 0, 1]),
+                                ("date", [7, 0, 1])):
+            cursor = urlsafe_b64encode(json.dumps(
+                {"p": position}).encode("ascii")).decode("ascii")
+            response = self.client.get(self.search_url, {
+                "q": "item", "order": order, "cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json()["detail"], "Invalid cursor")
+
+    def test_relevance_puts_title_hits_first(self):
+        described = TaskList.objects.create(
+            title="Weekend", description="alpha and more alpha",
+            owner=self.user)
+        titled = TaskList.objects.create(title="Alpha", description="...",
+                                         owner=self.user)
+        TaskList.objects.create(title="Beta", description="...",
+                                owner=self.user)
+        data = self.search(self.user, q="alpha", order="relevance").json()
+        self.assertEqual(data["results"]["TaskList"],
+                         [self.link(titled), self.link(described)])
+
+        lists = TaskList.reachable_by(self.user)
+        for ranker in (search.rank, search._rank_in_python):
+            hits = ranker("alpha", lists, 1)
+            self.assertEqual([(kind, pk) for score, kind, pk in hits],
+                             [("TaskList", titled.pk)])
+
+    def test_suggest_only_reaches_the_users_lists(self):
+        TaskList.objects.create(title="Gardening", description="...",
+                                owner=self.user)
+        theirs = TaskList.objects.create(title="Groceries", description="...",
+                                         owner=self.other)
+        Task.objects.create(title="Get gloves", owner=self.other,
+                            LinkedTaskList=theirs)
+        self.assertEqual(self.suggest(self.user, "g"), ["Gardening"])
+        self.share(theirs, self.user)
+        self.assertEqual(sorted(self.suggest(self.user, "g")),
+                         ["Gardening", "Get gloves", "Groceries"])
+        self.assertEqual(self.suggest(self.other, "gard"), [])
+
+    def test_results_cache_and_invalidation(self):
+        theirs = TaskList.objects.create(title="Groceries", description="...",
+                                         owner=self.other)
+        relation = self.share(theirs, self.user)
+        first = self.search(self.user, q="grocer")
+        self.assertEqual(first["X-Search-Cache"], "miss")
+        again = self.search(self.user, q="grocer")
+        self.assertEqual(again["X-Search-Cache"], "hit")
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(self.search(self.user, q="grocer", order="-date")
+                         ["X-Search-Cache"], "miss")
+        theirs.title = "Groceries!"
+        theirs.save()
+        self.assertEqual(self.search(self.user, q="grocer")
+                         ["X-Search-Cache"], "miss")
+        # The versions are in the shared cache, so a list saved by another
+        # worker, which writes a new version there, orphans this copy too.
+        self.assertEqual(self.search(self.user, q="grocer")
+                         ["X-Search-Cache"], "hit")
+        cache.set("search:listversion:%d" % theirs.pk, "elsewhere", None)
+        self.assertEqual(self.search(self.user, q="grocer")
+                         ["X-Search-Cache"], "miss")
+
+        relation.delete()
+        after = self.search(self.user, q="grocer")
+        self.assertEqual(after["X-Search-Cache"], "miss")
+        self.assertEqual(after.json()["TaskList"], [])
+
+    def test_moved_task_takes_its_comments_along(self):
+        shared, private = self.make_list(), self.make_list()
+        self.share(shared, self.other)
+        task = Task.objects.create(title="Plan", owner=self.user,
+                                   LinkedTaskList=shared)
+        TaskComment.objects.create(title="Secret", description="...",
+                                   owner=self.user, LinkedTask=task)
+        self.assertEqual(self.suggest(self.other, "secr"), ["Secret"])
+        self.assertEqual(len(self.search(self.other, q="secret")
+                             .json()["TaskComment"]), 1)
+
+        self.client.force_authenticate(self.user)
+        self.client.patch(task.get_api_url(),
+                          {"LinkedTaskList": private.pk}, format="json")
+        self.assertEqual(self.suggest(self.other, "secr"), [])
+        self.assertEqual(self.search(self.other, q="secret")
+                         .json()["TaskComment"], [])
+        self.assertEqual(self.search(self.other, q="secret",
+                                     order="relevance").json()["results"],
+                         {})
+        self.assertEqual(self.suggest(self.user, "secr"), ["Secret"])
+
+
+class URLFactoryTests(TestCase):
+
+    def test_matches_reverse_for_every_route(self):
+        names = ["taskMaster-api:" + pattern.name
+                 for pattern in urls.urlpatterns
+                 if "pk" in pattern.pattern.regex.groupindex]
+        self.assertEqual(len(names), 6)
+        request = Request(APIRequestFactory().get("/", secure=True))
+        for current in (request, None):
+            factory = URLFactory(current)
+            for name in names:
+                for pk in (1, 42, 987654321):
+                    self.assertEqual(
+                        factory.build(name, pk),
+                        reverse(name, kwargs={"pk": pk}, request=current))
+        self.assertIs(url_factory(request), url_factory(request))
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        super(ConditionalGetTests, self).setUp()
+        self.task_list = self.make_list(tasks=2, comments=2)
+        self.url = "/api/v1.0/TaskMaster/TaskList/%d/" % self.task_list.pk
+
+    def test_detail_304_skips_the_children(self):
+        etag = self.client.get(self.url)["ETag"]
+        acl.load(self.user.pk)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        self.assertNotEqual(
+            self.client.get(self.url, {"fields": "pk"})["ETag"], etag)
+        Task.objects.filter(LinkedTaskList=self.task_list).first().delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["tasksUrl"]), 1)
+
+    def test_weak_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag[2:])
+                         .status_code, 304)
+
+    def test_own_edits_move_last_modified(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        for model in (TaskList, Task, TaskListComment):
+            model.objects.update(date_created=yesterday)
+        last_modified = self.client.get(self.url)["Last-Modified"]
+        self.client.patch(self.url, {"title": "Renamed"}, format="json")
+        self.assertEqual(self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+        comment = TaskListComment.objects.first()
+        self.assertIn("Last-Modified", self.client.get(
+            "/api/v1.0/TaskMaster/TaskListComment/%d/" % comment.pk))
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get(self.url)["Last-Modified"]
+        response = self.client.get(self.url,
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE="Mon, 01 Jan 2018 00:00:00 GMT")
+        self.assertEqual(response.status_code, 200)
+
+    def test_deletes_move_last_modified(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        for model in (TaskList, Task, TaskComment, TaskListComment):
+            model.objects.update(date_created=yesterday)
+        urls = (self.url, "/api/v1.0/TaskMaster/Task/")
+        since = [self.client.get(url)["Last-Modified"] for url in urls]
+        for url, last_modified in zip(urls, since):
+            self.assertEqual(self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.task_list.task_set.first().delete()
+        for url, last_modified in zip(urls, since):
+            self.assertEqual(self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+        # Nothing records deleted notifications, so only the ETag counts.
+        self.assertNotIn("Last-Modified", self.client.get(
+            "/api/v1.0/TaskMaster/Notifications/"))
+
+    def test_collection_etag(self):
+        url = "/api/v1.0/TaskMaster/Task/"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                         .status_code, 304)
+        Task.objects.create(title="New", owner=self.user,
+                            LinkedTaskList=self.task_list)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 3)
+
+    def test_children_are_not_joined(self):
+        url = "/api/v1.0/TaskMaster/TaskList/"
+        etag = self.client.get(url)["ETag"]
+        acl.load(self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(
+                url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        aggregate, = [query["sql"] for query in queries.captured_queries
+                      if "tasklist" in query["sql"]]
+        self.assertNotIn('JOIN "taskMaster_task"', aggregate)
+        self.assertNotIn('JOIN "taskMaster_tasklistcomment"', aggregate)
+        TaskListComment.objects.create(
+            title="New", description="...", owner=self.user,
+            LinkedTaskList=self.task_list)
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_notification_etag_follows_the_flipped_row(self):
+        outbox.process()
+        notification = Notification.objects.filter(receiver=self.user)[0]
+        url = "/api/v1.0/TaskMaster/Notifications/%d/" % notification.pk
+        # The first GET marks it seen, the tag is for what got sent back.
+        first = self.client.get(url)
+        self.assertTrue(first.json()["seen"])
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+        Notification.objects.filter(pk=notification.pk).update(
+            change_count=F("change_count") + 1)
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 200)
+
+
+class SyncTests(APITestCase):
+    url = "/api/v1.0/TaskMaster/Sync/"
+
+    def sync(self, cursor=None, user=None, **params):
+        if cursor is not None:
+            params["cursor"] = cursor
+        if user is not None:
+            self.client.force_authenticate(user)
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def pks(self, data, kind):
+        return [row["pk"] for row in data["upserts"].get(kind, [])]
+
+    def test_resync_after_one_edit_is_one_row(self):
+        task_list = self.make_list(tasks=3, comments=2)
+        data = self.sync()
+        self.assertEqual(self.pks(data, "TaskList"), [task_list.pk])
+        self.assertEqual(len(self.pks(data, "Task")), 3)
+        self.assertEqual(len(self.pks(data, "TaskComment")), 6)
+        self.assertEqual(self.sync(data["cursor"])["upserts"], {})
+
+        task = Task.objects.filter(LinkedTaskList=task_list).first()
+        task.title = "Edited"
+        task.save()
+        changes = self.sync(data["cursor"])
+        self.assertEqual(self.pks(changes, "Task"), [task.pk])
+        self.assertEqual(list(changes["upserts"]), ["Task"])
+        self.assertEqual(changes["upserts"]["Task"][0]["title"], "Edited")
+        self.assertEqual(changes["deletes"], [])
+        self.assertIsNone(changes["next"])
+
+    def test_shared_lists_ask_for_a_resync(self):
+        other = User.objects.create_user("other")
+        theirs = self.make_list(tasks=2, user=other)
+        self.make_list()
+        cursor = self.sync()["cursor"]
+        self.assertEqual(self.sync()["resync"], [])
+        UserListRelation.objects.create(LinkedTaskList=theirs, user=self.user,
+                                        owner=other, role="user")
+        changes = self.sync(cursor)
+        self.assertEqual(changes["resync"], [theirs.pk])
+        self.assertNotIn("Task", changes["upserts"])
+        self.assertEqual(len(self.pks(self.sync(list=theirs.pk), "Task")), 2)
+        self.assertEqual(self.sync(changes["cursor"])["resync"], [])
+
+    def test_forged_cursor(self):
+        self.make_list(tasks=1)
+        for position in (["yesterday", 0, 1], [None, 0, 1], ["x"]):
+            cursor = urlsafe_b64encode(json.dumps(
+                {"p": position}).encode("ascii")).decode("ascii")
+            response = self.client.get(self.url, {"cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_small_pages_walk_everything_once(self):
+        self.make_list(tasks=2, comments=1)
+        self.make_list(tasks=1)
+        seen, cursor, pages = [], None, 0
+        while True:
+            data = self.sync(cursor, limit=3)
+            pages += 1
+            for kind, rows in data["upserts"].items():
+                seen.extend((kind, row["pk"]) for row in rows)
+            cursor = data["cursor"]
+            if data["next"] is None:
+                break
+        self.assertEqual(len(seen), len(set(seen)))
+        # 2 lists, 2 relations, 3 tasks, 2 task and 1 list comment.
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(pages, 4)
+
+    def test_deletes_and_lost_lists(self):
+        task_list = self.make_list(tasks=2)
+        other = User.objects.create_user("other", "other@example.com",
+                                         "password123")
+        relation = UserListRelation.objects.create(
+            LinkedTaskList=task_list, user=other, owner=self.user)
+        cursor = self.sync()["cursor"]
+        other_cursor = self.sync(user=other)["cursor"]
+        self.assertEqual(self.sync(other_cursor)["upserts"], {})
+
+        task = Task.objects.filter(LinkedTaskList=task_list).first()
+        task_pk, relation_pk = task.pk, relation.pk
+        task.delete()
+        relation.delete()
+        self.assertEqual(self.sync(other_cursor)["deletes"],
+                         [{"type": "TaskList", "pk": task_list.pk}])
+        # The owner still has the list, he only loses the task and relation.
+        self.assertEqual(self.sync(cursor, user=self.user)["deletes"],
+                         [{"type": "Task", "pk": task_pk},
+                          {"type": "UserListRelation", "pk": relation_pk}])
+
+        list_pk = task_list.pk
+        task_list.delete()
+        self.assertIn({"type": "TaskList", "pk": list_pk},
+                      self.sync(cursor)["deletes"])
+
+    def test_moves(self):
+        source = self.make_list(tasks=2, comments=1)
+        target = self.make_list()
+        guest, newcomer = [User.objects.create_user(name) for name in
+                           ("guest", "newcomer")]
+        UserListRelation.objects.create(LinkedTaskList=source, user=guest,
+                                        owner=self.user)
+        UserListRelation.objects.create(LinkedTaskList=target, user=newcomer,
+                                        owner=self.user)
+        cursors = dict((user, self.sync(user=user)["cursor"])
+                       for user in (self.user, guest, newcomer))
+        first, second = Task.objects.filter(LinkedTaskList=source)
+        first_comment = first.taskcomment_set.get()
+
+        self.client.force_authenticate(self.user)
+        self.client.patch(first.get_api_url(), {"LinkedTaskList": target.pk},
+                          format="json")
+        self.client.patch("/api/v1.0/TaskMaster/Task/",
+                          {"ids": [second.pk],
+                           "set": {"LinkedTaskList": target.pk}},
+                          format="json")
+
+        gone = self.sync(cursors[guest], user=guest)
+        self.assertEqual(gone["upserts"], {})
+        self.assertEqual(sorted((item["type"], item["pk"])
+                                for item in gone["deletes"]),
+                         sorted([("Task", first.pk), ("Task", second.pk),
+                                 ("TaskComment", first_comment.pk),
+                                 ("TaskComment", second.taskcomment_set
+                                  .get().pk)]))
+        for user in (newcomer, self.user):
+            arrived = self.sync(cursors[user], user=user)
+            self.assertEqual(sorted(self.pks(arrived, "Task")),
+                             sorted([first.pk, second.pk]))
+            self.assertEqual(len(self.pks(arrived, "TaskComment")), 2)
+            self.assertEqual(arrived["deletes"], [])
+
+    def test_one_list_from_scratch(self):
+        self.make_list(tasks=2)
+        shared = self.make_list(tasks=1)
+        data = self.sync(list=shared.pk)
+        self.assertEqual(self.pks(data, "TaskList"), [shared.pk])
+        self.assertEqual(len(self.pks(data, "Task")), 1)
+        self.assertEqual(self.client.get(self.url, {"limit": "x"})
+                         .status_code, 400)
+
+
+class BulkTaskCreateTests(APITestCase):
+    url = "/api/v1.0/TaskMaster/Task/"
+
+    def post_tasks(self, count, *task_lists):
+        return self.client.post(self.url, [
+            {"title": "Item %d" % i,
+             "LinkedTaskList": task_lists[i % len(task_lists)].pk}
+            for i in range(count)], format="json")
+
+    def test_one_insert_and_one_event_per_list(self):
+        first, second = self.make_list(), self.make_list()
+        NotificationEvent.objects.all().delete()
+        acl.load(self.user.pk)
+        with CaptureQueriesContext(connection) as small:
+            self.post_tasks(4, first, second)
+        with CaptureQueriesContext(connection) as large:
+            response = self.post_tasks(20, first, second)
+        self.assertEqual(len(small), len(large))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()), 20)
+        self.assertEqual([item["pk"] for item in response.json()],
+                         list(Task.objects.filter(title__startswith="Item")
+                              .order_by("pk").values_list("pk", flat=True))
+                         [4:])
+        self.assertEqual(Task.objects.filter(LinkedTaskList=first).count(),
+                         12)
+        self.assertEqual(NotificationEvent.objects.filter(
+            LinkedTaskList=first).count(), 2)
+        suggestions = self.client.get("/api/v1.0/TaskMaster/Search/suggest/",
+                                      {"q": "item", "limit": 50}).json()
+        self.assertEqual(len(suggestions["results"]), 24)
+
+    def test_all_or_nothing(self):
+        mine = self.make_list()
+        theirs = self.make_list(user=User.objects.create_user(
+            "other", "other@example.com", "password123"))
+        self.assertEqual(self.post_tasks(4, mine, theirs).status_code, 401)
+        response = self.client.post(self.url, [
+            {"title": "Fine", "LinkedTaskList": mine.pk},
+            {"title": "x" * 100, "LinkedTaskList": mine.pk}], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertEqual(self.client.post(self.url, [], format="json")
+                         .status_code, 400)
+        self.assertFalse(Task.objects.exists())
+
+    def test_other_endpoints_refuse_arrays(self):
+        task_list = self.make_list(tasks=1)
+        task = task_list.task_set.get()
+        for url, data in (("UserListRelation", {"LinkedTaskList":
+                                                task_list.pk}),
+                          ("TaskListComment", {"LinkedTaskList":
+                                               task_list.pk}),
+                          ("TaskComment", {"LinkedTask": task.pk})):
+            self.assertEqual(self.client.post(
+                "/api/v1.0/TaskMaster/%s/" % url, [data], format="json")
+                .status_code, 400)
+
+
+class BulkTaskUpdateTests(APITestCase):
+    url = "/api/v1.0/TaskMaster/Task/"
+
+    def patch(self, **data):
+        return self.client.patch(self.url, data, format="json")
+
+    def foreign_list(self, tasks=1):
+        # A list of somebody else where the user is only a guest.
+        other = User.objects.create_user("other", "other@example.com",
+                                         "password123")
+        task_list = self.make_list(tasks=tasks, user=other)
+        UserListRelation.objects.create(LinkedTaskList=task_list,
+                                        user=self.user, owner=other)
+        return task_list
+
+    def test_mark_all_done_costs_the_same_for_more_tasks(self):
+        small, large = self.make_list(tasks=2), self.make_list(tasks=12)
+        NotificationEvent.objects.all().delete()
+        cursor = self.client.get("/api/v1.0/TaskMaster/Sync/").json()["cursor"]
+        acl.load(self.user.pk)
+        counts = []
+        for task_list in (small, large):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.patch(filter={"LinkedTaskList": task_list.pk},
+                                      set={"completed": True})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(response.json()["updated"], 12)
+        self.assertFalse(Task.objects.filter(completed=False).exists())
+        self.assertEqual(NotificationEvent.objects.count(), 2)
+        # date_created moved, so the change feed has them.
+        sync = self.client.get("/api/v1.0/TaskMaster/Sync/",
+                               {"cursor": cursor, "limit": 50}).json()
+        self.assertEqual(len(sync["upserts"]["Task"]), 14)
+
+    def test_per_id_outcomes(self):
+        mine = Task.objects.filter(LinkedTaskList=self.make_list(tasks=1))[0]
+        guest = Task.objects.filter(LinkedTaskList=self.foreign_list())[0]
+        response = self.patch(ids=[mine.pk, guest.pk, 999999],
+                              set={"title": "Renamed"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [
+            {"pk": mine.pk, "status": "updated"},
+            {"pk": guest.pk, "status": "forbidden"},
+            {"pk": 999999, "status": "not_found"}])
+        self.assertEqual(Task.objects.get(pk=guest.pk).title, "Task 0")
+        suggestions = self.client.get("/api/v1.0/TaskMaster/Search/suggest/",
+                                      {"q": "renam"}).json()["results"]
+        self.assertEqual([item["title"] for item in suggestions],
+                         ["Renamed"])
+
+    def test_move(self):
+        source = self.make_list(tasks=2, comments=1)
+        target = self.make_list()
+        ids = list(Task.objects.values_list("pk", flat=True))
+        self.assertEqual(self.patch(ids=ids, set={
+            "LinkedTaskList": self.foreign_list(tasks=0).pk}).status_code,
+            401)
+        response = self.patch(ids=ids, set={"LinkedTaskList": target.pk})
+        self.assertEqual(response.json()["updated"], 2)
+        self.assertFalse(Task.objects.filter(LinkedTaskList=source).exists())
+        self.assertEqual(set(TitleGram.objects.filter(kind="TaskComment")
+                             .values_list("LinkedTaskList", flat=True)),
+                         {target.pk})
+        self.assertEqual(NotificationEvent.objects.filter(
+            LinkedTaskList=target).count(), 2)
+
+    def test_invalid(self):
+        self.make_list(tasks=1)
+        self.assertEqual(self.patch(ids=[1], filter={"completed": False},
+                                    set={"completed": True}).status_code,
+                         400)
+        self.assertEqual(self.patch(ids=[1], set={"owner": 2}).status_code,
+                         400)
+        self.assertEqual(self.patch(ids=["x"], set={"completed": True})
+                         .status_code, 400)
+        self.assertEqual(self.patch(ids="12", set={"completed": True})
+                         .status_code, 400)
+        self.assertFalse(Task.objects.filter(completed=True).exists())
+        self.assertEqual(self.patch(ids=[1], set={"title": "x" * 100})
+                         .status_code, 400)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.patch(ids=list(range(1, 100001)),
+                                        set={"completed": True})
+                             .status_code, 400)
+        self.assertFalse([query for query in queries.captured_queries
+                          if "taskMaster_task" in query["sql"]])
+
+
+class SparseFieldsTests(APITestCase):
+
+    def test_fields_picks_the_response_fields(self):
+        task_list = self.make_list(tasks=2)
+        response = self.client.get(
+            "/api/v1.0/TaskMaster/TaskList/%d/" % task_list.pk,
+            {"fields": "pk,title"})
+        self.assertEqual(response.json(), {"pk": task_list.pk,
+                                           "title": "List"})
+
+    def test_omit_drops_fields(self):
+        task_list = self.make_list(tasks=2)
+        response = self.client.get(
+            "/api/v1.0/TaskMaster/TaskList/%d/" % task_list.pk,
+            {"omit": "tasks,tasksUrl"})
+        self.assertNotIn("tasks", response.json())
+        self.assertIn("comments", response.json())
+
+    def test_narrow_request_skips_the_prefetches(self):
+        for i in range(3):
+            self.make_list(tasks=3, comments=2)
+        # The page itself is one query and nothing is prefetched. Around it
+        # are the read of the ACL from the shared cache and the ETag
+        # aggregate, which also hands the paginator its count.
+        acl.load(self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/v1.0/TaskMaster/TaskList/",
+                            {"fields": "pk,title"})
+        cache_read, aggregate, page = [query["sql"] for query in queries]
+        self.assertIn("taskmaster_cache", cache_read)
+        self.assertIn("COUNT(", aggregate)
+        self.assertNotIn('"taskMaster_task"', page)
+        self.assertNotIn('"taskMaster_tasklistcomment"', page)
+        self.assertEqual(
+            self.count_queries("/api/v1.0/TaskMaster/TaskList/%d/" %
+                               TaskList.objects.first().pk,
+                               fields="pk,title"), 1)
+
+
+class RendererTests(APITestCase):
+
+    def test_fast_json_matches_json_renderer(self):
+        task_list = self.make_list(tasks=2, comments=1)
+        data = self.client.get("/api/v1.0/TaskMaster/TaskList/%d/" %
+                               task_list.pk).data
+        data["note"] = "line\u2028separator"
+        self.assertEqual(renderers.FastJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+
+    @skipUnless(renderers.msgpack, "msgpack isnt installed")
+    def test_msgpack_round_trip(self):
+        task_list = self.make_list(tasks=2)
+        # views is left out since it goes up with every read.
+        url = "/api/v1.0/TaskMaster/TaskList/%d/?omit=views" % task_list.pk
+        response = self.client.get(url, HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(renderers.msgpack.unpackb(response.content,
+                                                   raw=False),
+                         self.client.get(url).json())
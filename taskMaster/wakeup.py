@@ -0,0 +1,44 @@
+""" This is wakeup.py and it lets a request sleep until somebody has news
+for a user. Notifications/stream/ holds a connection open while nothing is
+new, and instead of querying in a loop it waits here until notify() is
+called for its user after a commit that gave him notifications.
+
+It only reaches threads of the same process, the Condition lives in its
+memory. Notifications written by another gunicorn worker or by manage.py
+notification_worker (where most of them are written) dont wake anybody up
+here, so waiters also wake up every NOTIFICATION_STREAM_POLL seconds and
+look for themselves. A waiter holds a thread, not a whole worker, since the
+web process runs gthread workers (see the Procfile). """
+import threading
+import time
+from collections import defaultdict
+
+_condition = threading.Condition()
+_generations = defaultdict(int)  # user id -> times he was notified
+
+
+def generation(user_id):
+    """ Take this before querying, then wait() on it so a notify() that
+    lands between the query and the wait isnt missed. """
+    with _condition:
+        return _generations[user_id]
+
+
+def notify(user_ids):
+    with _condition:
+        for user_id in user_ids:
+            _generations[user_id] += 1
+        _condition.notify_all()
+
+
+def wait(user_id, seen, timeout):
+    """ Blocks until user_id is notified after generation seen or timeout
+    seconds pass. Returns True when it was woken up. """
+    deadline = time.monotonic() + timeout
+    with _condition:
+        while _generations[user_id] == seen:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _condition.wait(remaining)
+        return True